@@ -57,6 +57,7 @@ Requires:   koji-containerbuild
 Requires:   osbs-client >= 2.0.0
 Requires:   python3-dockerfile-parse
 Requires:   python3-jsonschema
+Requires:   python3-requests
 Requires:   python3-six
 
 
@@ -24,38 +24,49 @@ containers."""
 #       Pavol Babincak <pbabinca@redhat.com>
 from __future__ import absolute_import
 
+import collections
+import concurrent.futures
+import contextlib
+import ctypes
+import ctypes.util
+import fcntl
+import functools
+import hashlib
+import io
+import json
 import os
 import os.path
+import re
+import select
+import struct
 import sys
+import tempfile
 import logging
 import time
 import traceback
 import signal
 import shutil
-from distutils.version import LooseVersion
-
-import dockerfile_parse
-import jsonschema
+import socket
+import threading
+import zlib
 
 # this is present because in some versions of koji, callback functions assume koji.plugin is
 # imported
 import koji.plugin
 import koji
-from koji.daemon import SCM, incremental_upload
+from koji.daemon import SCM, incremental_upload, log_output
 from koji.tasks import BaseTaskHandler
+from koji.util import base64encode
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
 
-import osbs
-from osbs.api import OSBS
-from osbs.conf import Configuration
-from osbs.exceptions import OsbsValidationException
-from osbs.utils import UserWarningsStore
+# osbs-client, jsonschema and dockerfile_parse are imported when a container
+# task needs them, kojid loads this plugin also on builders serving other
+# channels and imports are paid by every kojid start
 
-OSBS_VERSION = osbs.__version__
 OSBS_FLATPAK_SUPPORT_VERSION = '0.43'  # based on OSBS 2536f24 released on osbs-0.43
-if LooseVersion(OSBS_VERSION) < LooseVersion(OSBS_FLATPAK_SUPPORT_VERSION):
-    osbs_flatpak_support = False
-else:
-    osbs_flatpak_support = True
 
 
 # List of LABEL identifiers used within Koji. Values doesn't need to correspond
@@ -91,18 +102,136 @@ LABEL_NAME_MAP = {
 
 
 METADATA_TAG = "platform:_metadata_"
+# ioctl making a file share data of another file, on filesystems with reflinks
+FICLONE = getattr(fcntl, 'FICLONE', 0x40049409)
+# user warnings are logged by atomic-reactor with this level name, only lines
+# containing it can be user warnings matched by UserWarningsStore
+USER_WARNING_MARK = ' - USER_WARNING - '
 
 DEFAULT_CONF_BINARY_SECTION = "default_binary"
 DEFAULT_CONF_SOURCE_SECTION = "default_source"
 
+# files of the sources needed for checking labels before the build
+LABELS_CHECKOUT_FILES = ('Dockerfile', 'additional-tags')
+# default size limit of the labels cache in bytes
+LABELS_CACHE_SIZE = 10 * 1024 * 1024
+# only builds of commits are cached, branches move
+GIT_COMMIT_RE = re.compile(r'^[0-9a-f]{40}$')
+
 REMOTE_SOURCES_LOGNAME = 'remote-sources'
 REMOTE_SOURCES_TASKNAME = 'binary-container-hermeto'
 
+# new log data are uploaded once there are this many bytes of them or when
+# they are this many seconds old
+LOG_UPLOAD_COALESCE_SIZE = 256 * 1024
+LOG_UPLOAD_COALESCE_AGE = 1
+# log data are uploaded in chunks of this many bytes, as incremental_upload()
+# does, and at most this many bytes of chunks are sent in one multicall
+LOG_UPLOAD_CHUNK_SIZE = 64 * 1024
+LOG_UPLOAD_BATCH_SIZE = 1024 * 1024
+# number of threads uploading logs, each with its own hub session
+LOG_UPLOAD_WORKERS = 1
+# minimal number of seconds between two log upload passes
+LOG_UPLOAD_INTERVAL = 1
+# the interval doubles while logs are quiet, up to this number of seconds
+LOG_UPLOAD_MAX_INTERVAL = 30
+# when exit of the build process can't be waited for, maximal number of
+# seconds between checks whether it is still running
+LOG_WATCH_TIMEOUT = 5
+
+# optional configuration of the builder plugin
+CONFIG_FILE = '/etc/kojid/plugins/builder_containerbuild.conf'
+
+# record header of the log stream between the build process and the task
+# process: record kind, length of the log name, length of the data
+LOG_STREAM_HEADER = struct.Struct('!cHI')
+LOG_STREAM_DATA = b'L'
+# user warning found in the build log, data is its message
+LOG_STREAM_USER_WARNING = b'W'
+# requested capacity of the log streaming pipe
+LOG_STREAM_PIPE_SIZE = 1024 * 1024
+
+# compression of uploaded logs: none, <name>.log.gz uploaded in chunks while
+# the build runs, or the final log uploaded as <name>.log.gz after the build,
+# with compression only a tail of <name>.log is kept on the hub for the
+# browse view
+LOG_COMPRESSION_MODES = ('none', 'chunks', 'final')
+LOG_COMPRESSION_LEVEL = 6
+# size limit of the tail of a compressed log uploaded as <name>.log
+LOG_COMPRESSION_TAIL = 64 * 1024
+
+# build logs are written in batches of this many bytes, buffered data are
+# written at the latest after LOG_BUFFER_AGE seconds
+LOG_BUFFER_SIZE = 64 * 1024
+LOG_BUFFER_AGE = 1
+
+# number of pooled HTTP connections kept open to the OpenShift API
+HTTP_POOL_SIZE = 10
+
+# metrics exported for the node-exporter textfile collector: name without
+# METRICS_PREFIX -> (type, help)
+METRICS_PREFIX = 'koji_containerbuild_'
+METRICS = {
+    'tasks_in_flight': ('gauge', 'Container tasks running on the builder'),
+    'phase_seconds': ('histogram', 'Wall time of phases of container tasks'),
+    'log_lines_total': ('counter', 'Build log lines processed'),
+    'log_bytes_total': ('counter', 'Build log bytes written'),
+    'log_upload_retries_total': ('counter', 'Failed log chunks uploaded once more'),
+    'osbs_requests_total': ('counter', 'HTTP requests sent to the OpenShift API'),
+}
+METRICS_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600, 7200)
+
+_plugin_config = None
+_osbs_flatpak_support = None
+_pipeline_run_snapshot_class = None
+
 
 def _concat(iterables):
     return [x for iterable in iterables for x in iterable]
 
 
+def read_plugin_config():
+    """Returns parsed plugin configuration, empty if CONFIG_FILE doesn't exist"""
+    global _plugin_config  # pylint: disable=global-statement
+    if _plugin_config is None:
+        _plugin_config = koji.read_config_files([(CONFIG_FILE, False)])
+    return _plugin_config
+
+
+def osbs_flatpak_support():
+    """Whether installed osbs-client supports Flatpak builds"""
+    global _osbs_flatpak_support  # pylint: disable=global-statement
+    if _osbs_flatpak_support is None:
+        from distutils.version import LooseVersion
+        import osbs
+        _osbs_flatpak_support = (LooseVersion(osbs.__version__) >=
+                                 LooseVersion(OSBS_FLATPAK_SUPPORT_VERSION))
+    return _osbs_flatpak_support
+
+
+def log_tail(data, size=LOG_COMPRESSION_TAIL):
+    """Last whole lines of log data which fit in size bytes"""
+    if len(data) <= size:
+        return data
+    tail = data[-size:]
+    start = tail.find(b'\n') + 1
+    # a line longer than size is cut
+    return tail[start:] if start < len(tail) else tail
+
+
+def route_by_platform_name(task_run_name, platforms):
+    """Default log routing rule, platform name is part of task run name
+
+    platforms is a list of (platform, normalized platform) tuples, where
+    normalized platform uses '-' instead of '_' as in task run names.
+    Returns platform of the task run or None.
+    """
+    for platform, normalized_platform in platforms:
+        if normalized_platform in task_run_name:
+            return platform
+    return None
+
+
 def create_task_response(osbs_result):
     """Create task response from an OSBS result"""
     repositories = osbs_result.get('repositories', [])
@@ -120,6 +249,32 @@ def create_task_response(osbs_result):
     return task_response
 
 
+def link_or_copy(source, target):
+    """Make target a copy of source without copying data if possible
+
+    target is a hard link of source, or a reflink on the same filesystem,
+    data are copied only when neither is possible. Returns which one was made.
+    """
+    try:
+        os.link(source, target)
+        return 'link'
+    except FileExistsError:
+        # already linked, opening it for writing would truncate source
+        if os.path.samefile(source, target):
+            return 'link'
+    except OSError:
+        pass
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copymode(source, target)
+        return 'reflink'
+    except OSError:
+        pass
+    shutil.copy(source, target)
+    return 'copy'
+
+
 class ContainerError(koji.GenericError):
     """Raised when container creation fails"""
     faultCode = 2001
@@ -146,6 +301,207 @@ class My_SCM(SCM):
         git_uri = '%s%s%s' % (scheme, self.host, self.repository)
         return git_uri
 
+    def _git_repo(self):
+        """Repository URL as used by SCM.checkout()"""
+        if self.scmtype == 'GIT+SSH':
+            if not self.user:
+                raise koji.BuildError(
+                    'No user specified for repository access scheme: %s' % self.scheme)
+            return 'git+ssh://%s@%s%s' % (self.user, self.host, self.repository)
+
+        if self.user:
+            scheme = self.scheme
+            if '+' in scheme:
+                scheme = scheme.split('+')[1]
+            return '%s%s@%s%s' % (scheme, self.user, self.host, self.repository)
+        return self.get_git_uri()
+
+    def sparse_checkout(self, scmdir, files, session=None, uploadpath=None, logfile=None):
+        """Checkout only given files of the module, git only
+
+        Only the requested revision is fetched, without history and without
+        contents of other files. Arguments and return value are the same as
+        for SCM.checkout(), files are relative to the module directory.
+        """
+        if self.scmtype not in ('GIT', 'GIT+SSH'):
+            raise koji.BuildError("Sparse checkout is not supported for %s" % self.scmtype)
+
+        gitrepo = self._git_repo()
+        checkout_path = os.path.basename(self.repository)
+        if self.repository.endswith('/.git'):
+            checkout_path = os.path.basename(self.repository[:-5])
+        elif self.repository.endswith('.git'):
+            checkout_path = os.path.basename(self.repository[:-4])
+        checkout_dir = os.path.join(scmdir, checkout_path)
+
+        # git-reset happily accepted origin/x spec, fetch has it split
+        rev = self.revision
+        if rev.startswith('origin/'):
+            rev = rev[7:]
+
+        def _run(cmd, cwd, append=True):
+            if log_output(session, cmd[0], cmd, logfile, uploadpath,
+                          cwd=cwd, logerror=1, append=append):
+                raise koji.BuildError('Error running %s command "%s", see %s for details' %
+                                      (self.scmtype, ' '.join(cmd), os.path.basename(logfile)))
+
+        _run(['git', 'init', '-q', checkout_dir], cwd=scmdir, append=False)
+        _run(['git', 'remote', 'add', 'origin', gitrepo], cwd=checkout_dir)
+        _run(['git', 'config', 'core.sparseCheckout', 'true'], cwd=checkout_dir)
+        module_path = '/%s/' % self.module if self.module else '/'
+        sparse_checkout_file = os.path.join(checkout_dir, '.git', 'info', 'sparse-checkout')
+        koji.ensuredir(os.path.dirname(sparse_checkout_file))
+        with open(sparse_checkout_file, 'w') as f:
+            for fname in files:
+                f.write('%s%s\n' % (module_path, fname))
+        _run(['git', 'fetch', '-q', '--depth', '1', '--filter=blob:none', 'origin', rev],
+             cwd=checkout_dir)
+        _run(['git', 'checkout', '-q', 'FETCH_HEAD'], cwd=checkout_dir)
+
+        if self.module:
+            return os.path.join(checkout_dir, self.module)
+        return checkout_dir
+
+
+class InotifyWatch(object):
+    """Minimal ctypes binding of inotify(7) watching a single directory"""
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+
+    # struct inotify_event without the trailing name
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        mask = self.IN_CREATE | self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        if libc.inotify_add_watch(self._fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, os.strerror(errno), path)
+
+    def fileno(self):
+        return self._fd
+
+    def wait(self, timeout, fds=()):
+        """Block until an event or any of fds is available or timeout seconds pass"""
+        readable, _, _ = select.select([self._fd] + list(fds), [], [], timeout)
+        return bool(readable)
+
+    def read_events(self):
+        """Return names of files changed since the last call
+
+        Returns None when the kernel event queue overflowed and events were lost.
+        """
+        names = set()
+        overflow = False
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & self.IN_Q_OVERFLOW:
+                    overflow = True
+                elif name:
+                    names.add(os.fsdecode(name))
+        return None if overflow else names
+
+    def close(self):
+        os.close(self._fd)
+
+
+def wait_readable(fds, timeout):
+    """Wait up to timeout seconds until any of fds is readable, returns readable fds"""
+    if not fds:
+        time.sleep(timeout)
+        return []
+    return select.select(fds, [], [], timeout)[0]
+
+
+class ChildWatch(object):
+    """File descriptor which becomes readable when a child process exits
+
+    Uses pidfd (Linux 5.3+), or a pipe written to from SIGCHLD handler. When
+    neither is available fileno() returns None and exit has to be polled
+    with exited().
+    """
+    def __init__(self, pid):
+        self.pid = pid
+        self.status = None
+        self._fd = None
+        self._pipe = None
+        self._old_handler = None
+        try:
+            self._fd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            try:
+                self._watch_sigchld()
+            except (ValueError, OSError):
+                # signal handlers can be set only in the main thread
+                pass
+
+    def _watch_sigchld(self):
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        os.set_blocking(write_fd, False)
+
+        def sigchld_handler(signum, frame):
+            try:
+                os.write(write_fd, b'\0')
+            except OSError:
+                # pipe is full, the reader wakes up anyway
+                pass
+
+        try:
+            self._old_handler = signal.signal(signal.SIGCHLD, sigchld_handler)
+        except (ValueError, OSError):
+            os.close(read_fd)
+            os.close(write_fd)
+            raise
+        self._pipe = (read_fd, write_fd)
+        self._fd = read_fd
+        # child could have exited before the handler was set
+        os.write(write_fd, b'\0')
+
+    def fileno(self):
+        return self._fd
+
+    def exited(self):
+        """Whether the child exited, the child is reaped"""
+        if self.status is None:
+            if self._pipe is not None:
+                try:
+                    while os.read(self._pipe[0], 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+            if pid != 0:
+                self.status = status
+        return self.status is not None
+
+    def close(self):
+        if self._pipe is not None:
+            signal.signal(signal.SIGCHLD, self._old_handler)
+            os.close(self._pipe[1])
+            self._pipe = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
 
 class FileWatcher(object):
     """Watch directory for new or changed files which can be iterated on
@@ -153,11 +509,41 @@ class FileWatcher(object):
     Rewritten mock() from Buildroot class of kojid. When modifying keep that in
     mind and after the API looks stable enough try to merge the code back to
     koji.
+
+    When inotify is available only files reported as created, written or
+    replaced are checked, otherwise every file is checked on each call. Files
+    which can't be read are skipped until the next call.
     """
-    def __init__(self, result_dir, logger):
+    def __init__(self, result_dir, logger, use_inotify=True, ignore=()):
         self._result_dir = result_dir
         self.logger = logger
         self._logs = {}
+        self._ignore = ignore
+        self._inotify = None
+        self._scanned = False
+        self._last_wakeup = None
+
+        if use_inotify:
+            try:
+                self._inotify = InotifyWatch(result_dir)
+            except Exception as error:
+                self.logger.debug("inotify unavailable, polling %s: %s", result_dir, error)
+
+    def _is_watched(self, fname):
+        return ((fname.endswith('.log') or fname.endswith('.json')) and
+                fname not in self._ignore)
+
+    def _changed_files(self):
+        """Names of files changed since the last call, None if all have to be checked"""
+        if self._inotify is None or not self._scanned:
+            return None
+        return self._inotify.read_events()
+
+    def _add_files(self, fnames):
+        for fname in fnames:
+            if self._is_watched(fname) and fname not in self._logs:
+                fpath = os.path.join(self._result_dir, fname)
+                self._logs[fname] = (None, None, 0, fpath)
 
     def _list_files(self):
         try:
@@ -166,10 +552,8 @@ class FileWatcher(object):
             # will happen when mock hasn't created the resultdir yet
             return
 
-        for fname in results:
-            if (fname.endswith('.log') or fname.endswith('.json')) and fname not in self._logs:
-                fpath = os.path.join(self._result_dir, fname)
-                self._logs[fname] = (None, None, 0, fpath)
+        self._scanned = True
+        self._add_files(results)
 
     def _reopen_file(self, fname, fd, inode, size, fpath):
         try:
@@ -194,19 +578,1043 @@ class FileWatcher(object):
         return fd
 
     def files_to_upload(self):
-        self._list_files()
+        changed = self._changed_files()
+        if changed is None:
+            self._list_files()
+        else:
+            self._add_files(changed)
 
         for (fname, (fd, inode, size, fpath)) in self._logs.items():
+            if changed is not None and fname not in changed:
+                continue
             fd = self._reopen_file(fname, fd, inode, size, fpath)
             if fd is False:
-                return
+                # events of the file were read already, all files are checked
+                # on the next call
+                self._scanned = False
+                continue
             yield (fd, fname)
 
+    def wait(self, timeout, min_interval=0, fds=(), exit_fds=()):
+        """Wait for changes of watched files
+
+        With inotify it returns as soon as a file changes or any of fds is
+        readable, but not sooner than min_interval seconds after the previous
+        wakeup, and at the latest after timeout seconds. Without inotify changes
+        can't be detected, so only readable fds end the wait sooner. Wait ends
+        immediately when any of exit_fds is readable.
+        """
+        fds = list(fds) + list(exit_fds)
+        if self._last_wakeup is not None:
+            delay = self._last_wakeup + min_interval - time.monotonic()
+            if delay > 0:
+                if wait_readable(exit_fds, delay):
+                    self._last_wakeup = time.monotonic()
+                    return
+                timeout = max(timeout - delay, 0)
+        if self._inotify is None:
+            wait_readable(fds, timeout)
+        else:
+            self._inotify.wait(timeout, fds=fds)
+        self._last_wakeup = time.monotonic()
+
     def clean(self):
         # pylint: disable=unused-variable
         for (fname, (fd, inode, size, fpath)) in self._logs.items():
             if fd:
                 fd.close()
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+class LogStreamWriter(object):
+    """Sends log data from the build process to the task process over a pipe
+
+    Thread safe, records bigger than PIPE_BUF aren't written atomically, so
+    a record is completely written before another one is started.
+    """
+    def __init__(self, fd):
+        self._fd = fd
+        self._lock = threading.Lock()
+
+    def send(self, kind, name, data=b''):
+        name = name.encode('utf-8')
+        record = LOG_STREAM_HEADER.pack(kind, len(name), len(data)) + name + data
+        view = memoryview(record)
+        with self._lock:
+            while view:
+                written = os.write(self._fd, view)
+                view = view[written:]
+
+    def close(self):
+        os.close(self._fd)
+
+
+class LogStreamReader(object):
+    """Receives records sent by LogStreamWriter without blocking
+
+    A thread drains the pipe into memory as soon as data arrive, so the
+    writer doesn't block while the task process uploads logs. fileno() is
+    readable when data were received since the last read_records().
+    """
+    def __init__(self, fd):
+        self._fd = fd
+        self._buffer = bytearray()
+        self.eof = False
+        self._lock = threading.Lock()
+        self._wakeup = os.pipe()
+        self._stop = os.pipe()
+        for pipe_fd in (fd,) + self._wakeup:
+            os.set_blocking(pipe_fd, False)
+        self._thread = threading.Thread(target=self._drain, name='log-stream-reader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def fileno(self):
+        return self._wakeup[0]
+
+    def _read(self):
+        """Read data waiting in the pipe, returns whether any were read"""
+        received = False
+        with self._lock:
+            while not self.eof:
+                try:
+                    data = os.read(self._fd, LOG_STREAM_PIPE_SIZE)
+                except BlockingIOError:
+                    break
+                if not data:
+                    self.eof = True
+                self._buffer += data
+                received = True
+        return received
+
+    def _drain(self):
+        while not self.eof:
+            if self._stop[0] in select.select([self._fd, self._stop[0]], [], [])[0]:
+                break
+            if self._read():
+                try:
+                    os.write(self._wakeup[1], b'\0')
+                except BlockingIOError:
+                    # the reader wakes up anyway
+                    pass
+
+    def read_records(self):
+        """Returns list of (kind, name, data) records completely received so far"""
+        try:
+            while os.read(self._wakeup[0], 4096):
+                pass
+        except BlockingIOError:
+            pass
+        self._read()
+
+        records = []
+        offset = 0
+        header_size = LOG_STREAM_HEADER.size
+        with self._lock:
+            while len(self._buffer) - offset >= header_size:
+                kind, name_len, data_len = LOG_STREAM_HEADER.unpack_from(self._buffer, offset)
+                name_start = offset + header_size
+                data_start = name_start + name_len
+                end = data_start + data_len
+                if end > len(self._buffer):
+                    break
+                name = bytes(self._buffer[name_start:data_start]).decode('utf-8')
+                records.append((kind, name, bytes(self._buffer[data_start:end])))
+                offset = end
+            del self._buffer[:offset]
+        return records
+
+    def close(self):
+        os.write(self._stop[1], b'\0')
+        self._thread.join()
+        for pipe_fd in (self._fd,) + self._wakeup + self._stop:
+            os.close(pipe_fd)
+
+
+class StreamedLogFile(object):
+    """Write-only file object sending the data through LogStreamWriter"""
+    def __init__(self, writer, name):
+        self._writer = writer
+        self.name = name
+
+    def write(self, data):
+        self._writer.send(LOG_STREAM_DATA, self.name, bytes(data))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StreamedLogs(object):
+    """Logs received from the build process by the task process
+
+    Received data are uploaded directly from memory, local copies in the result
+    directory are kept only as a backup and are never read again.
+    """
+    def __init__(self, result_dir):
+        self._result_dir = result_dir
+        self._files = {}
+        self._sizes = {}
+
+    def __contains__(self, name):
+        return name in self._sizes
+
+    def append(self, name, data):
+        """Store data of the log and return offset at which they start"""
+        if name not in self._files:
+            self._sizes[name] = 0
+            self._files[name] = open(os.path.join(self._result_dir, name), 'wb')
+        offset = self._sizes[name]
+        self._files[name].write(data)
+        self._sizes[name] += len(data)
+        return offset
+
+    def close(self):
+        for logfile in self._files.values():
+            logfile.close()
+        self._files = {}
+
+
+class LogRouter(dict):
+    """Maps task run names to platforms of their logs
+
+    Every task run name is resolved by the routing rule only once, following
+    lookups are plain dict lookups. Task runs without platform map to 'noarch'.
+    """
+    def __init__(self, platforms, rule=route_by_platform_name):
+        dict.__init__(self)
+        self._platforms = [(platform, platform.replace('_', '-'))
+                           for platform in platforms or []]
+        self._rule = rule
+
+    def __missing__(self, task_run_name):
+        platform = None
+        if self._platforms:
+            platform = self._rule(task_run_name, self._platforms)
+        platform = platform or 'noarch'
+        self[task_run_name] = platform
+        return platform
+
+
+class BufferedLogWriter(object):
+    """Buffers data written to a log and passes them to the log file in batches
+
+    Buffered data are written when there is at least LOG_BUFFER_SIZE bytes of
+    them, when they are older than LOG_BUFFER_AGE seconds and on flush() and
+    close(). Thread safe, so LogFlusher can flush data of idle logs: the lock
+    is held while data are buffered and while they are written to the log
+    file, so the log file is used by one thread at a time.
+    """
+    def __init__(self, logfile):
+        self._logfile = logfile
+        self._lock = threading.Lock()
+        self._chunks = []
+        self._size = 0
+        self._buffered_since = None
+
+    def write(self, data):
+        with self._lock:
+            now = time.monotonic()
+            if not self._chunks:
+                self._buffered_since = now
+            self._chunks.append(data)
+            self._size += len(data)
+            if (self._size >= LOG_BUFFER_SIZE or
+                    now - self._buffered_since >= LOG_BUFFER_AGE):
+                self._flush()
+
+    def _flush(self):
+        if self._chunks:
+            self._logfile.write(b''.join(self._chunks))
+            self._logfile.flush()
+            self._chunks = []
+            self._size = 0
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def flush_expired(self, max_age):
+        """Flush buffered data older than max_age seconds"""
+        with self._lock:
+            if self._chunks and time.monotonic() - self._buffered_since >= max_age:
+                self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._logfile.close()
+
+
+class LogFlusher(threading.Thread):
+    """Periodically flushes BufferedLogWriters which are not written to"""
+    def __init__(self, logger, interval=LOG_BUFFER_AGE):
+        threading.Thread.__init__(self, name='log-flusher', daemon=True)
+        self.logger = logger
+        self._interval = interval
+        self._writers = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def add(self, writer):
+        with self._lock:
+            self._writers.append(writer)
+        return writer
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            with self._lock:
+                writers = list(self._writers)
+            for writer in writers:
+                try:
+                    writer.flush_expired(self._interval)
+                except Exception as error:
+                    self.logger.warning("Failed to flush build log: %s", error)
+
+    def stop(self):
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+
+
+class OffsetBytesIO(io.BytesIO):
+    """In-memory chunk of a file starting at offset, usable with incremental_upload"""
+    def __init__(self, data, offset):
+        io.BytesIO.__init__(self, data)
+        self._offset = offset
+
+    def tell(self):
+        return self._offset + io.BytesIO.tell(self)
+
+
+class LogUploader(object):
+    """Coalesce data appended to logs and upload them to the hub in batches
+
+    Data of a log are kept until there are at least coalesce_size bytes of
+    them or until they are coalesce_age seconds old. Logs due for upload are
+    sent together, in as few koji multicalls of uploadFile as batch_size
+    allows. Chunks which failed in a multicall are uploaded once more by
+    incremental_upload(), which retries them. When the session uses fast
+    upload, chunks are uploaded by incremental_upload() with rawUpload instead
+    of multicalls.
+
+    With compress data of .log files are uploaded only gzip compressed as
+    <name>.log.gz. Data of a log are compressed by a single deflate stream,
+    which is flushed after every upload, so the uploaded part of the file can
+    be decompressed at any time. The stream ends on the final flush, when a
+    tail of every compressed log is uploaded also as <name>.log, replacing
+    what was uploaded there before.
+
+    With more than one worker every file is uploaded by a thread pool with a
+    hub subsession per thread, so a slow upload doesn't hold up other files.
+    Uploads of a file wait for its previous uploads, which keeps them in
+    order. close() waits for all of them.
+    """
+    def __init__(self, session, uploadpath, logger, compress=False,
+                 coalesce_size=LOG_UPLOAD_COALESCE_SIZE, coalesce_age=LOG_UPLOAD_COALESCE_AGE,
+                 batch_size=LOG_UPLOAD_BATCH_SIZE, workers=LOG_UPLOAD_WORKERS):
+        self.session = session
+        self.uploadpath = uploadpath
+        self.logger = logger
+        self._compress = compress
+        self._coalesce_size = coalesce_size
+        self._coalesce_age = coalesce_age
+        self._batch_size = batch_size
+        # log name -> [offset, chunks, size, monotonic time of the oldest chunk]
+        self._pending = collections.OrderedDict()
+        # log name -> compressor of its data, while its gzip member isn't ended
+        self._compressors = {}
+        # log name -> size of its uploaded compressed file
+        self._compressed_sizes = {}
+        # log name -> tail of the compressed log, names of tails not uploaded yet
+        self._tails = {}
+        self._new_tails = set()
+        # log name -> [uploaded bytes, requests, seconds spent in requests]
+        self.stats = {}
+        # chunks uploaded once more after they failed
+        self.retries = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        if workers > 1:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        # limits data waiting for workers in memory
+        self._queued = threading.BoundedSemaphore(2 * workers)
+        # uploaded file name -> future of its last upload
+        self._uploads = {}
+        self._local = threading.local()
+        self._sessions = []
+
+    def add(self, name, offset, data):
+        """Add data of the log name starting at offset"""
+        if not data:
+            return
+        pending = self._pending.get(name)
+        if pending is not None and pending[0] + pending[2] != offset:
+            # the log was truncated or replaced, keep the order of uploads
+            self.flush(names=[name])
+            pending = None
+        if pending is None:
+            pending = self._pending[name] = [offset, [], 0, time.monotonic()]
+        pending[1].append(data)
+        pending[2] += len(data)
+
+    def add_file(self, name, fd):
+        """Add rest of the file opened as fd, return number of bytes read"""
+        read = 0
+        while True:
+            offset = fd.tell()
+            data = fd.read(self._coalesce_size)
+            if not data:
+                break
+            if not isinstance(data, bytes):
+                data = data.encode('utf-8')
+            self.add(name, offset, data)
+            read += len(data)
+            # keep at most coalesce_size bytes of a log in memory
+            self.flush()
+        return read
+
+    def timeout(self):
+        """Seconds until the oldest pending data are due, None if there are none"""
+        if not self._pending:
+            return None
+        oldest = min(pending[3] for pending in self._pending.values())
+        return max(oldest + self._coalesce_age - time.monotonic(), 0)
+
+    def _due(self):
+        now = time.monotonic()
+        return [name for name, (_, _, size, since) in self._pending.items()
+                if size >= self._coalesce_size or now - since >= self._coalesce_age]
+
+    def _compressed(self, name, offset, data, finish=False):
+        """Compress data of the log at offset, returns (target, offset, data) to upload
+
+        Data following the previous ones continue its deflate stream, finish
+        ends the gzip member. A log rewritten from its start starts a new
+        compressed file.
+        """
+        compressor = self._compressors.get(name)
+        if compressor is None or offset == 0:
+            compressor = zlib.compressobj(LOG_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+        target_offset = 0 if offset == 0 else self._compressed_sizes.get(name, 0)
+        if finish:
+            data = compressor.compress(data) + compressor.flush()
+            self._compressors.pop(name, None)
+        else:
+            data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            self._compressors[name] = compressor
+        self._compressed_sizes[name] = target_offset + len(data)
+        return name + '.gz', target_offset, data
+
+    def _add_tail(self, name, offset, data):
+        tail = self._tails.get(name, b'') if offset else b''
+        self._tails[name] = log_tail(tail + data)
+        self._new_tails.add(name)
+
+    def flush(self, force=False, names=None):
+        """Upload pending data due for upload, all of them with force or of names
+
+        Forced flush ends compressed logs and uploads their tails.
+        """
+        if names is None:
+            names = list(self._pending) if force else self._due()
+        targets = []
+        for name in names:
+            if name not in self._pending:
+                continue
+            offset, data, _, _ = self._pending.pop(name)
+            data = b''.join(data)
+            if self._compress and name.endswith('.log'):
+                targets.append((name,) + self._compressed(name, offset, data, finish=force))
+                self._add_tail(name, offset, data)
+            else:
+                targets.append((name, name, offset, data))
+        if force:
+            for name in list(self._compressors):
+                targets.append((name,) + self._compressed(name, None, b'', finish=True))
+            for name in sorted(self._new_tails):
+                targets.append((name, name, 0, self._tails[name]))
+            self._new_tails.clear()
+
+        chunks = []
+        for name, target, target_offset, target_data in targets:
+            file_chunks = [(name, target, target_offset + start,
+                            target_data[start:start + LOG_UPLOAD_CHUNK_SIZE])
+                           for start in range(0, len(target_data), LOG_UPLOAD_CHUNK_SIZE)]
+            if self._executor is None:
+                chunks.extend(file_chunks)
+            else:
+                self._submit(target, file_chunks)
+        self._send_batches(chunks, self.session)
+
+    def _send_batches(self, chunks, session):
+        batch = []
+        batch_size = 0
+        for chunk in chunks:
+            if batch and batch_size + len(chunk[3]) > self._batch_size:
+                self._send(batch, session)
+                batch = []
+                batch_size = 0
+            batch.append(chunk)
+            batch_size += len(chunk[3])
+        if batch:
+            self._send(batch, session)
+
+    def _submit(self, target, chunks):
+        self._queued.acquire()
+        try:
+            previous = self._uploads.get(target)
+            self._uploads[target] = self._executor.submit(self._upload_in_worker, previous,
+                                                          chunks)
+        except Exception:
+            self._queued.release()
+            raise
+
+    def _upload_in_worker(self, previous, chunks):
+        try:
+            if previous is not None:
+                # the previous upload of the file was submitted earlier, so it
+                # already runs in another thread
+                concurrent.futures.wait([previous])
+            self._send_batches(chunks, self._worker_session())
+        finally:
+            self._queued.release()
+
+    def _worker_session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            # koji sessions can't be shared by threads
+            session = self._local.session = self.session.subsession()
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def close(self):
+        """Wait for uploads made by workers, raise the first error of them"""
+        if self._executor is None:
+            return
+        uploads = list(self._uploads.values())
+        self._uploads = {}
+        try:
+            for upload in uploads:
+                upload.result()
+        finally:
+            self._executor.shutdown()
+            self._executor = None
+            for session in self._sessions:
+                try:
+                    session.logout()
+                except Exception as error:
+                    self.logger.debug("Couldn't log out upload session: %s", error)
+            self._sessions = []
+
+    def _send(self, batch, session):
+        started = time.monotonic()
+        if session.opts.get('use_fast_upload'):
+            self._send_raw(batch, session)
+        else:
+            self._send_multicall(batch, session)
+        elapsed = time.monotonic() - started
+
+        batch_size = sum(len(chunk[3]) for chunk in batch)
+        with self._lock:
+            for target in set(chunk[1] for chunk in batch):
+                size = sum(len(chunk[3]) for chunk in batch if chunk[1] == target)
+                stats = self.stats.setdefault(target, [0, 0, 0.0])
+                stats[0] += size
+                stats[1] += 1
+                # time of the batch is split by the uploaded bytes
+                stats[2] += elapsed * size / batch_size
+
+    def _send_raw(self, batch, session):
+        # rawUpload sends data without base64 encoding, but it can't be
+        # made in a multicall
+        for _, target, offset, data in batch:
+            incremental_upload(session, target, OffsetBytesIO(data, offset), self.uploadpath,
+                               logger=self.logger)
+
+    def _send_multicall(self, batch, session):
+        calls = []
+        with session.multicall(strict=False) as m:
+            for _, target, offset, data in batch:
+                digest = hashlib.sha256(data).hexdigest()
+                calls.append(m.uploadFile(self.uploadpath, target, len(data),
+                                          ('sha256', digest), offset, base64encode(data)))
+
+        failed = {}
+        for (_, target, offset, _), call in zip(batch, calls):
+            try:
+                uploaded = call.result
+            except Exception as error:
+                self.logger.debug("Uploading %s at offset %d failed: %s", target, offset, error)
+                uploaded = False
+            if not uploaded and target not in failed:
+                failed[target] = offset
+        for target, failed_offset in failed.items():
+            # the hub truncates a file when data are uploaded at offset 0, so
+            # the chunks after the failed one are uploaded once more as well
+            data = b''.join(data for _, chunk_target, offset, data in batch
+                            if chunk_target == target and offset >= failed_offset)
+            with self._lock:
+                self.retries += sum(1 for _, chunk_target, offset, _ in batch
+                                    if chunk_target == target and offset >= failed_offset)
+            incremental_upload(session, target, OffsetBytesIO(data, failed_offset),
+                               self.uploadpath, logger=self.logger)
+
+    def log_stats(self):
+        for name, (size, uploads, seconds) in sorted(self.stats.items()):
+            rate = size / seconds if seconds else 0
+            self.logger.info("Uploaded %s: %d bytes in %d requests, %.1f KiB/s",
+                             name, size, uploads, rate / 1024)
+
+
+class PhaseTimings(object):
+    """Wall time spent by a task in its phases
+
+    Time of a phase entered more than once is summed up, time of a phase
+    entered within another one is not counted in the enclosing phase. The
+    build itself runs during BUILD_PHASES, the rest of the task is overhead.
+    """
+    BUILD_PHASES = ('log_follow', 'wait_for_build')
+
+    def __init__(self):
+        self._started = time.monotonic()
+        self._phases = collections.OrderedDict()
+        self._running = []
+        self._since = None
+
+    def _add(self, name, now):
+        self._phases[name] = self._phases.get(name, 0) + now - self._since
+        self._since = now
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if self._running:
+            self._add(self._running[-1], time.monotonic())
+        else:
+            self._since = time.monotonic()
+        self._running.append(name)
+        try:
+            yield
+        finally:
+            self._add(self._running.pop(), time.monotonic())
+
+    def report(self):
+        total = time.monotonic() - self._started
+        build = sum(seconds for name, seconds in self._phases.items()
+                    if name in self.BUILD_PHASES)
+        return {
+            'total': round(total, 3),
+            'build': round(build, 3),
+            'overhead': round(total - build, 3),
+            'phases': [{'name': name, 'seconds': round(seconds, 3)}
+                       for name, seconds in self._phases.items()],
+        }
+
+    def summary(self):
+        report = self.report()
+        phases = ', '.join('%s %.1fs' % (phase['name'], phase['seconds'])
+                           for phase in report['phases'])
+        return ("Task took %.1fs, build %.1fs, overhead %.1fs (%s)" %
+                (report['total'], report['build'], report['overhead'], phases))
+
+
+class TextfileMetrics(object):
+    """Metrics of container tasks written for the node-exporter textfile collector
+
+    Tasks run in separate processes, so metrics are kept in a state file in
+    the directory. Each update holds a lock of the state file while it changes
+    it and writes the .prom file, which is replaced atomically, so the
+    collector never reads a partially written file. Tasks in flight are
+    counted by their processes, tasks of processes which don't exist anymore
+    are not counted.
+    """
+    STATE_FILE = 'koji_containerbuild.state.json'
+    PROM_FILE = 'koji_containerbuild.prom'
+
+    def __init__(self, directory, logger=None):
+        self.directory = directory
+        self.logger = logger
+
+    @staticmethod
+    def _labels(labels):
+        return ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                        for key, value in sorted(labels.items()))
+
+    @staticmethod
+    def _running(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def record(self, method, samples=(), in_flight=None):
+        """Add samples of metrics of a task of method
+
+        samples are (metric name, labels, value). With in_flight the task of
+        this process is marked as running or as finished.
+        """
+        koji.ensuredir(self.directory)
+        with open(os.path.join(self.directory, self.STATE_FILE), 'a+') as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            state_file.seek(0)
+            data = state_file.read()
+            state = json.loads(data) if data else {'tasks': {}, 'methods': [], 'series': {}}
+
+            if method not in state['methods']:
+                state['methods'].append(method)
+            if in_flight:
+                state['tasks'][str(os.getpid())] = method
+            elif in_flight is not None:
+                state['tasks'].pop(str(os.getpid()), None)
+            state['tasks'] = {pid: task_method for pid, task_method in state['tasks'].items()
+                              if self._running(int(pid))}
+
+            for name, labels, value in samples:
+                series = state['series'].setdefault(name, {})
+                key = self._labels(dict(labels, method=method))
+                if METRICS[name][0] == 'histogram':
+                    histogram = series.setdefault(key, {'buckets': [0] * len(METRICS_BUCKETS),
+                                                        'sum': 0, 'count': 0})
+                    for index, bound in enumerate(METRICS_BUCKETS):
+                        if value <= bound:
+                            histogram['buckets'][index] += 1
+                    histogram['sum'] += value
+                    histogram['count'] += 1
+                else:
+                    series[key] = series.get(key, 0) + value
+
+            state_file.seek(0)
+            state_file.truncate()
+            json.dump(state, state_file)
+            state_file.flush()
+            self._write_prom(state)
+
+    def _write_prom(self, state):
+        lines = []
+        for name, (metric_type, help_text) in sorted(METRICS.items()):
+            metric = METRICS_PREFIX + name
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s %s' % (metric, metric_type))
+            if name == 'tasks_in_flight':
+                for method in sorted(state['methods']):
+                    count = sum(1 for task_method in state['tasks'].values()
+                                if task_method == method)
+                    lines.append('%s{%s} %d' % (metric, self._labels({'method': method}), count))
+                continue
+            for key, value in sorted(state['series'].get(name, {}).items()):
+                if metric_type != 'histogram':
+                    lines.append('%s{%s} %s' % (metric, key, value))
+                    continue
+                bounds = [str(bound) for bound in METRICS_BUCKETS] + ['+Inf']
+                counts = value['buckets'] + [value['count']]
+                for bound, count in zip(bounds, counts):
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (metric, key, bound, count))
+                lines.append('%s_sum{%s} %s' % (metric, key, value['sum']))
+                lines.append('%s_count{%s} %d' % (metric, key, value['count']))
+
+        fd, path = tempfile.mkstemp(prefix='.' + self.PROM_FILE, dir=self.directory)
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'w') as prom_file:
+                prom_file.write('\n'.join(lines) + '\n')
+            os.replace(path, os.path.join(self.directory, self.PROM_FILE))
+        except Exception:
+            os.unlink(path)
+            raise
+
+
+def pipeline_run_snapshot_class():
+    """osbs-client PipelineRun answering from data fetched once
+
+    PipelineRun helpers fetch the PipelineRun again for every question, the
+    subclass answers them from pipeline_run_data it was created with.
+    """
+    global _pipeline_run_snapshot_class  # pylint: disable=global-statement
+    if _pipeline_run_snapshot_class is None:
+        from osbs.tekton import PipelineRun
+
+        class PipelineRunSnapshot(PipelineRun):
+            def __init__(self, openshift, pipeline_run_name, pipeline_run_data):
+                super(PipelineRunSnapshot, self).__init__(openshift, pipeline_run_name)
+                self._snapshot = pipeline_run_data
+
+            @property
+            def data(self):
+                return self._snapshot
+
+            def get_info(self, wait=False):
+                return self._snapshot
+
+        _pipeline_run_snapshot_class = PipelineRunSnapshot
+    return _pipeline_run_snapshot_class
+
+
+class BuildStatusSnapshot(object):
+    """Status of an OSBS build answered from a single fetch of its PipelineRun
+
+    osbs-client fetches the PipelineRun again for each of build_has_succeeded(),
+    build_was_cancelled(), build_not_finished(), get_build_reason() and
+    get_build_results(). This fetches it once and answers the same questions
+    by osbs-client PipelineRun helpers from the fetched data until refresh()
+    is called.
+    """
+    def __init__(self, osbs_obj, build_id):
+        self._osbs = osbs_obj
+        self.build_id = build_id
+        self.data = None
+        self._pipeline_run = None
+        self.refresh()
+
+    def refresh(self):
+        """Fetch current PipelineRun of the build"""
+        self.data = self._osbs.get_build(self.build_id) or {}
+        self._pipeline_run = pipeline_run_snapshot_class()(self._osbs.os, self.build_id,
+                                                           self.data)
+
+    @property
+    def _started(self):
+        # PipelineRun helpers expect its status, it's missing until the run starts
+        return bool((self.data.get('status') or {}).get('conditions'))
+
+    @property
+    def reason(self):
+        return self._pipeline_run.status_reason if self._started else None
+
+    @property
+    def succeeded(self):
+        return self._started and self._pipeline_run.has_succeeded()
+
+    @property
+    def cancelled(self):
+        return self._started and self._pipeline_run.was_cancelled()
+
+    @property
+    def not_finished(self):
+        return not self._started or self._pipeline_run.has_not_finished()
+
+    @property
+    def results(self):
+        """Results of the PipelineRun with JSON decoded values, null values are left out"""
+        return self._pipeline_run.pipeline_results if self._started else {}
+
+
+class HubBatch(object):
+    """Hub calls recorded in a koji multicall, see HubCalls.batch()"""
+    def __init__(self, hub, strict=True):
+        self._hub = hub
+        self._multicall = hub.session.multicall(strict=strict)
+        self._calls = {}
+
+    def __enter__(self):
+        self._multicall.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        result = self._multicall.__exit__(exc_type, exc_value, tb)
+        if exc_type is None:
+            self._hub._calls.update(self._calls)
+        return result
+
+    def __getattr__(self, method):
+        def record(*args, **kwargs):
+            key = HubCalls.call_key(method, args, kwargs)
+            self._hub.misses[method] += 1
+            self._calls[key] = getattr(self._multicall, method)(*args, **kwargs)
+        return record
+
+
+class HubResult(object):
+    """Result of a lookup made outside of a multicall, same interface as koji.VirtualCall"""
+    def __init__(self, result):
+        self.result = result
+
+
+class HubCalls(object):
+    """Hub calls of a task, independent calls can be made in one round-trip
+
+    Calls made in a batch() are sent to the hub as a single koji multicall
+    when the batch ends. Their results are then returned when the same method
+    is called with the same arguments. Results of lookups which don't change
+    during a task (MEMOIZED) are kept too, other calls go to the hub
+    directly. Faults of calls in a non-strict batch are raised when their
+    result is used.
+
+    hits and misses count calls served locally and calls made to the hub.
+    """
+    MEMOIZED = ('getTaskInfo', 'getChannel', 'getUser')
+
+    def __init__(self, session):
+        self.session = session
+        self._calls = {}
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+
+    @staticmethod
+    def call_key(method, args, kwargs):
+        return (method, args, tuple(sorted(kwargs.items())))
+
+    def batch(self, strict=True):
+        return HubBatch(self, strict=strict)
+
+    def memoize(self, key, func, *args, **kwargs):
+        """Return result of func for key, func is called only the first time"""
+        name = key[0]
+        if key in self._calls:
+            self.hits[name] += 1
+            return self._calls[key].result
+        self.misses[name] += 1
+        result = func(*args, **kwargs)
+        self._calls[key] = HubResult(result)
+        return result
+
+    def stats(self):
+        return "%d hits, %d misses" % (sum(self.hits.values()), sum(self.misses.values()))
+
+    def _call(self, method, *args, **kwargs):
+        return getattr(self.session, method)(*args, **kwargs)
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            key = self.call_key(method, args, kwargs)
+            if method in self.MEMOIZED:
+                return self.memoize(key, self._call, method, *args, **kwargs)
+            if key in self._calls:
+                self.hits[method] += 1
+                return self._calls[key].result
+            self.misses[method] += 1
+            return self._call(method, *args, **kwargs)
+        return call
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTP adapter keeping connections to the OpenShift API open between calls
+
+    Adapters created with pool share connections of the pool adapter, closing
+    them leaves the connections open for the other adapters. Requests sent by
+    all of them are counted by the pool adapter.
+    """
+    def __init__(self, pool_size=HTTP_POOL_SIZE, keep_alive=True, pool=None, **kwargs):
+        self.keep_alive = keep_alive
+        self._pool = pool
+        self._lock = threading.Lock()
+        self._requests_sent = 0
+        super(PooledHTTPAdapter, self).__init__(pool_connections=pool_size,
+                                                pool_maxsize=pool_size, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self._pool is not None:
+            self.poolmanager = self._pool.poolmanager
+            return
+        if self.keep_alive:
+            kwargs['socket_options'] = (HTTPConnection.default_socket_options +
+                                        [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)])
+        super(PooledHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+
+    @property
+    def requests_sent(self):
+        """Requests sent by this adapter and by adapters sharing its connections"""
+        with self._lock:
+            return self._requests_sent
+
+    def _count_request(self):
+        with self._lock:
+            self._requests_sent += 1
+
+    def send(self, request, **kwargs):
+        pool = self if self._pool is None else self._pool
+        pool._count_request()  # pylint: disable=protected-access
+        return super(PooledHTTPAdapter, self).send(request, **kwargs)
+
+    def close(self):
+        if self._pool is None:
+            super(PooledHTTPAdapter, self).close()
+
+
+class PooledHTTPSession(requests.Session):
+    """requests session whose adapters share connections of pool
+
+    Adapters mounted to the session are replaced by PooledHTTPAdapter with
+    the same retries.
+    """
+    def __init__(self, pool):
+        self._pool = pool
+        super(PooledHTTPSession, self).__init__()
+        if not pool.keep_alive:
+            self.headers['Connection'] = 'close'
+
+    def mount(self, prefix, adapter):
+        if not isinstance(adapter, PooledHTTPAdapter):
+            adapter = PooledHTTPAdapter(keep_alive=self._pool.keep_alive, pool=self._pool,
+                                        max_retries=adapter.max_retries)
+        super(PooledHTTPSession, self).mount(prefix, adapter)
+
+
+class PooledRequests(object):
+    """requests module as seen by osbs-client, its sessions share pooled connections"""
+    def __init__(self, module, pool):
+        self.module = module
+        self.pool = pool
+        self.pid = os.getpid()
+
+    def Session(self):  # pylint: disable=invalid-name
+        return PooledHTTPSession(self.pool)
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+
+def creates_requests_sessions(http_module):
+    """Whether HttpStream of osbs.http mounts adapters to sessions of its requests module"""
+    stream_init = getattr(getattr(http_module, 'HttpStream', None), '__init__', None)
+    names = getattr(getattr(stream_init, '__code__', None), 'co_names', ())
+    module = getattr(http_module, 'requests', None)
+    if isinstance(module, PooledRequests):
+        module = module.module
+    return (getattr(module, 'Session', None) is requests.Session and
+            'Session' in names and 'mount' in names)
+
+
+def setup_http_pool(pool_size=HTTP_POOL_SIZE, keep_alive=True, logger=None):
+    """Make HTTP requests of osbs-client in this process reuse pooled connections
+
+    osbs-client sends every request by a HttpStream with a new requests
+    session of osbs.http, the sessions are created with a shared pool of
+    connections instead. Retries configured by osbs-client are kept. A pool
+    set up by the parent process is replaced, connections can't be shared
+    with it. Returns False when osbs-client doesn't create sessions this way.
+    """
+    import osbs.http
+
+    module = getattr(osbs.http, 'requests', None)
+    if isinstance(module, PooledRequests):
+        if module.pid == os.getpid():
+            return True
+        module = module.module
+    if not creates_requests_sessions(osbs.http):
+        if logger:
+            logger.warning("HttpStream of osbs-client doesn't create requests sessions, "
+                           "connections to the OpenShift API aren't pooled")
+        return False
+
+    pool = PooledHTTPAdapter(pool_size=pool_size, keep_alive=keep_alive)
+    osbs.http.requests = PooledRequests(module, pool)
+    return True
+
+
+def http_pool():
+    """PooledHTTPAdapter set up by setup_http_pool() in this process, None if there is none"""
+    module = getattr(sys.modules.get('osbs.http'), 'requests', None)
+    if isinstance(module, PooledRequests) and module.pid == os.getpid():
+        return module.pool
+    return None
 
 
 class LabelsWrapper(object):
@@ -214,21 +1622,35 @@ class LabelsWrapper(object):
         self.dockerfile_path = dockerfile_path
         self._setup_logger(logger_name)
         self._parser = None
-        self._label_data = {}
+        self._labels = None
+        self._label_data = None
         self._label_overwrites = label_overwrites or {}
 
     def _setup_logger(self, logger_name=None):
+        import dockerfile_parse
         if logger_name:
             dockerfile_parse.parser.logger = logging.getLogger("%s.dockerfile_parse"
                                                                % logger_name)
 
     def _parse(self):
+        import dockerfile_parse
         self._parser = dockerfile_parse.parser.DockerfileParser(self.dockerfile_path)
+        self._labels = self._parser.labels
+
+    def invalidate(self):
+        """Forget parsed labels, Dockerfile is parsed again when labels are needed"""
+        self._parser = None
+        self._labels = None
+        self._label_data = None
 
     def get_labels(self):
-        """returns all labels how they are found in Dockerfile"""
-        self._parse()
-        return self._parser.labels
+        """returns all labels how they are found in Dockerfile
+
+        Dockerfile is parsed only the first time, see invalidate().
+        """
+        if self._labels is None:
+            self._parse()
+        return self._labels
 
     def get_data_labels(self):
         """Subset of labels found in Dockerfile which we are interested in
@@ -236,8 +1658,11 @@ class LabelsWrapper(object):
         returns dict with keys from LABELS and values from Dockerfile as mapped via
         LABEL_NAME_MAP.
         """
+        if self._label_data is not None:
+            return self._label_data
 
         parsed_labels = self.get_labels()
+        label_data = {}
         for label_id in LABELS:
             if label_id not in LABEL_NAME_MAP:
                 msg = "Required label '{}' doesn't map to name in Dockerfile".format(label_id)
@@ -245,12 +1670,13 @@ class LabelsWrapper(object):
 
             for label_name in LABEL_NAME_MAP[label_id]:
                 if label_name in self._label_overwrites:
-                    self._label_data[label_id] = self._label_overwrites[label_name]
+                    label_data[label_id] = self._label_overwrites[label_name]
                     break
 
                 if label_name in parsed_labels:
-                    self._label_data[label_id] = parsed_labels[label_name]
+                    label_data[label_id] = parsed_labels[label_name]
                     break
+        self._label_data = label_data
         return self._label_data
 
     def get_additional_tags(self):
@@ -302,31 +1728,148 @@ class LabelsWrapper(object):
             return "%s (or %s)" % (label_map[0], " or ".join(label_map[1:]))
 
 
+class LabelsCache(object):
+    """On-disk cache of checked labels shared by tasks on the builder
+
+    Entries are JSON files named by hash of the key. Reading an entry updates
+    its mtime, when the total size of the entries exceeds max_size the least
+    recently used ones are removed.
+    """
+    def __init__(self, directory, max_size=LABELS_CACHE_SIZE, logger=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.logger = logger or logging.getLogger(__name__)
+
+    @staticmethod
+    def key(src, release=None):
+        """Key of labels of the SCM URL src, including its module and commit"""
+        return hashlib.sha256(json.dumps([src, release]).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        """Returns cached entry or None"""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key, entry):
+        try:
+            koji.ensuredir(self.directory)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.', suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, self._path(key))
+            self._evict()
+        except OSError as error:
+            self.logger.warning("Couldn't store labels in cache %s: %s", self.directory, error)
+
+    def _evict(self):
+        entries = []
+        for fname in os.listdir(self.directory):
+            if not fname.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, fname)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed by another task
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total_size -= size
+
+
 class BaseContainerTask(BaseTaskHandler):
     """Common class for BuildContainerTask and BuildSourceContainerTask"""
     def __init__(self, id, method, params, session, options, workdir=None):
         # pylint: disable=redefined-builtin
         BaseTaskHandler.__init__(self, id, method, params, session, options, workdir)
         self._osbs = None
+        self._osbs_conf = None
+        self.hub = HubCalls(session)
+        self.timings = PhaseTimings()
+        # (pool, requests sent by it) when OSBS requests were counted in metrics
+        self._osbs_requests_recorded = self._osbs_requests_sent()
         self._log_handler_added = False
         self.incremental_log_basename = 'osbs-build.log'
+        # rule used to find platform of a task run, see route_by_platform_name()
+        self.log_routing_rule = route_by_platform_name
+        # log streaming between the build process and the task process
+        self._log_stream_writer = None
+        self._log_stream_reader = None
+        self._streamed_logs = ()
+        # messages of user warnings received from the build process
+        self._user_warnings = []
+
+    @classmethod
+    def validate_params(cls, params):
+        """Validate task parameters against PARAMS_SCHEMA like jsonschema.validate()
+
+        The schema is checked and its validator created only once per class.
+        """
+        import jsonschema
+        validator = cls.__dict__.get('_params_validator')
+        if validator is None:
+            validator_cls = jsonschema.validators.validator_for(cls.PARAMS_SCHEMA)
+            validator_cls.check_schema(cls.PARAMS_SCHEMA)
+            validator = validator_cls(cls.PARAMS_SCHEMA)
+            cls._params_validator = validator
+
+        error = jsonschema.exceptions.best_match(validator.iter_errors(params))
+        if error is not None:
+            raise error
+
+    def osbs_conf(self):
+        """osbs-client Configuration of the task
+
+        It's parsed once, the build process creates its own OSBS object from
+        it after fork.
+        """
+        if self._osbs_conf is None:
+            from osbs.conf import Configuration
 
-    def osbs(self):
-        """Handler of OSBS object"""
-        if not self._osbs:
             conf_section = None
             if self.method in BuildContainerTask.Methods:
                 conf_section = DEFAULT_CONF_BINARY_SECTION
             elif self.method in BuildSourceContainerTask.Methods:
                 conf_section = DEFAULT_CONF_SOURCE_SECTION
+            self._osbs_conf = Configuration(conf_section=conf_section)
+        return self._osbs_conf
 
-            os_conf = Configuration(conf_section=conf_section)
-            self._osbs = OSBS(os_conf)
-            if not self._osbs:
-                msg = 'Could not successfully instantiate `osbs`'
-                raise ContainerError(msg)
-            log_level = logging.DEBUG if os_conf.get_verbosity() else logging.INFO
-            self.setup_osbs_logging(level=log_level)
+    def osbs(self):
+        """Handler of OSBS object"""
+        if not self._osbs:
+            from osbs.api import OSBS
+
+            with self.timings.phase('osbs_init'):
+                os_conf = self.osbs_conf()
+                self._osbs = OSBS(os_conf)
+                if not self._osbs:
+                    msg = 'Could not successfully instantiate `osbs`'
+                    raise ContainerError(msg)
+                config = read_plugin_config()
+                setup_http_pool(pool_size=config.getint('osbs', 'http_pool_size',
+                                                        fallback=HTTP_POOL_SIZE),
+                                keep_alive=config.getboolean('osbs', 'http_keep_alive',
+                                                             fallback=True),
+                                logger=self.logger)
+                log_level = logging.DEBUG if os_conf.get_verbosity() else logging.INFO
+                self.setup_osbs_logging(level=log_level)
 
         return self._osbs
 
@@ -334,7 +1877,7 @@ class BaseContainerTask(BaseTaskHandler):
         # Setting handler more than once will cause duplicated log lines.
         # Log handler will persist in child process.
         if not self._log_handler_added:
-            osbs_logger = logging.getLogger(osbs.__name__)
+            osbs_logger = logging.getLogger('osbs')
             osbs_logger.setLevel(level)
             log_file = os.path.join(self.resultdir(), 'osbs-client.log')
             handler = logging.FileHandler(filename=log_file)
@@ -359,39 +1902,242 @@ class BaseContainerTask(BaseTaskHandler):
             os.makedirs(path)
         return path
 
+    def sparse_checkout_enabled(self):
+        """Whether only files needed for checking labels are checked out before the build"""
+        return read_plugin_config().getboolean('scm', 'sparse_checkout', fallback=False)
+
+    def metrics(self):
+        """Textfile metrics, None when they aren't configured"""
+        directory = read_plugin_config().get('metrics', 'textfile_dir', fallback=None)
+        if not directory:
+            return None
+        return TextfileMetrics(directory, logger=self.logger)
+
+    @staticmethod
+    def _osbs_requests_sent():
+        """(pool, requests sent by it) of this process, pool is None without pooling"""
+        pool = http_pool()
+        return pool, pool.requests_sent if pool is not None else 0
+
+    def _record_metrics(self, samples=(), in_flight=None):
+        """Record samples of metrics and OSBS requests made since the last call"""
+        metrics = self.metrics()
+        if metrics is None:
+            return
+        pool, requests_sent = self._osbs_requests_sent()
+        if pool is not None:
+            # requests are counted only by pooled connections, all requests
+            # of a pool set up since the last call are new
+            recorded_pool, recorded = self._osbs_requests_recorded
+            if recorded_pool is not pool:
+                recorded = 0
+            self._osbs_requests_recorded = (pool, requests_sent)
+            samples = list(samples) + [('osbs_requests_total', {}, requests_sent - recorded)]
+        try:
+            metrics.record(self.method, samples, in_flight=in_flight)
+        except Exception as error:
+            self.logger.warning("Failed to record metrics: %s", error)
+
+    def log_streaming_enabled(self):
+        """Whether build logs are streamed to this process instead of re-read from disk"""
+        return read_plugin_config().getboolean('logs', 'streaming', fallback=False)
+
+    def _open_log_streams(self):
+        """Create pipe for streaming logs from the build process, call before fork"""
+        read_fd, write_fd = os.pipe()
+        try:
+            fcntl.fcntl(write_fd, getattr(fcntl, 'F_SETPIPE_SZ', 1031), LOG_STREAM_PIPE_SIZE)
+        except OSError as error:
+            self.logger.debug("Couldn't resize log streaming pipe: %s", error)
+        return read_fd, write_fd
+
+    def _open_log(self, logs_dir, log_filename):
+        """Open buffered log for writing, it's sent to the task process when streaming"""
+        if self._log_stream_writer is not None:
+            return BufferedLogWriter(StreamedLogFile(self._log_stream_writer, log_filename))
+        return BufferedLogWriter(open(os.path.join(logs_dir, log_filename), 'wb'))
+
+    def log_compression(self):
+        """How uploaded logs are compressed, one of LOG_COMPRESSION_MODES"""
+        mode = read_plugin_config().get('logs', 'compression', fallback='none')
+        if mode not in LOG_COMPRESSION_MODES:
+            self.logger.warning("Unknown log compression %r, logs are uploaded uncompressed",
+                                mode)
+            return 'none'
+        return mode
+
+    def _upload_streamed_logs(self, uploader):
+        """Pass received log data to uploader, return number of received bytes
+
+        User warnings are collected and added to their log as they arrive.
+        """
+        received = 0
+        for kind, name, data in self._log_stream_reader.read_records():
+            if kind == LOG_STREAM_USER_WARNING:
+                message = data.decode('utf-8')
+                self.logger.info("User warning: %s", message)
+                if self._user_warnings:
+                    data = b'\n' + data
+                self._user_warnings.append(message)
+            elif kind != LOG_STREAM_DATA:
+                continue
+            offset = self._streamed_logs.append(name, data)
+            uploader.add(name, offset, data)
+            received += len(data)
+        return received
+
+    def _send_user_warning(self, line, sent):
+        """Send message of user warning in line to the task process, unless it was sent"""
+        from osbs.utils import UserWarningsStore
+        warning = UserWarningsStore()
+        warning.store(line)
+        for message in warning:
+            if message not in sent:
+                sent.add(message)
+                self._log_stream_writer.send(LOG_STREAM_USER_WARNING, 'user_warnings.log',
+                                             message.encode('utf-8'))
+
+    def log_upload_intervals(self):
+        """Minimal and maximal number of seconds between log upload passes"""
+        config = read_plugin_config()
+        min_interval = config.getfloat('logs', 'upload_interval', fallback=LOG_UPLOAD_INTERVAL)
+        max_interval = config.getfloat('logs', 'upload_max_interval',
+                                       fallback=LOG_UPLOAD_MAX_INTERVAL)
+        return min_interval, max(min_interval, max_interval)
+
+    def log_uploader(self, uploadpath, compress=False):
+        """LogUploader coalescing uploads as configured in the [logs] section"""
+        config = read_plugin_config()
+        coalesce_size = config.getint('logs', 'coalesce_size', fallback=LOG_UPLOAD_COALESCE_SIZE)
+        coalesce_age = config.getfloat('logs', 'coalesce_age', fallback=LOG_UPLOAD_COALESCE_AGE)
+        workers = config.getint('logs', 'upload_workers', fallback=LOG_UPLOAD_WORKERS)
+        return LogUploader(self.session, uploadpath, self.logger, compress=compress,
+                           coalesce_size=coalesce_size, coalesce_age=coalesce_age,
+                           workers=workers)
+
     def _incremental_upload_logs(self, child_pid=None):
         resultdir = self.resultdir()
         uploadpath = self.getUploadPath()
-        watcher = FileWatcher(resultdir, logger=self.logger)
+        watcher = FileWatcher(resultdir, logger=self.logger, ignore=self._streamed_logs)
+        streams = []
+        if self._log_stream_reader is not None:
+            streams.append(self._log_stream_reader)
+
+        min_interval, max_interval = self.log_upload_intervals()
+        child = None
+        exit_fds = []
+        if child_pid is not None:
+            child = ChildWatch(child_pid)
+            if child.fileno() is not None:
+                exit_fds.append(child)
+            else:
+                max_interval = min(max_interval, max(min_interval, LOG_WATCH_TIMEOUT))
+        interval = min_interval
+        uploader = self.log_uploader(uploadpath, compress=self.log_compression() == 'chunks')
+
         finished = False
         try:
             while not finished:
-                if child_pid is None:
+                if child is None:
                     finished = True
                 else:
-                    time.sleep(1)
-                    status = os.waitpid(child_pid, os.WNOHANG)
-                    if status[0] != 0:
-                        finished = True
+                    # wake up when coalesced data are due for upload
+                    timeout = uploader.timeout()
+                    if timeout is None or timeout > interval:
+                        timeout = interval
+                    watcher.wait(timeout, min_interval=min_interval, fds=streams,
+                                 exit_fds=exit_fds)
+                    finished = child.exited()
+
+                received = 0
+                if streams:
+                    received += self._upload_streamed_logs(uploader)
 
                 for result in watcher.files_to_upload():
                     if result is False:
                         return
                     (fd, fname) = result
-                    incremental_upload(self.session, fname, fd, uploadpath, logger=self.logger)
+                    received += uploader.add_file(fname, fd)
+
+                uploader.flush(force=finished)
+
+                # logs are quiet, wait longer for the next pass
+                interval = min_interval if received else min(interval * 2, max_interval)
         finally:
-            watcher.clean()
+            try:
+                uploader.close()
+            finally:
+                watcher.clean()
+                if child is not None:
+                    child.close()
+        uploader.log_stats()
+        if uploader.retries:
+            self._record_metrics([('log_upload_retries_total', {}, uploader.retries)])
 
     def _upload_logs_once(self):
         """Upload log updates without waiting for anything"""
         try:
-            self._incremental_upload_logs()
+            with self.timings.phase('upload_logs'):
+                self._incremental_upload_logs()
+                self._finalize_compressed_logs()
         except koji.ActionNotAllowed:
             pass
 
+    def _report_timings(self):
+        """Write timings of task phases to timings.json, upload it and log a summary
+
+        Phase times are recorded as metrics, the task isn't in flight anymore.
+        """
+        try:
+            path = os.path.join(self.resultdir(), 'timings.json')
+            with open(path, 'w') as f:
+                json.dump(self.timings.report(), f, indent=2)
+            with open(path, 'rb') as f:
+                incremental_upload(self.session, 'timings.json', f, self.getUploadPath(),
+                                   logger=self.logger)
+        except Exception as error:
+            self.logger.warning("Failed to upload task timings: %s", error)
+        self.logger.info(self.timings.summary())
+        self._record_metrics([('phase_seconds', {'phase': phase['name']}, phase['seconds'])
+                              for phase in self.timings.report()['phases']],
+                             in_flight=False)
+
+    def _finalize_compressed_logs(self):
+        """Upload finished logs compressed as <name>.log.gz with 'final' compression
+
+        The uncompressed logs were uploaded while the build was running, on the
+        hub they are replaced by their tails afterwards.
+        """
+        if self.log_compression() != 'final':
+            return
+        resultdir = self.resultdir()
+        uploadpath = self.getUploadPath()
+        for fname in sorted(os.listdir(resultdir)):
+            if not fname.endswith('.log'):
+                continue
+            # compressed outside of resultdir, which is watched for logs to upload
+            with open(os.path.join(resultdir, fname), 'rb') as source, \
+                    tempfile.TemporaryFile() as target:
+                compressor = zlib.compressobj(LOG_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+                for data in iter(functools.partial(source.read, LOG_UPLOAD_CHUNK_SIZE), b''):
+                    target.write(compressor.compress(data))
+                target.write(compressor.flush())
+                target.seek(0)
+                incremental_upload(self.session, fname + '.gz', target, uploadpath,
+                                   logger=self.logger)
+
+                size = source.tell()
+                if size > LOG_COMPRESSION_TAIL:
+                    # one byte more shows whether the tail starts with a whole line
+                    source.seek(size - LOG_COMPRESSION_TAIL - 1)
+                    tail = OffsetBytesIO(log_tail(source.read()), 0)
+                    incremental_upload(self.session, fname, tail, uploadpath,
+                                       logger=self.logger)
+
     def _write_logs(self, build_id, logs_dir, platforms: list = None):
-        logfiles = {'noarch': open(os.path.join(logs_dir, self.incremental_log_basename),
-                                   'wb')}
+        flusher = LogFlusher(self.logger)
+        logfiles = {'noarch': flusher.add(self._open_log(logs_dir,
+                                                         self.incremental_log_basename))}
         self.logger.info("Will write follow log: %s", self.incremental_log_basename)
         try:
             logs = self.osbs().get_build_logs(build_id, follow=True, wait=True)
@@ -399,73 +2145,93 @@ class BaseContainerTask(BaseTaskHandler):
             msg = "Exception while waiting for build logs: %s" % error
             raise ContainerError(msg)
 
+        from osbs.utils import UserWarningsStore
         user_warnings = UserWarningsStore()
+        # user warnings are sent to the task process when logs are streamed
+        streamed_warnings = set()
         final_platforms = []
+        log_router = LogRouter(platforms, rule=self.log_routing_rule)
 
-        for task_run_name, line in logs:
-            if METADATA_TAG in line:
-                _, meta_file = line.rsplit(' ', 1)
-                source_file = os.path.join(koji.pathinfo.work(), meta_file)
-                uploadpath = os.path.join(logs_dir, os.path.basename(meta_file))
-                shutil.copy(source_file, uploadpath)
-                continue
+        lines = 0
+        written = 0
+        flusher.start()
+        try:
+            for task_run_name, line in logs:
+                lines += 1
+                if METADATA_TAG in line:
+                    _, meta_file = line.rsplit(' ', 1)
+                    source_file = os.path.join(koji.pathinfo.work(), meta_file)
+                    uploadpath = os.path.join(logs_dir, os.path.basename(meta_file))
+                    method = link_or_copy(source_file, uploadpath)
+                    self.logger.debug("Metadata file %s added to logs (%s)", meta_file, method)
+                    continue
 
-            if user_warnings.is_user_warning(line):
-                user_warnings.store(line)
-                continue
+                # a substring check skips the user warnings regex for ordinary lines
+                if USER_WARNING_MARK in line and user_warnings.is_user_warning(line):
+                    if self._log_stream_writer is not None:
+                        self._send_user_warning(line, streamed_warnings)
+                    else:
+                        user_warnings.store(line)
+                    continue
 
-            if platforms:
-                task_platform = next(
-                    (platform for platform in platforms if
-                     platform.replace('_', '-') in task_run_name),
-                    'noarch'
-                )
-            else:
-                task_platform = 'noarch'
+                task_platform = log_router[task_run_name]
 
-            if task_platform not in logfiles:
-                if task_platform != 'noarch' and not final_platforms:
-                    final_platforms = self.osbs().get_final_platforms(build_id)
+                if task_platform not in logfiles:
+                    if task_platform != 'noarch' and not final_platforms:
+                        final_platforms = self.osbs().get_final_platforms(build_id)
 
-                    if not final_platforms:
-                        self.logger.info("Couldn't obtain final platforms from build")
-                        final_platforms = platforms
+                        if not final_platforms:
+                            self.logger.info("Couldn't obtain final platforms from build")
+                            final_platforms = platforms
 
-                if (task_platform != 'noarch') and (task_platform not in final_platforms):
-                    continue
+                    if (task_platform != 'noarch') and (task_platform not in final_platforms):
+                        continue
 
-                if task_platform != 'noarch':
-                    logfiles['noarch'].write(bytearray(f'{task_platform} build has started. '
-                                                       'Check platform specific logs\n', 'utf-8'))
+                    if task_platform != 'noarch':
+                        logfiles['noarch'].write(bytearray(f'{task_platform} build has started. '
+                                                           'Check platform specific logs\n',
+                                                           'utf-8'))
 
-                log_filename = f'{task_platform}.log'
-                logfiles[task_platform] = open(os.path.join(logs_dir, log_filename),
-                                               'wb')
+                    log_filename = f'{task_platform}.log'
+                    logfiles[task_platform] = flusher.add(self._open_log(logs_dir,
+                                                                         log_filename))
 
-            outfile = logfiles[task_platform]
+                outfile = logfiles[task_platform]
 
-            remote_sources_log = None
-            if task_run_name == REMOTE_SOURCES_TASKNAME:
-                if REMOTE_SOURCES_LOGNAME in logfiles:
-                    remote_sources_log = logfiles[REMOTE_SOURCES_LOGNAME]
-                else:
-                    log_filename = f"{REMOTE_SOURCES_LOGNAME}.log"
-                    remote_sources_log = open(os.path.join(logs_dir, log_filename),
-                                              'wb')
-                    logfiles[REMOTE_SOURCES_LOGNAME] = remote_sources_log
+                remote_sources_log = None
+                if task_run_name == REMOTE_SOURCES_TASKNAME:
+                    if REMOTE_SOURCES_LOGNAME in logfiles:
+                        remote_sources_log = logfiles[REMOTE_SOURCES_LOGNAME]
+                    else:
+                        log_filename = f"{REMOTE_SOURCES_LOGNAME}.log"
+                        remote_sources_log = flusher.add(self._open_log(logs_dir, log_filename))
+                        logfiles[REMOTE_SOURCES_LOGNAME] = remote_sources_log
 
-            try:
-                outfile.write(("%s\n" % line).encode('utf-8'))
-                outfile.flush()
-                if remote_sources_log:
-                    remote_sources_log.write(("%s\n" % line).encode('utf-8'))
-                    remote_sources_log.flush()
-            except Exception as error:
-                msg = "Exception (%s) while writing build logs: %s" % (type(error), error)
-                raise ContainerError(msg)
+                try:
+                    data = ("%s\n" % line).encode('utf-8')
+                    outfile.write(data)
+                    written += len(data)
+                    if remote_sources_log:
+                        remote_sources_log.write(data)
+                except Exception as error:
+                    msg = "Exception (%s) while writing build logs: %s" % (type(error), error)
+                    raise ContainerError(msg)
+        finally:
+            flusher.stop()
+            self._record_metrics([('log_lines_total', {}, lines),
+                                  ('log_bytes_total', {}, written)])
+            # buffered lines are written also when following the logs fails,
+            # they are the closest ones to the failure
+            close_error = None
+            for logfile in logfiles.values():
+                try:
+                    logfile.close()
+                except Exception as error:
+                    close_error = close_error or error
 
-        for logfile in logfiles.values():
-            logfile.close()
+        if close_error is not None:
+            msg = "Exception (%s) while writing build logs: %s" % (type(close_error), close_error)
+            raise ContainerError(msg)
 
         if user_warnings:
             try:
@@ -483,9 +2249,10 @@ class BaseContainerTask(BaseTaskHandler):
     def _write_incremental_logs(self, build_id, logs_dir, platforms: list = None):
         self._write_logs(build_id, logs_dir, platforms=platforms)
 
-        if self.osbs().build_not_finished(build_id):
+        build_status = BuildStatusSnapshot(self.osbs(), build_id)
+        if build_status.not_finished:
             raise ContainerError("Build log finished but build still has not "
-                                 "finished: %s." % self.osbs().get_build_reason(build_id))
+                                 "finished: %s." % build_status.reason)
 
     def _read_user_warnings(self, logs_dir):
         log_filename = os.path.join(logs_dir, "user_warnings.log")
@@ -504,8 +2271,8 @@ class BaseContainerTask(BaseTaskHandler):
 
         Raises with koji.BuildError if package is not whitelisted or blocked.
         """
-        pkg_cfg = self.session.getPackageConfig(target_info['dest_tag_name'],
-                                                name)
+        with self.timings.phase('check_whitelist'):
+            pkg_cfg = self.hub.getPackageConfig(target_info['dest_tag_name'], name)
         self.logger.debug("%r", pkg_cfg)
         # Make sure package is on the list for this tag
         if pkg_cfg is None:
@@ -520,7 +2287,8 @@ class BaseContainerTask(BaseTaskHandler):
             return self._handle_build_response(build_id, platforms)
         finally:
             try:
-                self.osbs().remove_build(build_id)
+                with self.timings.phase('remove_build'):
+                    self.osbs().remove_build(build_id)
             except Exception as error:
                 self.logger.warning("Failed to remove build %s : %s", build_id, error)
 
@@ -540,14 +2308,30 @@ class BaseContainerTask(BaseTaskHandler):
 
         osbs_logs_dir = self.resultdir()
         koji.ensuredir(osbs_logs_dir)
+        streaming = self.log_streaming_enabled()
+        if streaming:
+            read_fd, write_fd = self._open_log_streams()
         pid = os.fork()
         if pid:
+            if streaming:
+                os.close(write_fd)
+                self._log_stream_reader = LogStreamReader(read_fd)
+                self._streamed_logs = StreamedLogs(osbs_logs_dir)
             try:
-                self._incremental_upload_logs(pid)
+                with self.timings.phase('log_follow'):
+                    self._incremental_upload_logs(pid)
             except koji.ActionNotAllowed:
                 pass
+            finally:
+                if streaming:
+                    self._log_stream_reader.close()
+                    self._log_stream_reader = None
+                    self._streamed_logs.close()
         else:
             self._osbs = None
+            if streaming:
+                os.close(read_fd)
+                self._log_stream_writer = LogStreamWriter(write_fd)
 
             try:
                 self._write_incremental_logs(build_id, osbs_logs_dir, platforms=platforms)
@@ -556,23 +2340,28 @@ class BaseContainerTask(BaseTaskHandler):
                 os._exit(1)
             os._exit(0)
 
-        # User warnings are being processed in a child process,
-        # so we have to collect them back when the process ends
-        user_warnings = self._read_user_warnings(osbs_logs_dir)
+        # User warnings are being processed in a child process, streamed ones
+        # were received with the logs, others are collected back from their log
+        if streaming:
+            user_warnings = self._user_warnings
+        else:
+            user_warnings = self._read_user_warnings(osbs_logs_dir)
 
         # there is race between all pods finished and pipeline run changing status
-        self.osbs().wait_for_build_to_finish(build_id)
+        with self.timings.phase('wait_for_build'):
+            self.osbs().wait_for_build_to_finish(build_id)
 
-        has_succeeded = self.osbs().build_has_succeeded(build_id)
-        build_results = self.osbs().get_build_results(build_id)
+        with self.timings.phase('collect_results'):
+            build_status = BuildStatusSnapshot(self.osbs(), build_id)
+        has_succeeded = build_status.succeeded
+        build_results = build_status.results
 
         self.logger.debug("OSBS build finished with status: %s. Build "
-                          "response: %s.", self.osbs().get_build_reason(build_id),
-                          self.osbs().get_build(build_id))
+                          "response: %s.", build_status.reason, build_status.data)
 
         self.logger.info("Response status: %r", has_succeeded)
 
-        if self.osbs().build_was_cancelled(build_id):
+        if build_status.cancelled:
             self.session.cancelTask(self.id)
             self._upload_logs_once()
             raise ContainerCancelled('Image build was cancelled by OSBS.')
@@ -580,11 +2369,12 @@ class BaseContainerTask(BaseTaskHandler):
         elif not has_succeeded:
             error_message = None
             try:
-                error_message = self.osbs().get_build_error_message(build_id)
+                with self.timings.phase('collect_results'):
+                    error_message = self.osbs().get_build_error_message(build_id)
             except Exception:
                 self.logger.exception("Error during getting error message")
 
-            if self.osbs().build_not_finished(build_id):
+            if build_status.not_finished:
                 try:
                     self.osbs().cancel_build(build_id)
                 except Exception as ex:
@@ -754,16 +2544,17 @@ class BuildContainerTask(BaseContainerTask):
         scm = My_SCM(src)
         scm_policy_opts = {
             'user_id': task_info['owner'],
-            'channel': self.session.getChannel(task_info['channel_id'],
-                                               strict=True)['name'],
+            'channel': self.hub.getChannel(task_info['channel_id'], strict=True)['name'],
             'scratch': bool(scratch),
         }
-        scm.assert_allowed(
-                allowed=self.options.allowed_scms,
-                session=self.session,
-                by_config=self.options.allowed_scms_use_config,
-                by_policy=self.options.allowed_scms_use_policy,
-                policy_data=scm_policy_opts)
+        # policy is evaluated once per task for the same source
+        policy_key = ('assert_allowed', src, tuple(sorted(scm_policy_opts.items())))
+        self.hub.memoize(policy_key, scm.assert_allowed,
+                         allowed=self.options.allowed_scms,
+                         session=self.session,
+                         by_config=self.options.allowed_scms_use_config,
+                         by_policy=self.options.allowed_scms_use_policy,
+                         policy_data=scm_policy_opts)
 
         return scm
 
@@ -783,9 +2574,9 @@ class BuildContainerTask(BaseContainerTask):
             else:
                 self.logger.warning("deprecated option 'skip_build' in build params")
 
-        this_task = self.session.getTaskInfo(self.id)
+        this_task = self.hub.getTaskInfo(self.id)
         self.logger.debug("This task: %r", this_task)
-        owner_info = self.session.getUser(this_task['owner'])
+        owner_info = self.hub.getUser(this_task['owner'])
         self.logger.debug("Started by %s", owner_info['name'])
 
         scm = self._get_scm(src, this_task, scratch)
@@ -835,11 +2626,13 @@ class BuildContainerTask(BaseContainerTask):
         create_build_args['max_buildtime_limit'] =\
             self.osbs().os_conf.get_max_buildtime_limit()
 
+        from osbs.exceptions import OsbsValidationException
         try:
             create_method = self.osbs().create_binary_container_build
             self.logger.debug("Starting %s with params: '%s",
                               create_method, create_build_args)
-            build_response = create_method(**create_build_args)
+            with self.timings.phase('osbs_create'):
+                build_response = create_method(**create_build_args)
         except AttributeError:
             raise koji.BuildError("method %s doesn't exists in osbs" % create_method)
         except OsbsValidationException as exc:
@@ -880,11 +2673,38 @@ class BuildContainerTask(BaseContainerTask):
             raise koji.BuildError("No matching arches were found")
         return list(archdict.keys())
 
+    def _prefetch_hub_data(self, target):
+        """Get data needed before the build is started in as few hub round-trips as possible"""
+        with self.hub.batch() as batch:
+            batch.getLastEvent()
+            batch.getTaskInfo(self.id)
+        self.event_id = self.hub.getLastEvent()['id']
+        this_task = self.hub.getTaskInfo(self.id)
+
+        with self.hub.batch() as batch:
+            batch.getBuildTarget(target, event=self.event_id)
+            batch.getUser(this_task['owner'])
+            batch.getChannel(this_task['channel_id'], strict=True)
+
+    def _sparse_checkout(self, scm, uploadpath):
+        """Checkout only files needed for checking labels, returns None if it fails"""
+        scmdir = os.path.join(self.workdir, 'sources-sparse')
+        koji.ensuredir(scmdir)
+        logfile = os.path.join(self.workdir, 'sparse-checkout-for-labels.log')
+        try:
+            return scm.sparse_checkout(scmdir, LABELS_CHECKOUT_FILES, self.session,
+                                       uploadpath, logfile)
+        except Exception as error:
+            self.logger.warning("Sparse checkout failed, falling back to full checkout: %s",
+                                error)
+            shutil.rmtree(scmdir, ignore_errors=True)
+            return None
+
     def fetchDockerfile(self, src, build_tag, scratch):
         """
         Gets Dockerfile. Roughly corresponds to getSRPM method of build task
         """
-        this_task = self.session.getTaskInfo(self.id)
+        this_task = self.hub.getTaskInfo(self.id)
         scm = self._get_scm(src, this_task, scratch)
 
         scmdir = os.path.join(self.workdir, 'sources')
@@ -900,7 +2720,11 @@ class BuildContainerTask(BaseContainerTask):
                            scratch=self.opts.get('scratch', False))
 
         # Check out sources from the SCM
-        sourcedir = scm.checkout(scmdir, self.session, uploadpath, logfile)
+        sourcedir = None
+        if self.sparse_checkout_enabled():
+            sourcedir = self._sparse_checkout(scm, uploadpath)
+        if not sourcedir:
+            sourcedir = scm.checkout(scmdir, self.session, uploadpath, logfile)
 
         self.run_callbacks("postSCMCheckout", scminfo=scm.get_info(), build_tag=build_tag,
                            scratch=self.opts.get('scratch', False), srcdir=sourcedir)
@@ -910,9 +2734,47 @@ class BuildContainerTask(BaseContainerTask):
             raise koji.BuildError("Dockerfile file missing: %s" % fn)
         return fn
 
+    def labels_cache(self):
+        """Cache of checked labels, None when it isn't configured"""
+        config = read_plugin_config()
+        directory = config.get('labels', 'cache_dir', fallback=None)
+        if not directory:
+            return None
+        return LabelsCache(directory,
+                           max_size=config.getint('labels', 'cache_max_size',
+                                                  fallback=LABELS_CACHE_SIZE),
+                           logger=self.logger)
+
+    def _labels_cache_key(self, src, label_overwrites):
+        """Key of checked labels, None when they can't be cached
+
+        Only labels of git commits are cached. A cache hit skips the checkout,
+        so nothing is cached when preSCMCheckout or postSCMCheckout callbacks
+        of other plugins are registered, they have to run for every build.
+        """
+        if any(koji.plugin.callbacks.get(cbtype) for cbtype in
+               ('preSCMCheckout', 'postSCMCheckout')):
+            return None
+        scm = My_SCM(src)
+        if not GIT_COMMIT_RE.match(scm.revision):
+            return None
+        release = label_overwrites.get(LABEL_NAME_MAP['RELEASE'][0])
+        return LabelsCache.key(src, release)
+
     def checkLabels(self, src, build_tag, scratch, label_overwrites=None):
         label_overwrites = label_overwrites or {}
-        dockerfile_path = self.fetchDockerfile(src, build_tag, scratch)
+        labels_cache = self.labels_cache()
+        cache_key = None
+        if labels_cache:
+            cache_key = self._labels_cache_key(src, label_overwrites)
+        if cache_key:
+            entry = labels_cache.get(cache_key)
+            if entry:
+                self.logger.info("Using labels checked by a previous build of %s", src)
+                return (entry['component'], entry['expected_nvr'])
+
+        with self.timings.phase('scm_checkout'):
+            dockerfile_path = self.fetchDockerfile(src, build_tag, scratch)
         labels_wrapper = LabelsWrapper(dockerfile_path,
                                        logger_name=self.logger.name,
                                        label_overwrites=label_overwrites)
@@ -929,7 +2791,8 @@ class BuildContainerTask(BaseContainerTask):
         # see https://github.com/docker/docker/issues/8445
 
         data = labels_wrapper.get_data_labels()
-        tags = labels_wrapper.get_additional_tags()
+        additional_tags = labels_wrapper.get_additional_tags()
+        tags = list(additional_tags)
         check_nvr = False
 
         if 'RELEASE' in data and 'VERSION' in data:
@@ -945,13 +2808,28 @@ class BuildContainerTask(BaseContainerTask):
                     "Docker cannot create image with a tag longer than 128, "
                     "current version-release tag length is %s" % len(longest_tag))
 
-        if check_nvr:
-            return (data['COMPONENT'], labels_wrapper.get_expected_nvr())
-        return (data['COMPONENT'], None)
+        expected_nvr = labels_wrapper.get_expected_nvr() if check_nvr else None
+        if cache_key:
+            labels_cache.put(cache_key, {
+                'src': src,
+                'labels': labels_wrapper.get_labels(),
+                'additional_tags': additional_tags,
+                'component': data['COMPONENT'],
+                'expected_nvr': expected_nvr,
+            })
+        return (data['COMPONENT'], expected_nvr)
 
     def handler(self, src, target, opts=None):
-        jsonschema.validate([src, target, opts], self.PARAMS_SCHEMA)
+        self.validate_params([src, target, opts])
         self.opts = opts
+        self._record_metrics(in_flight=True)
+        try:
+            return self._handler(src, target, opts)
+        finally:
+            # also tasks failing before their build report timings
+            self._report_timings()
+
+    def _handler(self, src, target, opts):
         component = None
 
         if not opts.get('git_branch'):
@@ -960,8 +2838,9 @@ class BuildContainerTask(BaseContainerTask):
         if opts.get('scratch') and opts.get('isolated'):
             raise koji.BuildError("Build cannot be both isolated and scratch")
 
-        self.event_id = self.session.getLastEvent()['id']
-        target_info = self.session.getBuildTarget(target, event=self.event_id)
+        with self.timings.phase('hub_prefetch'):
+            self._prefetch_hub_data(target)
+        target_info = self.hub.getBuildTarget(target, event=self.event_id)
         if not target_info:
             raise koji.BuildError("Target `%s` not found" % target)
 
@@ -972,7 +2851,7 @@ class BuildContainerTask(BaseContainerTask):
         release_overwrite = opts.get('release')
 
         if flatpak:
-            if not osbs_flatpak_support:
+            if not osbs_flatpak_support():
                 raise koji.BuildError("osbs-client on koji builder doesn't have Flatpak support")
 
             expected_nvr = None
@@ -980,13 +2859,20 @@ class BuildContainerTask(BaseContainerTask):
             label_overwrites = {}
             if release_overwrite:
                 label_overwrites = {LABEL_NAME_MAP['RELEASE'][0]: release_overwrite}
-            component, expected_nvr = self.checkLabels(src, label_overwrites=label_overwrites,
-                                                       build_tag=build_tag,
-                                                       scratch=opts.get('scratch'))
+            with self.timings.phase('check_labels'):
+                component, expected_nvr = self.checkLabels(src,
+                                                           label_overwrites=label_overwrites,
+                                                           build_tag=build_tag,
+                                                           scratch=opts.get('scratch'))
 
             # scratch builds do not get imported, and consequently not tagged
             if not self.opts.get('scratch'):
-                self.check_whitelist(component, target_info)
+                with self.timings.phase('check_whitelist'):
+                    with self.hub.batch(strict=False) as batch:
+                        batch.getPackageConfig(target_info['dest_tag_name'], component)
+                        if expected_nvr:
+                            batch.getBuild(expected_nvr)
+                    self.check_whitelist(component, target_info)
 
         if not SCM.is_scm_url(src):
             raise koji.BuildError('Invalid source specification: %s' % src)
@@ -994,7 +2880,7 @@ class BuildContainerTask(BaseContainerTask):
         # Scratch and auto release builds shouldn't be checked for nvr
         if not self.opts.get('scratch') and expected_nvr:
             try:
-                build = self.session.getBuild(expected_nvr)
+                build = self.hub.getBuild(expected_nvr)
                 build_id = build['id']
             except Exception:
                 self.logger.info("No build for %s found", expected_nvr, exc_info=True)
@@ -1030,6 +2916,7 @@ class BuildContainerTask(BaseContainerTask):
         result = self.createContainer(**kwargs)
 
         self.logger.debug("Result: %r", result)
+        self.logger.debug("Hub lookups: %s", self.hub.stats())
 
         if not result:
             return {
@@ -1113,9 +3000,9 @@ class BuildSourceContainerTask(BaseContainerTask):
     def createSourceContainer(self, target_info=None, scratch=None, component=None,
                               koji_build_id=None, koji_build_nvr=None, signing_intent=None,
                               userdata=None):
-        this_task = self.session.getTaskInfo(self.id)
+        this_task = self.hub.getTaskInfo(self.id)
         self.logger.debug("This task: %r", this_task)
-        owner_info = self.session.getUser(this_task['owner'])
+        owner_info = self.hub.getUser(this_task['owner'])
         self.logger.debug("Started by %s", owner_info['name'])
 
         create_build_args = {
@@ -1133,11 +3020,13 @@ class BuildSourceContainerTask(BaseContainerTask):
         if userdata:
             create_build_args['userdata'] = userdata
 
+        from osbs.exceptions import OsbsValidationException
         try:
             create_method = self.osbs().create_source_container_build
             self.logger.debug("Starting %s with params: '%s",
                               create_method, create_build_args)
-            build_response = create_method(**create_build_args)
+            with self.timings.phase('osbs_create'):
+                build_response = create_method(**create_build_args)
         except AttributeError:
             raise koji.BuildError("method %s doesn't exists in osbs" % create_method)
         except OsbsValidationException as exc:
@@ -1145,10 +3034,23 @@ class BuildSourceContainerTask(BaseContainerTask):
 
         return self.handle_build_response(self.osbs().get_build_name(build_response))
 
+    def _prefetch_hub_data(self, target, build_identifier):
+        """Get data needed before the build is started in as few hub round-trips as possible"""
+        with self.hub.batch() as batch:
+            batch.getLastEvent()
+            batch.getTaskInfo(self.id)
+            batch.getBuild(build_identifier)
+        self.event_id = self.hub.getLastEvent()['id']
+        this_task = self.hub.getTaskInfo(self.id)
+
+        with self.hub.batch() as batch:
+            batch.getBuildTarget(target, event=self.event_id)
+            batch.getUser(this_task['owner'])
+
     def get_source_build_info(self, build_id, build_nvr):
         build_identifier = build_nvr or build_id
 
-        koji_build = self.session.getBuild(build_identifier)
+        koji_build = self.hub.getBuild(build_identifier)
         if not koji_build:
             raise koji.BuildError("specified source build '%s' doesn't exist" % build_identifier)
 
@@ -1180,11 +3082,20 @@ class BuildSourceContainerTask(BaseContainerTask):
         return component, build_id, build_nvr
 
     def handler(self, target, opts=None):
-        jsonschema.validate([target, opts], self.PARAMS_SCHEMA)
+        self.validate_params([target, opts])
         self.opts = opts
-
-        self.event_id = self.session.getLastEvent()['id']
-        target_info = self.session.getBuildTarget(target, event=self.event_id)
+        self._record_metrics(in_flight=True)
+        try:
+            return self._handler(target, opts)
+        finally:
+            # also tasks failing before their build report timings
+            self._report_timings()
+
+    def _handler(self, target, opts):
+        with self.timings.phase('hub_prefetch'):
+            self._prefetch_hub_data(target,
+                                    opts.get('koji_build_nvr') or opts.get('koji_build_id'))
+        target_info = self.hub.getBuildTarget(target, event=self.event_id)
         if not target_info:
             raise koji.BuildError("Target `%s` not found" % target)
 
@@ -1209,5 +3120,6 @@ class BuildSourceContainerTask(BaseContainerTask):
         result = self.createSourceContainer(**kwargs)
 
         self.logger.debug("Result: %r", result)
+        self.logger.debug("Hub lookups: %s", self.hub.stats())
 
         return create_task_response(result)
@@ -0,0 +1,176 @@
+"""
+Copyright (C) 2026  Red Hat, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+Run buildContainer tasks end to end against FakeOSBS and FakeHub and report
+log lines per second, upload lag of log lines and hub calls per task.
+
+The plugin configuration is read from --config, e.g. to compare log
+streaming, compression or upload workers. osbs-client has to be installed,
+the task imports parts of it.
+
+Run from the top directory of the repository:
+
+    python -m tests.benchmarks.bench_e2e --platforms x86_64,aarch64 --lines 100000
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import koji
+
+from koji_containerbuild.plugins import builder_containerbuild
+from koji_containerbuild.plugins.builder_containerbuild import BuildContainerTask
+from tests.benchmarks.fakes import DOCKERFILE, FAILURE_MODES, FakeHub, FakeOSBS
+
+SRC = 'git://pkgs.example.com/containers/bench#b8120b486367ec33fbbfa408542eec7eded8b54e'
+TARGET = 'bench-target'
+
+
+class BenchContainerTask(BuildContainerTask):
+    """buildContainer task using FakeOSBS and checking out a generated Dockerfile"""
+    fake_osbs = None
+
+    def osbs(self):
+        if not self._osbs:
+            with self.timings.phase('osbs_init'):
+                self._osbs = self.fake_osbs
+        return self._osbs
+
+    def fetchDockerfile(self, src, build_tag, scratch):
+        this_task = self.hub.getTaskInfo(self.id)
+        self._get_scm(src, this_task, scratch)
+        sourcedir = os.path.join(self.workdir, 'sources')
+        koji.ensuredir(sourcedir)
+        path = os.path.join(sourcedir, 'Dockerfile')
+        with open(path, 'w') as f:
+            f.write(DOCKERFILE)
+        return path
+
+
+def run_task(args, topdir, task_id):
+    platforms = args.platforms.split(',')
+    osbs = FakeOSBS(platforms=platforms, lines=args.lines, line_size=args.line_size,
+                    line_rate=args.line_rate, remote_sources_share=args.remote_sources_share,
+                    user_warnings=args.user_warnings, metadata_lines=args.metadata_lines,
+                    failure=args.failure)
+    hub = FakeHub(arches=platforms, fail_uploads=args.fail_uploads)
+    options = argparse.Namespace(allowed_scms='pkgs.example.com:/containers/*:no',
+                                 allowed_scms_use_config=True, allowed_scms_use_policy=False,
+                                 workdir=topdir)
+    workdir = os.path.join(topdir, 'tasks', str(task_id))
+    task = BenchContainerTask(task_id, 'buildContainer',
+                              [SRC, TARGET, {'git_branch': 'main', 'scratch': args.scratch}],
+                              hub.session(), options, workdir=workdir)
+    task.fake_osbs = osbs
+
+    started = time.monotonic()
+    try:
+        task.handler(*task.params, **task.opts)
+        outcome = 'succeeded'
+    except (builder_containerbuild.ContainerError, builder_containerbuild.ContainerCancelled,
+            koji.BuildError) as error:
+        outcome = '%s: %s' % (type(error).__name__, error)
+    elapsed = time.monotonic() - started
+
+    phases = dict((phase['name'], phase['seconds'])
+                  for phase in task.timings.report()['phases'])
+    return {
+        'outcome': outcome,
+        'seconds': elapsed,
+        'log_seconds': phases.get('log_follow', 0),
+        'hub': hub,
+        'osbs': osbs,
+    }
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def report(args, result):
+    hub = result['hub']
+    lines_rate = args.lines / result['log_seconds'] if result['log_seconds'] else 0
+    print('%s in %.2fs, %d lines in %.2fs (%.0f lines/s)' %
+          (result['outcome'], result['seconds'], args.lines, result['log_seconds'], lines_rate))
+    if hub.lags:
+        print('  upload lag: mean %.3fs, p95 %.3fs, max %.3fs (%d lines)' %
+              (statistics.mean(hub.lags), percentile(hub.lags, 0.95), max(hub.lags),
+               len(hub.lags)))
+    else:
+        print('  upload lag: n/a, no uncompressed log lines were uploaded')
+    print('  hub: %d calls in %d round trips, %d uploadFile, %d bytes uploaded to %d files' %
+          (hub.hub_calls(), hub.round_trips, hub.calls['uploadFile'], hub.uploaded,
+           len(hub)))
+    print('  osbs: %d calls' % sum(result['osbs'].calls.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark buildContainer tasks end to end')
+    parser.add_argument('--config', help='plugin configuration file')
+    parser.add_argument('--platforms', default='x86_64', help='comma separated platforms')
+    parser.add_argument('--lines', type=int, default=100000, help='log lines of a build')
+    parser.add_argument('--line-size', type=int, default=120, help='bytes of a log line')
+    parser.add_argument('--line-rate', type=float, default=None,
+                        help='log lines per second, unlimited by default')
+    parser.add_argument('--remote-sources-share', type=float, default=0.0,
+                        help='share of log lines from the hermeto task run')
+    parser.add_argument('--user-warnings', type=int, default=0, help='user warning lines')
+    parser.add_argument('--metadata-lines', type=int, default=0, help='metadata file lines')
+    parser.add_argument('--failure', choices=[mode for mode in FAILURE_MODES if mode],
+                        help='how the build fails')
+    parser.add_argument('--fail-uploads', type=int, default=0,
+                        help='every N-th uploadFile call fails')
+    parser.add_argument('--scratch', action='store_true', help='run scratch builds')
+    parser.add_argument('--repeat', type=int, default=1, help='tasks to run')
+    parser.add_argument('--verbose', action='store_true', help='show log of the tasks')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    if args.config:
+        builder_containerbuild.CONFIG_FILE = args.config
+        builder_containerbuild._plugin_config = None  # pylint: disable=protected-access
+
+    topdir = tempfile.mkdtemp(prefix='bench-e2e-')
+    try:
+        koji.pathinfo.topdir = topdir
+        if args.metadata_lines:
+            koji.ensuredir(koji.pathinfo.work())
+            with open(os.path.join(koji.pathinfo.work(), 'metadata.json'), 'w') as f:
+                f.write('{}')
+        results = []
+        for task_id in range(1, args.repeat + 1):
+            result = run_task(args, topdir, task_id)
+            report(args, result)
+            results.append(result)
+        if args.repeat > 1:
+            hub_calls = [result['hub'].hub_calls() for result in results]
+            print('median: %.2fs per task, %.0f hub calls per task' %
+                  (statistics.median(result['seconds'] for result in results),
+                   statistics.median(hub_calls)))
+    finally:
+        shutil.rmtree(topdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
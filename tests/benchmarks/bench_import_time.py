@@ -0,0 +1,71 @@
+"""
+Copyright (C) 2026  Red Hat, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+Measure import time of the builder plugin as kojid pays it on start, and
+of the dependencies imported only when a container task runs, using
+python -X importtime in fresh interpreters which already imported koji.
+
+Run from the top directory of the repository:
+
+    python -m tests.benchmarks.bench_import_time
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+PLUGIN = 'koji_containerbuild.plugins.builder_containerbuild'
+# already imported by kojid when it loads plugins
+KOJID_IMPORTS = ('koji', 'koji.daemon', 'koji.tasks')
+DEFERRED = ('osbs.api', 'osbs.conf', 'osbs.utils', 'jsonschema', 'dockerfile_parse')
+
+
+def import_time(module):
+    """Cumulative import time of module in microseconds, None if it can't be imported"""
+    code = 'import %s; import %s' % (', '.join(KOJID_IMPORTS), module)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    if result.returncode:
+        return None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == module:
+            return int(cumulative)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark import time of the builder plugin')
+    parser.add_argument('--repeat', type=int, default=5, help='imports, median is reported')
+    args = parser.parse_args()
+
+    for module in (PLUGIN,) + DEFERRED:
+        times = [import_time(module) for _ in range(args.repeat)]
+        if None in times:
+            print('%s: not installed' % module)
+            continue
+        label = 'on plugin load' if module == PLUGIN else 'deferred to container tasks'
+        print('%s: %.1f ms (%s)' % (module, statistics.median(times) / 1000, label))
+
+
+if __name__ == '__main__':
+    main()
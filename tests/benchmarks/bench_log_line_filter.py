@@ -0,0 +1,100 @@
+"""
+Copyright (C) 2026  Red Hat, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+Compare classification of build log lines as metadata, user warnings or
+ordinary lines by the checks of _write_logs with and without the cheap
+pre-filter of user warnings. osbs-client has to be installed.
+
+Run from the top directory of the repository:
+
+    python -m tests.benchmarks.bench_log_line_filter
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import timeit
+
+from osbs.utils import UserWarningsStore
+
+from koji_containerbuild.plugins.builder_containerbuild import METADATA_TAG, USER_WARNING_MARK
+
+ORDINARY = (
+    '2026-01-01 12:00:00,%03d platform:x86_64 - atomic_reactor.tasks.binary_container_build'
+    ' - DEBUG - Step 12/40 : RUN dnf install -y httpd mod_ssl python3-pip'
+)
+USER_WARNING = (
+    '2026-01-01 12:00:00,%03d platform:- - atomic_reactor.plugin - USER_WARNING'
+    ' - {"message": "Base image is deprecated"}'
+)
+METADATA = '2026-01-01 12:00:00,%03d platform:_metadata_ - x86_64-metadata.json'
+
+
+def log_lines(count, user_warnings, metadata):
+    lines = [ORDINARY % (i % 1000) for i in range(count)]
+    for i in range(user_warnings):
+        lines[i * count // user_warnings] = USER_WARNING % i
+    for i in range(metadata):
+        lines[i * count // metadata + 1] = METADATA % i
+    return lines
+
+
+def unfiltered(lines, store):
+    kinds = [0, 0, 0]
+    for line in lines:
+        if METADATA_TAG in line:
+            kinds[1] += 1
+        elif store.is_user_warning(line):
+            kinds[2] += 1
+        else:
+            kinds[0] += 1
+    return kinds
+
+
+def prefiltered(lines, store):
+    kinds = [0, 0, 0]
+    for line in lines:
+        if METADATA_TAG in line:
+            kinds[1] += 1
+        elif USER_WARNING_MARK in line and store.is_user_warning(line):
+            kinds[2] += 1
+        else:
+            kinds[0] += 1
+    return kinds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark classification of log lines')
+    parser.add_argument('--lines', type=int, default=100000, help='log lines')
+    parser.add_argument('--user-warnings', type=int, default=100, help='user warning lines')
+    parser.add_argument('--metadata-lines', type=int, default=4, help='metadata lines')
+    parser.add_argument('--repeat', type=int, default=5, help='rounds, best one is reported')
+    args = parser.parse_args()
+
+    lines = log_lines(args.lines, args.user_warnings, args.metadata_lines)
+    store = UserWarningsStore()
+    assert unfiltered(lines, store) == prefiltered(lines, store)
+
+    results = {}
+    for func in (unfiltered, prefiltered):
+        seconds = min(timeit.repeat(lambda: func(lines, store), number=1, repeat=args.repeat))
+        results[func.__name__] = args.lines / seconds
+        print('%s: %.0f lines/s' % (func.__name__, results[func.__name__]))
+    print('speedup: %.1fx' % (results['prefiltered'] / results['unfiltered']))
+
+
+if __name__ == '__main__':
+    main()
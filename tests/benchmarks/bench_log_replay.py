@@ -0,0 +1,220 @@
+"""
+Copyright (C) 2026  Red Hat, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+Replay build log streams into BaseContainerTask._write_logs and report
+lines per second, peak RSS growth and read/write syscalls per line.
+
+Streams are files with one JSON list [task_run_name, line] per line,
+optionally gzip compressed, as written by --save. Without --stream
+synthetic streams of FakeOSBS are replayed for each combination of
+--platform-counts and --remote-sources-shares. Each run is made in a
+forked process, as in builder tasks, the stream is loaded before it is
+measured. Syscalls are counted from /proc/self/io, so only on Linux.
+
+Run from the top directory of the repository:
+
+    python -m tests.benchmarks.bench_log_replay
+    python -m tests.benchmarks.bench_log_replay --stream build.jsonl.gz --platforms x86_64,s390x
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import gzip
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+import traceback
+
+import koji
+
+from koji_containerbuild.plugins.builder_containerbuild import METADATA_TAG, BuildContainerTask
+from tests.benchmarks.fakes import FakeHub, FakeOSBS
+
+PLATFORMS = ('x86_64', 'aarch64', 'ppc64le', 's390x')
+
+
+class ReplayOSBS(FakeOSBS):
+    """FakeOSBS returning a loaded log stream"""
+    def __init__(self, records, platforms):
+        FakeOSBS.__init__(self, platforms=platforms)
+        self.records = records
+
+    def get_build_logs(self, build_id, follow=False, wait=False):
+        self._record('get_build_logs')
+        return iter(self.records)
+
+
+def open_stream(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def load_stream(path):
+    with open_stream(path, 'r') as f:
+        return [tuple(json.loads(record)) for record in f]
+
+
+def save_stream(path, records):
+    with open_stream(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def synthetic_stream(args, platforms, remote_sources_share):
+    osbs = FakeOSBS(platforms=platforms, lines=args.lines, line_size=args.line_size,
+                    remote_sources_share=remote_sources_share,
+                    user_warnings=args.user_warnings, metadata_lines=args.metadata_lines)
+    return list(osbs.get_build_logs('replay'))
+
+
+def io_syscalls():
+    """Number of read and write syscalls made by this process, None if unknown"""
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(':') for line in f)
+    except (IOError, OSError):
+        return None
+    return int(counters['syscr']) + int(counters['syscw'])
+
+
+def max_rss():
+    """Peak RSS of this process in KiB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def prepare_metadata(records):
+    """Create metadata files the stream refers to, they are copied to the logs"""
+    for _, line in records:
+        if METADATA_TAG in line:
+            path = os.path.join(koji.pathinfo.work(), line.rsplit(' ', 1)[1])
+            koji.ensuredir(os.path.dirname(path))
+            with open(path, 'w') as f:
+                f.write('{}')
+
+
+def replay(records, platforms, topdir):
+    """Replay records into _write_logs of a task, returns measurements"""
+    options = argparse.Namespace(workdir=topdir)
+    workdir = tempfile.mkdtemp(dir=topdir)
+    task = BuildContainerTask(1, 'buildContainer', [], FakeHub().session(), options,
+                              workdir=workdir)
+    task._osbs = ReplayOSBS(records, platforms)  # pylint: disable=protected-access
+    logs_dir = task.resultdir()
+
+    rss = max_rss()
+    syscalls = io_syscalls()
+    started = time.perf_counter()
+    task._write_logs('replay', logs_dir, platforms=platforms)  # pylint: disable=protected-access
+    elapsed = time.perf_counter() - started
+    result = {
+        'seconds': elapsed,
+        'rss_growth': max_rss() - rss,
+        'syscalls': None if syscalls is None else io_syscalls() - syscalls,
+        'bytes': sum(os.path.getsize(os.path.join(logs_dir, fname))
+                     for fname in os.listdir(logs_dir)),
+    }
+    shutil.rmtree(workdir)
+    return result
+
+
+def replay_forked(records, platforms, topdir):
+    """Replay in a forked process, so every run starts with the same memory"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(read_fd)
+        status = 1
+        try:
+            result = replay(records, platforms, topdir)
+            os.write(write_fd, json.dumps(result).encode('utf-8'))
+            status = 0
+        except Exception:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as f:
+        data = f.read()
+    _, status = os.waitpid(pid, 0)
+    if status:
+        raise RuntimeError('Replay failed')
+    return json.loads(data.decode('utf-8'))
+
+
+def report(name, records, results):
+    best = min(results, key=lambda result: result['seconds'])
+    lines = len(records)
+    syscalls = 'n/a'
+    if best['syscalls'] is not None:
+        syscalls = '%.3f' % (best['syscalls'] / lines)
+    print('%s: %d lines in %.3fs (%.0f lines/s, %.1f MiB/s), peak RSS +%d KiB, '
+          '%s syscalls/line' %
+          (name, lines, best['seconds'], lines / best['seconds'],
+           best['bytes'] / best['seconds'] / 1024 / 1024,
+           max(result['rss_growth'] for result in results), syscalls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark writing of build logs')
+    parser.add_argument('--stream', help='recorded log stream to replay')
+    parser.add_argument('--platforms', default='x86_64',
+                        help='comma separated platforms of the recorded stream')
+    parser.add_argument('--save', help='save the first synthetic stream to this file')
+    parser.add_argument('--platform-counts', default='1,2,4',
+                        help='comma separated platform counts of synthetic streams')
+    parser.add_argument('--remote-sources-shares', default='0,0.5',
+                        help='comma separated shares of hermeto lines of synthetic streams')
+    parser.add_argument('--lines', type=int, default=200000, help='lines of synthetic streams')
+    parser.add_argument('--line-size', type=int, default=120, help='bytes of synthetic lines')
+    parser.add_argument('--user-warnings', type=int, default=10,
+                        help='user warnings of synthetic streams')
+    parser.add_argument('--metadata-lines', type=int, default=2,
+                        help='metadata lines of synthetic streams')
+    parser.add_argument('--repeat', type=int, default=3, help='runs, best one is reported')
+    args = parser.parse_args()
+
+    scenarios = []
+    if args.stream:
+        scenarios.append((args.stream, args.platforms.split(','), load_stream(args.stream)))
+    else:
+        for count in [int(count) for count in args.platform_counts.split(',')]:
+            if count > len(PLATFORMS):
+                parser.error('at most %d platforms are supported' % len(PLATFORMS))
+            platforms = list(PLATFORMS[:count])
+            for share in [float(share) for share in args.remote_sources_shares.split(',')]:
+                name = 'platforms %d, hermeto %d%%' % (count, share * 100)
+                scenarios.append((name, platforms, synthetic_stream(args, platforms, share)))
+        if args.save:
+            save_stream(args.save, scenarios[0][2])
+
+    topdir = tempfile.mkdtemp(prefix='bench-log-replay-')
+    try:
+        koji.pathinfo.topdir = topdir
+        for name, platforms, records in scenarios:
+            prepare_metadata(records)
+            results = [replay_forked(records, platforms, topdir) for _ in range(args.repeat)]
+            report(name, records, results)
+    finally:
+        shutil.rmtree(topdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
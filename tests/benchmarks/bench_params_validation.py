@@ -0,0 +1,82 @@
+"""
+Copyright (C) 2026  Red Hat, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+Compare validation of task parameters with jsonschema.validate() and with
+the validators cached by BaseContainerTask.validate_params().
+
+Run from the top directory of the repository:
+
+    python -m tests.benchmarks.bench_params_validation
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import timeit
+
+import jsonschema
+
+from koji_containerbuild.plugins.builder_containerbuild import (
+    BuildContainerTask,
+    BuildSourceContainerTask,
+)
+
+PARAMS = {
+    BuildContainerTask: [
+        'git://pkgs.example.com/rpms/fedora-docker#b8120b486367ec33fbbfa408542eec7eded8b54e',
+        'target',
+        {'git_branch': 'main', 'scratch': True, 'yum_repourls': ['http://example.com/a.repo'],
+         'compose_ids': [1, 2], 'userdata': {'custom': 'userdata'}},
+    ],
+    BuildSourceContainerTask: [
+        'target',
+        {'koji_build_nvr': 'fedora-docker-25-3', 'scratch': True,
+         'userdata': {'custom': 'userdata'}},
+    ],
+}
+
+
+def bench(task_cls, params, number, repeat):
+    def uncached():
+        jsonschema.validate(params, task_cls.PARAMS_SCHEMA)
+
+    def cached():
+        task_cls.validate_params(params)
+
+    results = {}
+    for name, func in (('jsonschema.validate', uncached), ('validate_params', cached)):
+        func()
+        best = min(timeit.repeat(func, number=number, repeat=repeat))
+        results[name] = best / number * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark validation of task parameters')
+    parser.add_argument('--number', type=int, default=1000, help='validations per round')
+    parser.add_argument('--repeat', type=int, default=5, help='rounds, best one is reported')
+    args = parser.parse_args()
+
+    for task_cls, params in PARAMS.items():
+        results = bench(task_cls, params, args.number, args.repeat)
+        uncached = results['jsonschema.validate']
+        cached = results['validate_params']
+        print('%s: jsonschema.validate %.1f us, validate_params %.1f us, saved %.1f us (%.1fx)' %
+              (task_cls.__name__, uncached, cached, uncached - cached, uncached / cached))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""
+Copyright (C) 2026  Red Hat, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+In-process stand-ins for OSBS and the koji hub, a build task runs against
+them end to end without OpenShift, a hub or an SCM.
+
+FakeOSBS replays a synthetic PipelineRun log stream, FakeHub records calls
+and uploaded files of the task, as the hub fakes of the tests do.
+"""
+from __future__ import absolute_import
+
+import collections
+import json
+import threading
+import time
+
+import koji
+
+from koji_containerbuild.plugins.builder_containerbuild import (
+    METADATA_TAG,
+    REMOTE_SOURCES_TASKNAME,
+)
+from tests.koji_fakes import FakeHubUploads, FakeMulticall, FakeUploadSession
+
+# how a fake build ends, see FakeOSBS
+FAILURE_MODES = (None, 'failed', 'cancelled', 'logs')
+
+DOCKERFILE = """\
+FROM fedora:latest
+LABEL com.redhat.component=bench-container
+LABEL name=bench
+LABEL version=1.0
+LABEL release=1
+"""
+
+USER_WARNING = ('2026-01-01 00:00:00,000 platform:- - atomic_reactor.plugin - USER_WARNING - '
+                '{"message": "user warning %d"}')
+
+
+def task_run_name(platform):
+    """Name of the task run building platform, as route_by_platform_name() expects"""
+    return 'binary-container-build-%s' % platform.replace('_', '-')
+
+
+class FakeOSBSConf(object):
+    def get_verbosity(self):
+        return False
+
+    def get_default_buildtime_limit(self):
+        return 3 * 60 * 60
+
+    def get_max_buildtime_limit(self):
+        return 6 * 60 * 60
+
+
+class FakeOSBS(object):
+    """Stand-in for osbs.api.OSBS replaying a synthetic build
+
+    The build logs lines lines at line_rate lines per second, or as fast as
+    they are read when line_rate is None. Lines of prebuild and postbuild task
+    runs go to the noarch log, the rest is spread over task runs of platforms
+    and remote_sources_share of them comes from the hermeto task run.
+    user_warnings and metadata lines are spread over the stream, metadata
+    lines name metadata_file relative to koji.pathinfo.work().
+
+    Each line starts with time.time() of when it was emitted, FakeHub
+    measures upload lag from it.
+
+    failure is one of FAILURE_MODES: the PipelineRun fails or is cancelled,
+    or the log stream breaks in the middle of the build which then succeeds.
+    """
+    def __init__(self, platforms=('x86_64',), lines=10000, line_size=120, line_rate=None,
+                 remote_sources_share=0.0, user_warnings=0, metadata_lines=0,
+                 metadata_file='metadata.json', failure=None):
+        if failure not in FAILURE_MODES:
+            raise ValueError('Unknown failure mode %r' % failure)
+        self.os_conf = FakeOSBSConf()
+        # OpenShift connection, PipelineRun data are returned by get_build()
+        self.os = None
+        self.platforms = list(platforms)
+        self.lines = lines
+        self.line_size = line_size
+        self.line_rate = line_rate
+        self.remote_sources_share = remote_sources_share
+        self.user_warnings = user_warnings
+        self.metadata_lines = metadata_lines
+        self.metadata_file = metadata_file
+        self.failure = failure
+        self.calls = collections.Counter()
+        self.build_name = 'fake-build-1'
+
+    def _record(self, method):
+        self.calls[method] += 1
+
+    def create_binary_container_build(self, **kwargs):
+        self._record('create_binary_container_build')
+        return {'metadata': {'name': self.build_name}}
+
+    def create_source_container_build(self, **kwargs):
+        self._record('create_source_container_build')
+        return {'metadata': {'name': self.build_name}}
+
+    def get_build_name(self, build_response):
+        return build_response['metadata']['name']
+
+    def get_final_platforms(self, build_id):
+        self._record('get_final_platforms')
+        return list(self.platforms)
+
+    def wait_for_build_to_finish(self, build_id):
+        self._record('wait_for_build_to_finish')
+
+    def cancel_build(self, build_id):
+        self._record('cancel_build')
+
+    def remove_build(self, build_id):
+        self._record('remove_build')
+
+    def get_build_error_message(self, build_id):
+        self._record('get_build_error_message')
+        return 'Fake build failed'
+
+    def get_build(self, build_id):
+        self._record('get_build')
+        reason = {'failed': 'Failed',
+                  'cancelled': 'PipelineRunCancelled'}.get(self.failure, 'Succeeded')
+        results = {}
+        if reason == 'Succeeded':
+            results = {
+                'repositories': {'primary': ['registry.example.com/bench:1.0-1'],
+                                 'floating': ['registry.example.com/bench:latest']},
+                'koji-build-id': 1,
+            }
+        return {
+            'metadata': {'name': build_id},
+            'status': {
+                'conditions': [{'type': 'Succeeded', 'reason': reason,
+                                'status': 'True' if reason == 'Succeeded' else 'False'}],
+                'pipelineResults': [{'name': name, 'value': json.dumps(value)}
+                                    for name, value in results.items()],
+            },
+        }
+
+    def _task_runs(self):
+        """Task run name of each line of the build"""
+        noarch = max(self.lines // 10, 1)
+        remote_sources = int(self.lines * self.remote_sources_share)
+        platform_runs = [task_run_name(platform) for platform in self.platforms]
+        for number in range(self.lines):
+            if number < noarch // 2:
+                yield 'binary-container-prebuild'
+            elif number < noarch // 2 + remote_sources:
+                yield REMOTE_SOURCES_TASKNAME
+            elif number >= self.lines - noarch // 2 or not platform_runs:
+                yield 'binary-container-postbuild'
+            else:
+                yield platform_runs[number % len(platform_runs)]
+
+    def _special_lines(self):
+        """Line numbers of user warnings and metadata lines"""
+        special = {}
+        for shift, count, kind in ((0, self.user_warnings, 'warning'),
+                                   (1, self.metadata_lines, 'metadata')):
+            for i in range(count):
+                special[(i + 1) * self.lines // (count + 1) + shift] = kind
+        return special
+
+    def get_build_logs(self, build_id, follow=False, wait=False):
+        """Generator of (task run name, line) of the synthetic build"""
+        self._record('get_build_logs')
+        special = self._special_lines()
+        padding = 'x' * self.line_size
+        started = time.monotonic()
+        for number, task_run in enumerate(self._task_runs()):
+            if self.failure == 'logs' and number == self.lines // 2:
+                raise koji.GenericError('Fake log stream broke')
+            if self.line_rate:
+                delay = started + number / self.line_rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            kind = special.get(number)
+            if kind == 'warning':
+                yield task_run, USER_WARNING % number
+            elif kind == 'metadata':
+                yield task_run, '%s %s' % (METADATA_TAG, self.metadata_file)
+            else:
+                line = '%.6f %s line %d ' % (time.time(), task_run, number)
+                yield task_run, line + padding[:max(self.line_size - len(line), 0)]
+
+
+class FakeHubSession(FakeUploadSession):
+    """Client session of FakeHub, subsessions share the hub
+
+    Every call is a round trip to the hub, calls of a multicall share one.
+    """
+    def __init__(self, hub, in_multicall=False):
+        FakeUploadSession.__init__(self, hub)
+        self.in_multicall = in_multicall
+
+    def _call(self, method, args, kwargs):
+        if not self.in_multicall:
+            self.uploads.round_trip()
+        return self.uploads.call(method, args, kwargs, multicall=self.in_multicall)
+
+    def multicall(self, strict=False):
+        self.uploads.round_trip()
+        return FakeMulticall(FakeHubSession(self.uploads, in_multicall=True), strict=strict)
+
+    def uploadFile(self, path, name, size, checksum, offset, data):
+        return self._call('uploadFile', (path, name, size, checksum, offset, data), {})
+
+    def subsession(self):
+        self._call('subsession', (), {})
+        return FakeHubSession(self.uploads)
+
+    def logout(self):
+        self._call('logout', (), {})
+        self.logged_out = True
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        def call(*args, **kwargs):
+            return self._call(method, args, kwargs)
+        return call
+
+
+class FakeHub(FakeHubUploads):
+    """Koji hub serving a build task, records its calls and uploaded files
+
+    Every fail_uploads-th uploadFile call made in a multicall fails, 0
+    never fails, their chunks are then uploaded once more by direct calls
+    which don't fail. Upload lag is measured for complete uploaded lines
+    which start with the time they were emitted by FakeOSBS.
+    """
+    def __init__(self, arches=('x86_64',), fail_uploads=0):
+        FakeHubUploads.__init__(self)
+        self.arches = list(arches)
+        self.fail_uploads = fail_uploads
+        self.calls = collections.Counter()
+        self.round_trips = 0
+        self.uploaded = 0
+        self.lags = []
+        self._measured = {}
+        self._uploads = 0
+        self._lock = threading.Lock()
+
+    def session(self):
+        return FakeHubSession(self)
+
+    def round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+
+    def call(self, method, args, kwargs, multicall=False):
+        with self._lock:
+            self.calls[method] += 1
+            if method == 'uploadFile' and multicall and self.fail_uploads:
+                self._uploads += 1
+                if self._uploads % self.fail_uploads == 0:
+                    raise koji.GenericError('Fake upload failure')
+            handler = getattr(self, 'do_%s' % method, None)
+            if handler is None:
+                return None
+            return handler(*args, **kwargs)
+
+    def do_getLastEvent(self):
+        return {'id': 1000, 'ts': time.time()}
+
+    def do_getTaskInfo(self, task_id, request=False, strict=False):
+        return {'id': task_id, 'owner': 1, 'channel_id': 1, 'method': 'buildContainer'}
+
+    def do_getUser(self, user_id=None, strict=False):
+        return {'id': 1, 'name': 'bench'}
+
+    def do_getChannel(self, channel_id, strict=False):
+        return {'id': channel_id, 'name': 'container'}
+
+    def do_getBuildTarget(self, target, event=None, strict=False):
+        return {'id': 1, 'name': target, 'build_tag': 2, 'build_tag_name': '%s-build' % target,
+                'dest_tag': 3, 'dest_tag_name': '%s-candidate' % target}
+
+    def do_getBuildConfig(self, tag, event=None):
+        return {'id': tag, 'name': 'bench-build', 'arches': ' '.join(self.arches)}
+
+    def do_getPackageConfig(self, tag, pkg, event=None):
+        return {'blocked': False, 'owner_id': 1}
+
+    def do_getBuild(self, build_info, strict=False):
+        return None
+
+    def do_uploadFile(self, path, name, size, checksum, offset, data):
+        self.uploadFile(path, name, size, checksum, offset, data)
+        self.uploaded += size
+        if name.endswith('.log'):
+            self._measure_lag(name, self[name])
+        return True
+
+    def _measure_lag(self, name, content):
+        # lines are measured once, when they are complete for the first time
+        start = self._measured.get(name, 0)
+        end = content.rfind(b'\n') + 1
+        gap = content.find(b'\0', start, end)
+        if gap >= 0:
+            # a chunk before failed, wait until it is uploaded once more
+            end = content.rfind(b'\n', start, gap) + 1
+        if end <= start:
+            return
+        now = time.time()
+        for line in bytes(content[start:end - 1]).split(b'\n'):
+            try:
+                self.lags.append(now - float(line.split(b' ', 1)[0]))
+            except ValueError:
+                pass
+        self._measured[name] = end
+
+    def hub_calls(self):
+        """Number of hub calls, calls of a multicall counted separately"""
+        return sum(self.calls.values())
@@ -0,0 +1,140 @@
+"""
+Copyright (C) 2026  Red Hat, Inc.
+
+This library is free software; you can redistribute it and/or
+modify it under the terms of the GNU Lesser General Public
+License as published by the Free Software Foundation; either
+version 2.1 of the License, or (at your option) any later version.
+
+This library is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with this library; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+Stand-ins for koji hub sessions shared by the tests and the benchmarks.
+"""
+from __future__ import absolute_import
+
+import base64
+import hashlib
+
+
+class FakeVirtualCall(object):
+    def __init__(self, method, args, kwargs):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self._result = None
+        self._error = None
+
+    @property
+    def result(self):
+        if self._error:
+            raise self._error
+        return self._result
+
+
+class FakeMulticall(object):
+    """koji multicall making the calls on a session when it ends
+
+    Methods of every multicall are recorded in multicall_batches of the
+    session.
+    """
+    def __init__(self, session, strict=False):
+        self.session = session
+        self.strict = strict
+        self.calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.session.multicall_batches.append([call.method for call in self.calls])
+            for call in self.calls:
+                try:
+                    call._result = getattr(self.session, call.method)(*call.args, **call.kwargs)
+                except Exception as error:
+                    if self.strict:
+                        raise
+                    call._error = error
+        return False
+
+    def __getattr__(self, method):
+        def record(*args, **kwargs):
+            call = FakeVirtualCall(method, args, kwargs)
+            self.calls.append(call)
+            return call
+        return record
+
+
+class FakeUploadSession(object):
+    """Session uploading files to FakeHubUploads"""
+    def __init__(self, uploads):
+        self.uploads = uploads
+        self.opts = {}
+        self.multicall_batches = []
+        self.logged_out = False
+
+    def multicall(self, strict=False):
+        return FakeMulticall(self, strict=strict)
+
+    def uploadFile(self, path, name, size, checksum, offset, data):
+        return self.uploads.uploadFile(path, name, size, checksum, offset, data)
+
+    def subsession(self):
+        return self.uploads.subsession()
+
+    def logout(self):
+        self.logged_out = True
+
+
+class FakeHubUploads(dict):
+    """Files uploaded to the hub by name
+
+    Like on the hub, data are written at the upload offset and an upload at
+    offset 0 truncates the file. Uploads of (name, offset) in fail fail once.
+    """
+    def __init__(self, fail=()):
+        dict.__init__(self)
+        self.fail = list(fail)
+        self.subsessions = []
+
+    def _store(self, fname, offset, data):
+        content = self.setdefault(fname, bytearray())
+        if not offset:
+            del content[:]
+        content.extend(bytes(max(offset - len(content), 0)))
+        content[offset:offset + len(data)] = data
+        return content
+
+    def upload(self, session, fname, fd, uploadpath, logger=None):
+        """Replacement of incremental_upload"""
+        offset = fd.tell()
+        data = fd.read()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._store(fname, offset, data)
+
+    def uploadFile(self, path, name, size, checksum, offset, data):
+        if (name, offset) in self.fail:
+            self.fail.remove((name, offset))
+            return False
+        data = base64.b64decode(data)
+        assert size == len(data)
+        assert checksum == ('sha256', hashlib.sha256(data).hexdigest())
+        self._store(name, offset, data)
+        return True
+
+    def session(self):
+        """Session uploading files by multicalls of uploadFile"""
+        return FakeUploadSession(self)
+
+    def subsession(self):
+        session = self.session()
+        self.subsessions.append(session)
+        return session
@@ -18,21 +18,34 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
 from __future__ import absolute_import
 
 from copy import copy, deepcopy
+import gzip
+import http.server
+import json
+import logging
 import os
 import os.path
+import select
 import signal
+import socket
+import subprocess
+import sys
 from textwrap import dedent
+import threading
+import zlib
 
 import jsonschema
 import koji
 import pytest
+import requests
 from flexmock import flexmock
 
-import osbs
+import osbs.api
+import osbs.http
 from osbs.exceptions import OsbsValidationException
 from osbs.utils import UserWarningsStore
 
 from koji_containerbuild.plugins import builder_containerbuild
+from tests.koji_fakes import FakeHubUploads, FakeMulticall
 
 USE_DEFAULT_PKG_INFO = object()
 
@@ -53,17 +66,65 @@ class mock_time():
     def sleep(self, *args):
         return
 
+    @staticmethod
+    def monotonic():
+        return 0
+
 
 builder_containerbuild.incremental_upload = mock_incremental_upload
 builder_containerbuild.time = mock_time
 
 
+@pytest.fixture(autouse=True)
+def short_log_watch_timeout(monkeypatch):
+    monkeypatch.setattr(builder_containerbuild, 'LOG_WATCH_TIMEOUT', 0.1)
+
+
+@pytest.fixture(autouse=True)
+def no_http_pool(monkeypatch):
+    # HTTP pools set up by a test are not used by the following ones
+    monkeypatch.setattr(osbs.http, 'requests', osbs.http.requests)
+
+
 logs = ['normal log entry',
         u'Hurray for bacon: \u2017',
         'line 2',
         'another log entry']
 
 
+def imported_modules(code):
+    """Top level names of modules imported by running code, as reported by -X importtime"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    return {line.split('|')[-1].strip().split('.')[0]
+            for line in result.stderr.splitlines() if line.startswith('import time:')}
+
+
+def mock_multicall(session):
+    session.multicall_batches = []
+    if not hasattr(session, 'opts'):
+        # options of koji sessions, logs are uploaded by multicalls without fast upload
+        session.opts = {}
+    (session
+        .should_receive('multicall')
+        .replace_with(lambda strict=False: FakeMulticall(session, strict=strict)))
+    return session
+
+
+def make_pipeline_run(reason='Succeeded', status='True', results=None):
+    """PipelineRun as returned by OSBS.get_build()"""
+    return {
+        'metadata': {'name': 'os-build-id'},
+        'status': {
+            'conditions': [{'type': 'Succeeded', 'status': status, 'reason': reason}],
+            'pipelineResults': [{'name': name, 'value': json.dumps(value)}
+                                for name, value in (results or {}).items()],
+        },
+    }
+
+
 class TestBuilder(object):
     @pytest.mark.parametrize(('task_method', 'method'), [
         (builder_containerbuild.BuildContainerTask, 'buildContainer'),
@@ -79,6 +140,154 @@ class TestBuilder(object):
                           workdir=resdir)
         assert cct.resultdir() == '%s/osbslogs' % resdir
 
+    @pytest.mark.parametrize('use_inotify', [True, False])
+    def test_file_watcher(self, tmpdir, use_inotify):
+        watcher = builder_containerbuild.FileWatcher(str(tmpdir), logging.getLogger('test'),
+                                                     use_inotify=use_inotify)
+        assert (watcher._inotify is not None) == use_inotify
+        assert list(watcher.files_to_upload()) == []
+
+        tmpdir.join('x86_64.log').write('line 1\n')
+        tmpdir.join('metadata.json').write('{}')
+        tmpdir.join('ignored.txt').write('ignored')
+        watcher.wait(1)
+        assert sorted(fname for _, fname in watcher.files_to_upload()) == \
+            ['metadata.json', 'x86_64.log']
+
+        tmpdir.join('x86_64.log').write('line 2\n', mode='a')
+        watcher.wait(1)
+        uploads = {fname: fd for fd, fname in watcher.files_to_upload()}
+        if use_inotify:
+            # unchanged files are not checked at all
+            assert list(uploads) == ['x86_64.log']
+        else:
+            assert sorted(uploads) == ['metadata.json', 'x86_64.log']
+        assert uploads['x86_64.log'].read() == 'line 1\nline 2\n'
+
+        # replaced file is reopened
+        tmpdir.join('x86_64.log').rename(tmpdir.join('old'))
+        tmpdir.join('x86_64.log').write('replaced\n')
+        uploads = {fname: fd for fd, fname in watcher.files_to_upload()}
+        assert uploads['x86_64.log'].read() == 'replaced\n'
+
+        watcher.clean()
+
+    def test_file_watcher_inotify_unavailable(self, tmpdir):
+        (flexmock(builder_containerbuild)
+            .should_receive('InotifyWatch')
+            .and_raise(OSError('not supported')))
+        logger = flexmock()
+        logger.should_receive('debug').once()
+
+        watcher = builder_containerbuild.FileWatcher(str(tmpdir), logger)
+        assert watcher._inotify is None
+
+        tmpdir.join('x86_64.log').write('line 1\n')
+        assert [fname for _, fname in watcher.files_to_upload()] == ['x86_64.log']
+        watcher.clean()
+
+    def test_file_watcher_inotify_overflow(self, tmpdir):
+        tmpdir.join('x86_64.log').write('line 1\n')
+        tmpdir.join('s390x.log').write('line 1\n')
+        watcher = builder_containerbuild.FileWatcher(str(tmpdir), flexmock())
+        assert len(list(watcher.files_to_upload())) == 2
+
+        # lost events result in checking all the files again
+        flexmock(watcher._inotify).should_receive('read_events').and_return(None)
+        assert len(list(watcher.files_to_upload())) == 2
+        watcher.clean()
+
+    @pytest.mark.parametrize('use_inotify', [True, False])
+    def test_file_watcher_unreadable_file(self, tmpdir, use_inotify):
+        watcher = builder_containerbuild.FileWatcher(str(tmpdir), logging.getLogger('test'),
+                                                     use_inotify=use_inotify)
+        assert list(watcher.files_to_upload()) == []
+        tmpdir.join('s390x.log').write('line 1\n')
+        tmpdir.join('x86_64.log').write('line 1\n')
+        watcher.wait(1)
+
+        reopen_file = watcher._reopen_file
+        failed = []
+
+        def fail_once(fname, *args):
+            if not failed:
+                failed.append(fname)
+                return False
+            return reopen_file(fname, *args)
+
+        flexmock(watcher).should_receive('_reopen_file').replace_with(fail_once)
+        # the other file is still checked
+        uploads = {fname: fd for fd, fname in watcher.files_to_upload()}
+        assert sorted(uploads) == sorted({'s390x.log', 'x86_64.log'} - set(failed))
+
+        # the file is checked again, also when it didn't change since
+        uploads = {fname: fd for fd, fname in watcher.files_to_upload()}
+        assert uploads[failed[0]].read() == 'line 1\n'
+        watcher.clean()
+
+    @pytest.mark.parametrize('use_inotify', [True, False])
+    def test_file_watcher_wait_fds(self, tmpdir, monkeypatch, use_inotify):
+        sleeps = []
+        monkeypatch.setattr(builder_containerbuild, 'time',
+                            flexmock(monotonic=lambda: 0, sleep=sleeps.append))
+        watcher = builder_containerbuild.FileWatcher(str(tmpdir), logging.getLogger('test'),
+                                                     use_inotify=use_inotify)
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b'data')
+        watcher.wait(0, min_interval=60)
+        del sleeps[:]
+
+        # data waiting in fds don't end the minimal interval
+        watcher.wait(60, min_interval=60, fds=[read_fd])
+        assert sleeps == [60]
+        del sleeps[:]
+
+        # exit of the writer ends it
+        watcher.wait(60, min_interval=60, exit_fds=[read_fd])
+        assert sleeps == []
+
+        os.close(read_fd)
+        os.close(write_fd)
+        watcher.clean()
+
+    @pytest.mark.parametrize(('link_error', 'clone_error', 'expected'), [
+        (None, None, 'link'),
+        (OSError('cross-device link'), None, 'reflink'),
+        (OSError('cross-device link'), OSError('not supported'), 'copy'),
+    ])
+    def test_link_or_copy(self, tmpdir, link_error, clone_error, expected):
+        source = tmpdir.join('source.json')
+        source.write('{}')
+        source.chmod(0o640)
+        target = tmpdir.join('target.json')
+        if link_error:
+            flexmock(os).should_receive('link').and_raise(link_error)
+        clone = flexmock(builder_containerbuild.fcntl).should_receive('ioctl')
+        if clone_error:
+            clone.and_raise(clone_error)
+        elif link_error:
+            # cloned data are copied here, tmpdir may not support reflinks
+            clone.replace_with(lambda fd, request, src_fd:
+                               os.write(fd, os.pread(src_fd, 1024, 0)))
+
+        assert builder_containerbuild.link_or_copy(str(source), str(target)) == expected
+        assert target.read() == '{}'
+        assert target.stat().mode & 0o777 == 0o640
+        assert (target.stat().ino == source.stat().ino) == (expected == 'link')
+
+        # the same file can be named again
+        assert builder_containerbuild.link_or_copy(str(source), str(target)) == expected
+        assert source.read() == target.read() == '{}'
+
+    def test_lazy_imports(self):
+        interpreter_modules = imported_modules('pass')
+        plugin_modules = imported_modules(
+            'import koji_containerbuild.plugins.builder_containerbuild')
+
+        assert 'koji_containerbuild' in plugin_modules
+        for module in ('osbs', 'jsonschema', 'dockerfile_parse', 'distutils'):
+            assert module not in plugin_modules - interpreter_modules
+
     @pytest.mark.parametrize(('task_method', 'method'), [
         (builder_containerbuild.BuildContainerTask, 'buildContainer'),
         (builder_containerbuild.BuildSourceContainerTask, 'buildSourceContainer'),
@@ -102,6 +311,232 @@ class TestBuilder(object):
         assert isinstance(osbs_obj, osbs.api.OSBS)
         assert osbs_obj.os_conf.conf_section == expected_conf_section
 
+    def test_osbs_conf_parsed_once(self):
+        cct = builder_containerbuild.BuildContainerTask(id=1,
+                                                        method='buildContainer',
+                                                        params='params',
+                                                        session='session',
+                                                        options='options',
+                                                        workdir='workdir')
+        osbs_obj = cct.osbs()
+        assert cct.osbs() is osbs_obj
+
+        # the build process creates its own OSBS object from the parsed configuration
+        cct._osbs = None
+        child_osbs_obj = cct.osbs()
+        assert child_osbs_obj is not osbs_obj
+        assert child_osbs_obj.os_conf is osbs_obj.os_conf
+
+    @pytest.mark.parametrize('keep_alive', [True, False])
+    def test_setup_http_pool(self, keep_alive):
+        clients = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                clients.append(self.client_address)
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, *args):
+                pass
+
+        assert builder_containerbuild.setup_http_pool(pool_size=4, keep_alive=keep_alive)
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            # requests are sent by osbs-client as for any OpenShift API call
+            session = osbs.http.HttpSession()
+            url = 'http://127.0.0.1:%d/apis' % server.server_port
+            for _ in range(3):
+                assert session.get(url).content == b'{}'
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        # every request reuses the pooled connection
+        assert len(set(clients)) == (1 if keep_alive else 3)
+        assert builder_containerbuild.http_pool().requests_sent == 3
+
+        session = osbs.http.requests.Session()
+        session.mount('https://', requests.adapters.HTTPAdapter(max_retries=3))
+        adapter = session.get_adapter('https://example.com/apis')
+        assert isinstance(adapter, builder_containerbuild.PooledHTTPAdapter)
+        assert adapter.max_retries.total == 3
+        assert adapter.poolmanager.connection_pool_kw['maxsize'] == 4
+        socket_options = adapter.poolmanager.connection_pool_kw.get('socket_options', [])
+        assert ((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in socket_options) == keep_alive
+        assert (session.headers.get('Connection') == 'close') != keep_alive
+
+    def test_setup_http_pool_once_per_process(self):
+        assert builder_containerbuild.setup_http_pool()
+        pool = osbs.http.requests.pool
+        assert builder_containerbuild.setup_http_pool()
+        assert osbs.http.requests.pool is pool
+        # a forked process sets up its own pool
+        flexmock(os).should_receive('getpid').and_return(osbs.http.requests.pid + 1)
+        assert builder_containerbuild.setup_http_pool()
+        assert osbs.http.requests.pool is not pool
+        assert osbs.http.requests.module is requests
+
+    def test_setup_http_pool_no_http_stream(self, monkeypatch):
+        monkeypatch.delattr(osbs.http, 'HttpStream')
+        assert not builder_containerbuild.setup_http_pool()
+        assert osbs.http.requests is requests
+        assert builder_containerbuild.http_pool() is None
+
+    def test_setup_http_pool_unexpected_http_stream(self, monkeypatch, caplog):
+        class HttpStream(object):
+            def __init__(self, url, method, **kwargs):
+                self.session = osbs.http.requests.request(method, url)
+
+        monkeypatch.setattr(osbs.http, 'HttpStream', HttpStream)
+        assert not builder_containerbuild.setup_http_pool(logger=logging.getLogger())
+        assert osbs.http.requests is requests
+        assert builder_containerbuild.http_pool() is None
+        assert "connections to the OpenShift API aren't pooled" in caplog.text
+
+    def test_osbs_http_creates_requests_sessions(self):
+        # connections are pooled by replacing requests module of osbs.http,
+        # HttpStream has to create requests sessions and mount adapters to them
+        assert osbs.http.requests is requests
+        assert 'HttpStream' in osbs.http.HttpSession.request.__code__.co_names
+        assert builder_containerbuild.creates_requests_sessions(osbs.http)
+
+    def test_pooled_http_adapter_counts_requests(self):
+        (flexmock(requests.adapters.HTTPAdapter)
+            .should_receive('send')
+            .and_return('response'))
+        pool = builder_containerbuild.PooledHTTPAdapter()
+        adapters = [pool] + [builder_containerbuild.PooledHTTPAdapter(pool=pool)
+                             for _ in range(3)]
+
+        def send(adapter):
+            for _ in range(1000):
+                assert adapter.send('request', timeout=1) == 'response'
+
+        threads = [threading.Thread(target=send, args=(adapter,)) for adapter in adapters]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # requests of all adapters sharing the pool are counted by it
+        assert pool.requests_sent == 4000
+        assert adapters[1].poolmanager is pool.poolmanager
+        assert adapters[1].requests_sent == 0
+
+    def test_textfile_metrics(self, tmpdir):
+        directory = str(tmpdir.join('metrics'))
+        metrics = builder_containerbuild.TextfileMetrics(directory)
+        metrics.record('buildContainer', [('log_lines_total', {}, 10)], in_flight=True)
+        # task of a process which doesn't exist anymore
+        state_path = os.path.join(directory, metrics.STATE_FILE)
+        with open(state_path) as f:
+            state = json.load(f)
+        state['tasks']['999999999'] = 'buildSourceContainer'
+        state['methods'].append('buildSourceContainer')
+        with open(state_path, 'w') as f:
+            json.dump(state, f)
+
+        metrics.record('buildContainer', [('log_lines_total', {}, 5),
+                                          ('phase_seconds', {'phase': 'log_follow'}, 42),
+                                          ('phase_seconds', {'phase': 'log_follow'}, 0.2)])
+        prom_path = os.path.join(directory, metrics.PROM_FILE)
+        with open(prom_path) as f:
+            prom = f.read().splitlines()
+
+        prefix = 'koji_containerbuild_'
+        assert '# TYPE %sphase_seconds histogram' % prefix in prom
+        assert '%slog_lines_total{method="buildContainer"} 15' % prefix in prom
+        assert '%stasks_in_flight{method="buildContainer"} 1' % prefix in prom
+        assert '%stasks_in_flight{method="buildSourceContainer"} 0' % prefix in prom
+        labels = 'method="buildContainer",phase="log_follow"'
+        for bound, count in (('0.1', 0), ('0.5', 1), ('60', 2), ('+Inf', 2)):
+            bucket = '%sphase_seconds_bucket{%s,le="%s"} %d' % (prefix, labels, bound, count)
+            assert bucket in prom
+        assert '%sphase_seconds_sum{%s} 42.2' % (prefix, labels) in prom
+        assert '%sphase_seconds_count{%s} 2' % (prefix, labels) in prom
+        assert os.stat(prom_path).st_mode & 0o777 == 0o644
+
+        metrics.record('buildContainer', in_flight=False)
+        with open(prom_path) as f:
+            assert '%stasks_in_flight{method="buildContainer"} 0' % prefix in f.read()
+        assert sorted(os.listdir(directory)) == [metrics.PROM_FILE, metrics.STATE_FILE]
+
+    def test_record_metrics(self, tmpdir):
+        task = builder_containerbuild.BuildContainerTask(id=1,
+                                                         method='buildContainer',
+                                                         params='params',
+                                                         session='session',
+                                                         options='options',
+                                                         workdir=str(tmpdir))
+        # not configured
+        task._record_metrics(in_flight=True)
+
+        metrics = builder_containerbuild.TextfileMetrics(str(tmpdir))
+        flexmock(task).should_receive('metrics').and_return(metrics)
+        (flexmock(requests.adapters.HTTPAdapter)
+            .should_receive('send')
+            .and_return('response'))
+        assert builder_containerbuild.setup_http_pool()
+        pool = builder_containerbuild.http_pool()
+        for _ in range(3):
+            pool.send('request')
+        task._record_metrics([('log_bytes_total', {}, 100)])
+        pool.send('request')
+        task._record_metrics()
+
+        with open(os.path.join(str(tmpdir), metrics.PROM_FILE)) as f:
+            prom = f.read().splitlines()
+        assert 'koji_containerbuild_osbs_requests_total{method="buildContainer"} 4' in prom
+        assert 'koji_containerbuild_log_bytes_total{method="buildContainer"} 100' in prom
+
+        flexmock(metrics).should_receive('record').and_raise(OSError('read-only'))
+        task._record_metrics()
+
+    @pytest.mark.parametrize(('task_class', 'method', 'args'), [
+        (builder_containerbuild.BuildContainerTask, 'buildContainer',
+         ['git://example.com/repo#commit', 'target', {}]),
+        (builder_containerbuild.BuildSourceContainerTask, 'buildSourceContainer',
+         ['target', {'koji_build_nvr': 'image-1.0-1'}]),
+    ])
+    def test_handler_failure_in_flight(self, tmpdir, task_class, method, args):
+        task = task_class(id=1, method=method, params='params', session='session',
+                          options='options', workdir=str(tmpdir))
+        metrics = builder_containerbuild.TextfileMetrics(str(tmpdir))
+        flexmock(task).should_receive('metrics').and_return(metrics)
+        flexmock(task).should_receive('_prefetch_hub_data').and_raise(koji.BuildError('hub down'))
+
+        with pytest.raises(koji.BuildError):
+            task.handler(*args)
+
+        # the task failed before the build, it isn't in flight anymore
+        with open(os.path.join(str(tmpdir), metrics.PROM_FILE)) as f:
+            prom = f.read().splitlines()
+        assert 'koji_containerbuild_tasks_in_flight{method="%s"} 0' % method in prom
+
+    def test_record_metrics_without_http_pool(self, tmpdir):
+        task = builder_containerbuild.BuildContainerTask(id=1,
+                                                         method='buildContainer',
+                                                         params='params',
+                                                         session='session',
+                                                         options='options',
+                                                         workdir=str(tmpdir))
+        metrics = builder_containerbuild.TextfileMetrics(str(tmpdir))
+        flexmock(task).should_receive('metrics').and_return(metrics)
+        # requests aren't counted without the pool
+        task._record_metrics([('log_bytes_total', {}, 100)])
+
+        with open(os.path.join(str(tmpdir), metrics.PROM_FILE)) as f:
+            prom = f.read()
+        assert 'koji_containerbuild_log_bytes_total{method="buildContainer"} 100' in prom
+        assert 'osbs_requests_total{' not in prom
+
     def _check_logfiles(self, log_entries, logs_dir, platforms: list = None):
         def check_meta_entry(filename):
             source_file = os.path.join(koji.pathinfo.work(), filename)
@@ -218,11 +653,12 @@ class TestBuilder(object):
             .should_receive('work')
             .and_return(str(koji_tmpdir)))
 
-        (flexmock(osbs.api.OSBS)
-            .should_receive('build_not_finished').and_return(build_not_finished))
         if build_not_finished:
-            (flexmock(osbs.api.OSBS)
-                .should_receive('get_build_reason').and_return('Failed'))
+            pipeline_run = make_pipeline_run(reason='Failed', status='Unknown')
+        else:
+            pipeline_run = make_pipeline_run()
+        (flexmock(osbs.api.OSBS)
+            .should_receive('get_build').and_return(pipeline_run))
 
         if get_logs_exc:
             (flexmock(osbs.api.OSBS)
@@ -266,11 +702,12 @@ class TestBuilder(object):
         log_entries = [('task_run', 'line 1'),
                        ('task_run', 'line 2')]
 
-        (flexmock(osbs.api.OSBS)
-            .should_receive('build_not_finished').and_return(build_not_finished))
         if build_not_finished:
-            (flexmock(osbs.api.OSBS)
-                .should_receive('get_build_reason').and_return('Failed'))
+            pipeline_run = make_pipeline_run(reason='Failed', status='Unknown')
+        else:
+            pipeline_run = make_pipeline_run()
+        (flexmock(osbs.api.OSBS)
+            .should_receive('get_build').and_return(pipeline_run))
 
         if get_logs_exc:
             (flexmock(osbs.api.OSBS)
@@ -303,10 +740,773 @@ class TestBuilder(object):
         if get_logs_exc is None:
             self._check_logfiles(log_entries, str(tmpdir))
 
+    @pytest.mark.parametrize('pidfd', [True, False])
+    def test_child_watch(self, monkeypatch, pidfd):
+        if not pidfd:
+            monkeypatch.delattr(os, 'pidfd_open', raising=False)
+        elif not hasattr(os, 'pidfd_open'):
+            pytest.skip('pidfd is not supported')
+        sigchld_handler = signal.getsignal(signal.SIGCHLD)
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            os.close(write_fd)
+            os.read(read_fd, 1)
+            os._exit(3)
+        os.close(read_fd)
+
+        child = builder_containerbuild.ChildWatch(pid)
+        try:
+            assert child.fileno() is not None
+            assert not child.exited()
+            assert not builder_containerbuild.wait_readable([child], 0)
+
+            os.close(write_fd)
+            assert builder_containerbuild.wait_readable([child], 5) == [child]
+            assert child.exited()
+            assert os.WEXITSTATUS(child.status) == 3
+        finally:
+            child.close()
+        assert signal.getsignal(signal.SIGCHLD) == sigchld_handler
+
+    def test_incremental_upload_logs_backoff(self, tmpdir):
+        uploads = FakeHubUploads()
+        task = builder_containerbuild.BuildContainerTask(id=1,
+                                                         method='buildContainer',
+                                                         params='params',
+                                                         session=uploads.session(),
+                                                         options='options',
+                                                         workdir=str(tmpdir))
+        flexmock(task).should_receive('resultdir').and_return(str(tmpdir))
+        flexmock(task).should_receive('getUploadPath').and_return('uploadpath')
+        flexmock(task).should_receive('log_upload_intervals').and_return((1, 4))
+
+        intervals = []
+
+        def wait(timeout, min_interval=0, fds=(), exit_fds=()):
+            intervals.append(timeout)
+            if len(intervals) == 5:
+                tmpdir.join('x86_64.log').write('line\n')
+
+        flexmock(builder_containerbuild.FileWatcher).should_receive('wait').replace_with(wait)
+        exited = flexmock(builder_containerbuild.ChildWatch).should_receive('exited')
+        for _ in range(6):
+            exited.and_return(False)
+        exited.and_return(True)
+
+        task._incremental_upload_logs(os.getpid())
+
+        # interval doubles while nothing is uploaded and resets with new logs,
+        # the task wakes up once the coalesced data are due for upload
+        assert intervals == [1, 2, 4, 4, 4, 1, builder_containerbuild.LOG_UPLOAD_COALESCE_AGE]
+        # coalesced data are uploaded when the build process exits
+        assert uploads == {'x86_64.log': b'line\n'}
+
+    @pytest.mark.parametrize(('platforms', 'task_run_name', 'expected'), [
+        (['x86_64', 's390x'], 'binary-container-build-x86-64', 'x86_64'),
+        (['x86_64', 's390x'], 'binary-container-build-s390x', 's390x'),
+        (['x86_64', 's390x'], 'binary-container-prebuild', 'noarch'),
+        (['x86_64', 's390x'], 'binary-container-hermeto', 'noarch'),
+        ([], 'binary-container-build-x86-64', 'noarch'),
+        (None, 'binary-container-build-x86-64', 'noarch'),
+    ])
+    def test_log_router(self, platforms, task_run_name, expected):
+        router = builder_containerbuild.LogRouter(platforms)
+        assert router[task_run_name] == expected
+        assert router == {task_run_name: expected}
+
+    def test_log_router_custom_rule(self):
+        calls = []
+
+        def rule(task_run_name, platforms):
+            calls.append(task_run_name)
+            assert platforms == [('x86_64', 'x86-64'), ('ppc64le', 'ppc64le')]
+            suffix = task_run_name.rsplit('.', 1)[-1]
+            return suffix if suffix in dict(platforms) else None
+
+        router = builder_containerbuild.LogRouter(['x86_64', 'ppc64le'], rule=rule)
+        for _ in range(3):
+            assert router['build.ppc64le'] == 'ppc64le'
+            assert router['build.x86_64'] == 'x86_64'
+            assert router['prebuild'] == 'noarch'
+        # every task run name is resolved only once
+        assert calls == ['build.ppc64le', 'build.x86_64', 'prebuild']
+
+    def test_buffered_log_writer(self, tmpdir):
+        logfile = tmpdir.join('x86_64.log')
+        writer = builder_containerbuild.BufferedLogWriter(open(str(logfile), 'wb'))
+        line = b'x' * 1023 + b'\n'
+
+        for _ in range(builder_containerbuild.LOG_BUFFER_SIZE // len(line) - 1):
+            writer.write(line)
+        assert logfile.size() == 0
+
+        # size threshold reached
+        writer.write(line)
+        assert logfile.size() == builder_containerbuild.LOG_BUFFER_SIZE
+
+        writer.write(b'line\n')
+        writer.flush_expired(1)
+        assert logfile.size() == builder_containerbuild.LOG_BUFFER_SIZE
+        writer.flush_expired(0)
+        assert logfile.size() == builder_containerbuild.LOG_BUFFER_SIZE + 5
+
+        writer.write(b'line\n')
+        writer.flush()
+        assert logfile.size() == builder_containerbuild.LOG_BUFFER_SIZE + 10
+
+        writer.write(b'last line\n')
+        writer.close()
+        assert logfile.size() == builder_containerbuild.LOG_BUFFER_SIZE + 20
+
+    def test_buffered_log_writer_age(self, tmpdir, monkeypatch):
+        logfile = tmpdir.join('x86_64.log')
+        writer = builder_containerbuild.BufferedLogWriter(open(str(logfile), 'wb'))
+        now = iter([10, 10 + builder_containerbuild.LOG_BUFFER_AGE])
+        monkeypatch.setattr(builder_containerbuild, 'time', flexmock(monotonic=lambda: next(now)))
+
+        writer.write(b'line 1\n')
+        assert logfile.size() == 0
+        writer.write(b'line 2\n')
+        assert logfile.read() == 'line 1\nline 2\n'
+        writer.close()
+
+    def test_log_flusher(self):
+        flushed = threading.Event()
+
+        class Writer(object):
+            def flush_expired(self, max_age):
+                assert max_age == 0.01
+                flushed.set()
+
+        writer = Writer()
+        flusher = builder_containerbuild.LogFlusher(flexmock(), interval=0.01)
+        assert flusher.add(writer) is writer
+        flusher.start()
+        assert flushed.wait(5)
+        flusher.stop()
+        assert not flusher.is_alive()
+
+    def test_log_flusher_concurrent_writes(self, monkeypatch):
+        monkeypatch.setattr(builder_containerbuild, 'time', __import__('time'))
+        read_fd, write_fd = os.pipe()
+        stream = builder_containerbuild.LogStreamWriter(write_fd)
+        reader = builder_containerbuild.LogStreamReader(read_fd)
+        flusher = builder_containerbuild.LogFlusher(flexmock(), interval=0.001)
+        names = ['noarch.log', 'x86_64.log']
+        writers = [flusher.add(builder_containerbuild.BufferedLogWriter(
+            builder_containerbuild.StreamedLogFile(stream, name))) for name in names]
+
+        flusher.start()
+        for number in range(5000):
+            for writer in writers:
+                writer.write(b'line %d\n' % number)
+            if number % 500 == 0:
+                stream.send(builder_containerbuild.LOG_STREAM_USER_WARNING,
+                            'user_warnings.log', b'warning')
+        flusher.stop()
+        for writer in writers:
+            writer.close()
+        stream.close()
+
+        records = []
+        while not reader.eof:
+            select.select([reader], [], [], 5)
+            records.extend(reader.read_records())
+        records.extend(reader.read_records())
+        reader.close()
+        received = {}
+        for _, name, data in records:
+            received[name] = received.get(name, b'') + data
+        # data flushed by both threads arrive complete and in order
+        expected = b''.join(b'line %d\n' % number for number in range(5000))
+        assert received == {'noarch.log': expected, 'x86_64.log': expected,
+                            'user_warnings.log': b'warning' * 10}
+
+    def test_log_stream(self):
+        read_fd, write_fd = os.pipe()
+        writer = builder_containerbuild.LogStreamWriter(write_fd)
+        reader = builder_containerbuild.LogStreamReader(read_fd)
+
+        assert reader.read_records() == []
+        writer.send(builder_containerbuild.LOG_STREAM_DATA, 'x86_64.log', b'line 1\n')
+        writer.send(builder_containerbuild.LOG_STREAM_DATA, u'\u2017.log', b'')
+        # incomplete record is kept until the rest arrives
+        record = builder_containerbuild.LOG_STREAM_HEADER.pack(b'L', 5, 3) + b'a.log'
+        os.write(write_fd, record + b'1')
+        assert reader.read_records() == [
+            (b'L', 'x86_64.log', b'line 1\n'),
+            (b'L', u'\u2017.log', b''),
+        ]
+        os.write(write_fd, b'23')
+        writer.close()
+        assert reader.read_records() == [(b'L', 'a.log', b'123')]
+        assert reader.eof
+        reader.close()
+
+    def test_log_stream_drained(self):
+        read_fd, write_fd = os.pipe()
+        writer = builder_containerbuild.LogStreamWriter(write_fd)
+        reader = builder_containerbuild.LogStreamReader(read_fd)
+        data = b'x' * 65536
+        sent = threading.Event()
+
+        def send():
+            # more than the pipe holds, while the reader doesn't read records
+            for _ in range(64):
+                writer.send(builder_containerbuild.LOG_STREAM_DATA, 'x86_64.log', data)
+            sent.set()
+
+        thread = threading.Thread(target=send)
+        thread.start()
+        assert sent.wait(5)
+        thread.join()
+        # the reader is woken up by received data
+        assert select.select([reader], [], [], 5)[0] == [reader]
+        records = reader.read_records()
+        assert records == [(b'L', 'x86_64.log', data)] * 64
+        writer.close()
+        reader.close()
+
+    def test_log_stream_concurrent_senders(self):
+        read_fd, write_fd = os.pipe()
+        writer = builder_containerbuild.LogStreamWriter(write_fd)
+        reader = builder_containerbuild.LogStreamReader(read_fd)
+        sent = {'x86_64.log': b'x' * 102400, 'ppc64le.log': b'p' * 102400}
+
+        def send(name):
+            for _ in range(16):
+                writer.send(builder_containerbuild.LOG_STREAM_DATA, name, sent[name])
+
+        threads = [threading.Thread(target=send, args=(name,)) for name in sent]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+
+        records = []
+        while not reader.eof:
+            select.select([reader], [], [], 5)
+            records.extend(reader.read_records())
+        records.extend(reader.read_records())
+        # records of both threads arrive whole, none is interleaved with another
+        assert len(records) == 32
+        for kind, name, data in records:
+            assert kind == builder_containerbuild.LOG_STREAM_DATA
+            assert data == sent[name]
+        reader.close()
+
+    def test_write_logs_broken_stream(self, tmpdir):
+        cct = builder_containerbuild.BuildContainerTask(id=1,
+                                                        method='buildContainer',
+                                                        params='params',
+                                                        session='session',
+                                                        options='options',
+                                                        workdir='workdir')
+
+        def logs():
+            yield 'task_run', 'line 1'
+            yield 'task_run_x86-64', 'x86_64 line 1'
+            raise requests.exceptions.ConnectionError('connection reset')
+
+        (flexmock(osbs.api.OSBS)
+            .should_receive('get_build_logs')
+            .and_return(logs()))
+        (flexmock(osbs.api.OSBS)
+            .should_receive('get_final_platforms').and_return(['x86_64']))
+
+        with pytest.raises(requests.exceptions.ConnectionError):
+            cct._write_logs('id', str(tmpdir), platforms=['x86_64'])
+
+        # lines buffered before the failure are written
+        assert tmpdir.join('osbs-build.log').read() == \
+            'line 1\nx86_64 build has started. Check platform specific logs\n'
+        assert tmpdir.join('x86_64.log').read() == 'x86_64 line 1\n'
+
+    def test_write_logs_streaming(self, tmpdir):
+        cct = builder_containerbuild.BuildContainerTask(id=1,
+                                                        method='buildContainer',
+                                                        params='params',
+                                                        session='session',
+                                                        options='options',
+                                                        workdir='workdir')
+        log_entries = [
+            ('task_run', 'line 1'),
+            ('task_run', 'log - USER_WARNING - {"message": "message"}'),
+            ('task_run_x86-64', 'x86_64 line 1'),
+            ('task_run_x86-64', 'log - USER_WARNING - {"message": "message"}'),
+            ('binary-container-hermeto', 'hermeto line 1'),
+            ('task_run_x86-64', 'x86_64 line 2'),
+            ('task_run', 'line 2'),
+        ]
+        (flexmock(osbs.api.OSBS)
+            .should_receive('get_build_logs')
+            .and_return(log_entries))
+        (flexmock(osbs.api.OSBS)
+            .should_receive('get_final_platforms').and_return(['x86_64']))
+
+        read_fd, write_fd = cct._open_log_streams()
+        cct._log_stream_writer = builder_containerbuild.LogStreamWriter(write_fd)
+        reader = builder_containerbuild.LogStreamReader(read_fd)
+
+        cct._write_logs('id', str(tmpdir), platforms=['x86_64'])
+        cct._log_stream_writer.close()
+
+        # nothing is written by the build process
+        assert os.listdir(str(tmpdir)) == []
+
+        streamed_logs = builder_containerbuild.StreamedLogs(str(tmpdir))
+        warnings = []
+        for kind, name, data in reader.read_records():
+            if kind == builder_containerbuild.LOG_STREAM_USER_WARNING:
+                warnings.append((name, data))
+            else:
+                assert kind == builder_containerbuild.LOG_STREAM_DATA
+            streamed_logs.append(name, data)
+        streamed_logs.close()
+        reader.close()
+
+        assert warnings == [('user_warnings.log', b'message')]
+
+        assert 'remote-sources.log' in streamed_logs
+        self._check_logfiles(log_entries, str(tmpdir), platforms=['x86_64'])
+
+    def test_write_logs_user_warnings_prefilter(self, tmpdir, monkeypatch):
+        cct = builder_containerbuild.BuildContainerTask(id=1,
+                                                        method='buildContainer',
+                                                        params='params',
+                                                        session='session',
+                                                        options='options',
+                                                        workdir='workdir')
+        log_entries = [
+            ('task_run', 'line 1'),
+            ('task_run', 'log - USER_WARNING - {"message": "message"}'),
+            ('task_run', 'line {}'),
+        ]
+        (flexmock(osbs.api.OSBS)
+            .should_receive('get_build_logs')
+            .and_return(log_entries))
+        checked = []
+        is_user_warning = UserWarningsStore.is_user_warning
+        monkeypatch.setattr(UserWarningsStore, 'is_user_warning',
+                            lambda store, line: checked.append(line) or
+                            is_user_warning(store, line))
+
+        cct._write_logs('id', str(tmpdir))
+        monkeypatch.undo()
+
+        # only the line which can be a user warning is checked by the store
+        assert checked == [log_entries[1][1]]
+        self._check_logfiles(log_entries, str(tmpdir))
+
+    def test_write_logs_user_warning_trailing_whitespace(self, tmpdir):
+        cct = builder_containerbuild.BuildContainerTask(id=1,
+                                                        method='buildContainer',
+                                                        params='params',
+                                                        session='session',
+                                                        options='options',
+                                                        workdir='workdir')
+        log_entries = [
+            ('task_run', 'line 1'),
+            ('task_run', 'log - USER_WARNING - {"message": "message"}  \n'),
+        ]
+        (flexmock(osbs.api.OSBS)
+            .should_receive('get_build_logs')
+            .and_return(log_entries))
+
+        cct._write_logs('id', str(tmpdir))
+
+        with open(os.path.join(str(tmpdir), 'user_warnings.log')) as f:
+            assert f.read() == 'message'
+        with open(os.path.join(str(tmpdir), 'osbs-build.log')) as f:
+            assert f.read() == 'line 1\n'
+
+    def test_upload_streamed_logs(self, tmpdir):
+        uploads = FakeHubUploads()
+        cct = builder_containerbuild.BuildContainerTask(id=1,
+                                                        method='buildContainer',
+                                                        params='params',
+                                                        session=uploads.session(),
+                                                        options='options',
+                                                        workdir=str(tmpdir))
+        read_fd, write_fd = cct._open_log_streams()
+        writer = builder_containerbuild.LogStreamWriter(write_fd)
+        cct._log_stream_reader = builder_containerbuild.LogStreamReader(read_fd)
+        cct._streamed_logs = builder_containerbuild.StreamedLogs(cct.resultdir())
+        uploader = builder_containerbuild.LogUploader(cct.session, 'uploadpath', cct.logger)
+
+        writer.send(builder_containerbuild.LOG_STREAM_DATA, 'x86_64.log', b'line 1\n')
+        writer.send(builder_containerbuild.LOG_STREAM_DATA, 'x86_64.log', b'line 2\n')
+        writer.send(builder_containerbuild.LOG_STREAM_DATA, 'osbs-build.log', b'line 1\n')
+        assert cct._upload_streamed_logs(uploader) == 21
+        writer.send(builder_containerbuild.LOG_STREAM_DATA, 'x86_64.log', b'line 3\n')
+        writer.send(builder_containerbuild.LOG_STREAM_USER_WARNING, 'user_warnings.log',
+                    b'message')
+        writer.send(builder_containerbuild.LOG_STREAM_USER_WARNING, 'user_warnings.log',
+                    b'another message')
+        writer.close()
+        assert cct._upload_streamed_logs(uploader) == 30
+        cct._streamed_logs.close()
+        uploader.flush(force=True)
+
+        # all logs are uploaded in a single multicall
+        assert cct.session.multicall_batches == [['uploadFile'] * 3]
+        assert uploads == {
+            'x86_64.log': b'line 1\nline 2\nline 3\n',
+            'osbs-build.log': b'line 1\n',
+            'user_warnings.log': b'message\nanother message',
+        }
+        assert cct._user_warnings == ['message', 'another message']
+        with open(os.path.join(cct.resultdir(), 'x86_64.log'), 'rb') as backup:
+            assert backup.read() == b'line 1\nline 2\nline 3\n'
+
+        # streamed logs are not uploaded once more from the disk
+        cct.session.multicall_batches = []
+        cct._log_stream_reader.close()
+        cct._log_stream_reader = None
+        cct._upload_logs_once()
+        assert cct.session.multicall_batches == []
+
+    def test_log_uploader_coalescing(self, monkeypatch):
+        uploads = FakeHubUploads()
+        session = uploads.session()
+        now = [100]
+        monkeypatch.setattr(builder_containerbuild, 'time', flexmock(monotonic=lambda: now[0]))
+        uploader = builder_containerbuild.LogUploader(session, 'uploadpath', logging.getLogger(),
+                                                      coalesce_size=10, coalesce_age=5)
+        assert uploader.timeout() is None
+
+        uploader.add('x86_64.log', 0, b'line 1\n')
+        uploader.add('s390x.log', 0, b'line 1\n')
+        now[0] = 102
+        assert uploader.timeout() == 3
+        uploader.flush()
+        assert uploads == {}
+
+        # size threshold
+        uploader.add('x86_64.log', 7, b'line 2\n')
+        uploader.flush()
+        assert uploads == {'x86_64.log': b'line 1\nline 2\n'}
+        assert uploader.timeout() == 3
+
+        # age threshold
+        now[0] = 105
+        uploader.flush()
+        assert uploads['s390x.log'] == b'line 1\n'
+        assert uploader.timeout() is None
+
+        # the log was rewritten, pending data are uploaded first
+        uploader.add('x86_64.log', 14, b'line 3\n')
+        uploader.add('x86_64.log', 0, b'new\n')
+        assert uploads['x86_64.log'] == b'line 1\nline 2\nline 3\n'
+        uploader.flush(force=True)
+        assert uploads['x86_64.log'] == b'new\n'
+        assert len(session.multicall_batches) == 4
+        assert uploader.stats['x86_64.log'][:2] == [25, 3]
+
+    def test_log_uploader_batches(self):
+        chunk_size = builder_containerbuild.LOG_UPLOAD_CHUNK_SIZE
+        uploads = FakeHubUploads(fail=[('x86_64.log', chunk_size)])
+        session = uploads.session()
+        uploader = builder_containerbuild.LogUploader(session, 'uploadpath', logging.getLogger(),
+                                                      batch_size=4 * chunk_size)
+        x86_64_log = os.urandom(3 * chunk_size)
+        s390x_log = os.urandom(2 * chunk_size)
+        uploader.add('x86_64.log', 0, x86_64_log)
+        uploader.add('s390x.log', 0, s390x_log)
+        # the failed chunk and the following ones are uploaded once more
+        (flexmock(builder_containerbuild)
+            .should_receive('incremental_upload')
+            .replace_with(uploads.upload)
+            .once())
+        uploader.flush(force=True)
+
+        assert session.multicall_batches == [['uploadFile'] * 4, ['uploadFile']]
+        assert uploads == {'x86_64.log': x86_64_log, 's390x.log': s390x_log}
+        assert uploader.stats['x86_64.log'][:2] == [3 * chunk_size, 1]
+        assert uploader.retries == 2
+        assert uploader.stats['s390x.log'][:2] == [2 * chunk_size, 2]
+
+    def test_log_uploader_fast_upload(self):
+        chunk_size = builder_containerbuild.LOG_UPLOAD_CHUNK_SIZE
+        uploads = FakeHubUploads()
+        session = uploads.session()
+        session.opts['use_fast_upload'] = True
+        uploader = builder_containerbuild.LogUploader(session, 'uploadpath', logging.getLogger())
+        x86_64_log = os.urandom(2 * chunk_size)
+        uploader.add('x86_64.log', 0, x86_64_log)
+        uploader.add('s390x.log', 0, b'line 1\n')
+        # every chunk is uploaded by rawUpload of incremental_upload
+        (flexmock(builder_containerbuild)
+            .should_receive('incremental_upload')
+            .replace_with(uploads.upload)
+            .times(3))
+        uploader.flush(force=True)
+
+        assert session.multicall_batches == []
+        assert uploads == {'x86_64.log': x86_64_log, 's390x.log': b'line 1\n'}
+        assert uploader.stats['x86_64.log'][:2] == [2 * chunk_size, 1]
+
+    def test_log_uploader_workers(self):
+        uploads = FakeHubUploads()
+        session = uploads.session()
+        upload_file = uploads.uploadFile
+        x86_64_uploaded = threading.Event()
+
+        def uploadFile(path, name, size, checksum, offset, data):
+            if name == 's390x.log':
+                # x86_64 log is uploaded while s390x one is stuck
+                assert x86_64_uploaded.wait(5)
+            uploaded = upload_file(path, name, size, checksum, offset, data)
+            if name == 'x86_64.log' and offset == 7:
+                x86_64_uploaded.set()
+            return uploaded
+
+        uploads.uploadFile = uploadFile
+        uploader = builder_containerbuild.LogUploader(session, 'uploadpath', logging.getLogger(),
+                                                      workers=2)
+        for name, offset, data in [('s390x.log', 0, b'line 1\n'),
+                                   ('x86_64.log', 0, b'line 1\n'),
+                                   ('x86_64.log', 7, b'line 2\n'),
+                                   ('s390x.log', 7, b'line 2\n')]:
+            uploader.add(name, offset, data)
+            uploader.flush(force=True)
+        uploader.close()
+
+        # uploads of a log are kept in order
+        assert uploads == {'x86_64.log': b'line 1\nline 2\n', 's390x.log': b'line 1\nline 2\n'}
+        assert session.multicall_batches == []
+        assert len(uploads.subsessions) == 2
+        assert all(subsession.logged_out for subsession in uploads.subsessions)
+        assert uploader.stats['s390x.log'][:2] == [14, 2]
+
+    def test_log_uploader_workers_error(self):
+        uploads = FakeHubUploads()
+        uploader = builder_containerbuild.LogUploader(uploads.session(), 'uploadpath',
+                                                      logging.getLogger(), workers=2)
+        (flexmock(uploader)
+            .should_receive('_send')
+            .and_raise(koji.GenericError('upload failed')))
+        uploader.add('x86_64.log', 0, b'line 1\n')
+        uploader.flush(force=True)
+        with pytest.raises(koji.GenericError, match='upload failed'):
+            uploader.close()
+        assert [subsession.logged_out for subsession in uploads.subsessions] == [True]
+
+    def test_log_uploader_compress(self, tmpdir):
+        uploads = FakeHubUploads()
+        uploader = builder_containerbuild.LogUploader(uploads.session(), 'uploadpath',
+                                                      logging.getLogger(), compress=True)
+        uploader.add('x86_64.log', 0, b'line 1\n')
+        uploader.add('metadata.json', 0, b'{}')
+        uploader.flush(names=['x86_64.log', 'metadata.json'])
+        # the uploaded part of the compressed log can be read before it ends
+        decompressor = zlib.decompressobj(31)
+        assert decompressor.decompress(bytes(uploads['x86_64.log.gz'])) == b'line 1\n'
+        assert uploads['metadata.json'] == b'{}'
+        assert sorted(uploads) == ['metadata.json', 'x86_64.log.gz']
+
+        tmpdir.join('x86_64.log').write('line 1\n' + 'line 2\n' * 1000)
+        with open(str(tmpdir.join('x86_64.log'))) as fd:
+            fd.seek(7)
+            assert uploader.add_file('x86_64.log', fd) == 7000
+            assert uploader.add_file('x86_64.log', fd) == 0
+        uploader.flush(force=True)
+
+        # data of the log are compressed by a single stream
+        assert gzip.decompress(uploads['x86_64.log.gz']) == b'line 1\n' + b'line 2\n' * 1000
+        assert len(uploads['x86_64.log.gz']) < 100
+        # the tail of the log is uploaded uncompressed when it ends
+        assert uploads['x86_64.log'] == b'line 1\n' + b'line 2\n' * 1000
+        assert sorted(uploads) == ['metadata.json', 'x86_64.log', 'x86_64.log.gz']
+
+        # data following the ended stream are compressed as another gzip member
+        uploader.add('x86_64.log', 7007, b'line 3\n')
+        uploader.flush(force=True)
+        log = b'line 1\n' + b'line 2\n' * 1000 + b'line 3\n'
+        assert gzip.decompress(uploads['x86_64.log.gz']) == log
+        assert uploads['x86_64.log'] == log
+
+        # the log was rewritten, so is the compressed one
+        uploader.add('x86_64.log', 0, b'new\n')
+        uploader.flush(force=True)
+        assert gzip.decompress(uploads['x86_64.log.gz']) == b'new\n'
+        assert uploads['x86_64.log'] == b'new\n'
+
+    def test_log_tail(self):
+        assert builder_containerbuild.log_tail(b'line 1\nline 2\n', size=14) == (b'line 1\n'
+                                                                                 b'line 2\n')
+        assert builder_containerbuild.log_tail(b'line 1\nline 2\n', size=13) == b'line 2\n'
+        assert builder_containerbuild.log_tail(b'line 1\nline 2\n', size=7) == b'line 2\n'
+        # a line longer than the tail is cut
+        assert builder_containerbuild.log_tail(b'line 1\nline 2\n', size=5) == b'ne 2\n'
+        assert builder_containerbuild.log_tail(b'line 1\nline 2', size=5) == b'ine 2'
+
+    @pytest.mark.parametrize('mode', ['none', 'chunks', 'final'])
+    def test_compressed_log_uploads(self, tmpdir, mode):
+        uploads = FakeHubUploads()
+        task = builder_containerbuild.BuildContainerTask(id=1,
+                                                         method='buildContainer',
+                                                         params='params',
+                                                         session=uploads.session(),
+                                                         options='options',
+                                                         workdir=str(tmpdir))
+        flexmock(task).should_receive('getUploadPath').and_return('uploadpath')
+        flexmock(task).should_receive('log_compression').and_return(mode)
+        flexmock(builder_containerbuild).should_receive('incremental_upload').replace_with(
+            uploads.upload)
+
+        big_log = b''.join(b'line %d\n' % i for i in range(20000))
+        small_log = b'line\n'
+        with open(os.path.join(task.resultdir(), 'osbs-build.log'), 'wb') as f:
+            f.write(big_log)
+        with open(os.path.join(task.resultdir(), 'x86_64.log'), 'wb') as f:
+            f.write(small_log)
+        with open(os.path.join(task.resultdir(), 'metadata.json'), 'wb') as f:
+            f.write(b'{}')
+
+        task._upload_logs_once()
+
+        assert uploads['metadata.json'] == b'{}'
+        assert uploads['x86_64.log'] == small_log
+        if mode == 'none':
+            assert uploads['osbs-build.log'] == big_log
+            assert sorted(uploads) == ['metadata.json', 'osbs-build.log', 'x86_64.log']
+        else:
+            # compressed logs replace the complete uncompressed ones, their
+            # tails stay on the hub for the browse view
+            assert gzip.decompress(uploads['osbs-build.log.gz']) == big_log
+            assert gzip.decompress(uploads['x86_64.log.gz']) == small_log
+            assert uploads['osbs-build.log'] == big_log[-len(uploads['osbs-build.log']):]
+            assert uploads['osbs-build.log'].startswith(b'line ')
+            assert (builder_containerbuild.LOG_COMPRESSION_TAIL - 20 <
+                    len(uploads['osbs-build.log']) <= builder_containerbuild.LOG_COMPRESSION_TAIL)
+            assert sorted(uploads) == ['metadata.json', 'osbs-build.log', 'osbs-build.log.gz',
+                                       'x86_64.log', 'x86_64.log.gz']
+
+    def test_log_compression_unknown(self, tmpdir, caplog):
+        task = builder_containerbuild.BuildContainerTask(id=1,
+                                                         method='buildContainer',
+                                                         params='params',
+                                                         session='session',
+                                                         options='options',
+                                                         workdir=str(tmpdir))
+        config = flexmock()
+        config.should_receive('get').with_args('logs', 'compression',
+                                               fallback='none').and_return('xz')
+        flexmock(builder_containerbuild).should_receive('read_plugin_config').and_return(config)
+        assert task.log_compression() == 'none'
+        assert "Unknown log compression 'xz'" in caplog.text
+
+    @pytest.mark.parametrize(('pipeline_run', 'succeeded', 'cancelled', 'not_finished'), [
+        (make_pipeline_run(), True, False, False),
+        (make_pipeline_run(reason='Completed'), True, False, False),
+        (make_pipeline_run(reason='Failed', status='False'), False, False, False),
+        (make_pipeline_run(reason='PipelineRunCancelled', status='False'), False, True, False),
+        (make_pipeline_run(reason='CancelledRunFinally', status='False'), False, True, False),
+        (make_pipeline_run(reason='Running', status='Unknown'), False, False, True),
+        ({'metadata': {'name': 'os-build-id'}, 'status': {}}, False, False, True),
+        ({}, False, False, True),
+    ])
+    def test_build_status_snapshot(self, pipeline_run, succeeded, cancelled, not_finished):
+        osbs_obj = flexmock(os=flexmock())
+        (osbs_obj
+            .should_receive('get_build')
+            .with_args('os-build-id')
+            .and_return(pipeline_run)
+            .once())
+
+        build_status = builder_containerbuild.BuildStatusSnapshot(osbs_obj, 'os-build-id')
+
+        for _ in range(2):
+            assert build_status.succeeded == succeeded
+            assert build_status.cancelled == cancelled
+            assert build_status.not_finished == not_finished
+            assert build_status.data == pipeline_run
+
+    def test_build_status_snapshot_results_and_refresh(self):
+        running = make_pipeline_run(reason='Running', status='Unknown')
+        finished = make_pipeline_run(results={'koji-build-id': 123, 'annotations': None})
+        osbs_obj = flexmock(os=flexmock())
+        (osbs_obj
+            .should_receive('get_build')
+            .and_return(running)
+            .and_return(finished)
+            .times(2))
+
+        build_status = builder_containerbuild.BuildStatusSnapshot(osbs_obj, 'os-build-id')
+        assert build_status.reason == 'Running'
+        assert build_status.results == {}
+
+        build_status.refresh()
+        assert build_status.reason == 'Succeeded'
+        assert build_status.results == {'koji-build-id': 123}
+
+    def test_phase_timings(self, monkeypatch):
+        now = [100]
+        monkeypatch.setattr(builder_containerbuild, 'time', flexmock(monotonic=lambda: now[0]))
+        timings = builder_containerbuild.PhaseTimings()
+
+        with timings.phase('check_labels'):
+            now[0] += 1
+            with timings.phase('scm_checkout'):
+                now[0] += 10
+            now[0] += 2
+        with pytest.raises(RuntimeError):
+            with timings.phase('log_follow'):
+                now[0] += 100
+                raise RuntimeError()
+        with timings.phase('wait_for_build'):
+            now[0] += 5
+        with timings.phase('check_labels'):
+            now[0] += 1
+        now[0] += 0.5
+
+        assert timings.report() == {
+            'total': 119.5,
+            'build': 105,
+            'overhead': 14.5,
+            'phases': [
+                {'name': 'check_labels', 'seconds': 4},
+                {'name': 'scm_checkout', 'seconds': 10},
+                {'name': 'log_follow', 'seconds': 100},
+                {'name': 'wait_for_build', 'seconds': 5},
+            ],
+        }
+        assert timings.summary() == ('Task took 119.5s, build 105.0s, overhead 14.5s '
+                                     '(check_labels 4.0s, scm_checkout 10.0s, '
+                                     'log_follow 100.0s, wait_for_build 5.0s)')
+
+    def test_report_timings(self, tmpdir, caplog):
+        task = builder_containerbuild.BuildContainerTask(id=1,
+                                                         method='buildContainer',
+                                                         params='params',
+                                                         session='session',
+                                                         options='options',
+                                                         workdir=str(tmpdir))
+        flexmock(task).should_receive('getUploadPath').and_return('uploadpath')
+        uploads = FakeHubUploads()
+        (flexmock(builder_containerbuild)
+            .should_receive('incremental_upload')
+            .replace_with(uploads.upload))
+        with task.timings.phase('osbs_create'):
+            pass
+
+        with caplog.at_level(logging.INFO):
+            task._report_timings()
+
+        with open(os.path.join(task.resultdir(), 'timings.json')) as f:
+            timings = json.load(f)
+        assert [phase['name'] for phase in timings['phases']] == ['osbs_create']
+        assert json.loads(uploads['timings.json'].decode('utf-8')) == timings
+        assert 'Task took 0.0s, build 0.0s, overhead 0.0s (osbs_create 0.0s)' in caplog.text
+
     def _mock_session(self, last_event_id, koji_task_id, pkg_info=USE_DEFAULT_PKG_INFO):
         if pkg_info == USE_DEFAULT_PKG_INFO:
             pkg_info = {'blocked': False}
-        session = flexmock()
+        session = mock_multicall(flexmock())
         (session
             .should_receive('getLastEvent')
             .and_return({'id': last_event_id}))
@@ -412,22 +1612,22 @@ class TestBuilder(object):
             .with_args('os-build-id', follow=True, wait=True)
             .and_return(logs))
         (flexmock(osbs.api.OSBS).should_receive('get_build_name').and_return('os-build-id'))
-        (flexmock(osbs.api.OSBS).should_receive('get_build').and_return({}))
-        (flexmock(osbs.api.OSBS).should_receive('get_build_reason').and_return('Succeeded'))
-        (flexmock(osbs.api.OSBS).should_receive('build_has_succeeded').and_return(True))
-        (flexmock(osbs.api.OSBS).should_receive('build_was_cancelled').and_return(False))
 
         build_results = {
-            'repositories': {'unique': ['unique-repo'], 'primary': ['primary-repo']}
+            'repositories': {'unique': ['unique-repo'], 'primary': ['primary-repo']},
+            'annotations': None,
         }
         if not create_build_args.get('scratch'):
             # only non-scratch tasks create Koji builds
             build_results['koji-build-id'] = koji_build_id
         (flexmock(osbs.api.OSBS)
-            .should_receive('get_build_results')
-            .and_return(build_results))
+            .should_receive('get_build')
+            .and_return(make_pipeline_run(results=build_results)))
 
-        (flexmock(osbs.api.OSBS).should_receive('build_not_finished').and_return(False))
+        # build status is answered from the single get_build() call
+        for method in ('get_build_reason', 'build_has_succeeded', 'build_was_cancelled',
+                       'get_build_results', 'build_not_finished'):
+            (flexmock(osbs.api.OSBS).should_receive(method).never())
         (flexmock(osbs.api.OSBS).should_receive('cancel_build').never())
         (flexmock(osbs.api.OSBS)
             .should_receive('get_build_error_message')
@@ -566,6 +1766,8 @@ class TestBuilder(object):
             .should_receive('fetchDockerfile')
             .with_args('src', 'build-tag', scratch)
             .and_return(folder_info['dockerfile_path']))
+        # Dockerfile is parsed once for all the checks
+        flexmock(builder_containerbuild.LabelsWrapper).should_call('_parse').once()
 
         if not missing_labels:
             check_return = cct.checkLabels('src', 'build-tag', scratch)
@@ -578,6 +1780,196 @@ class TestBuilder(object):
         err_msg = str(exc_info.value)
         assert all(label in err_msg for label in missing_labels)
 
+    def test_checkLabels_cache(self, tmpdir):
+        folder_info = self._mock_folders(str(tmpdir))
+        src = self._mock_git_source()
+        labels_cache = builder_containerbuild.LabelsCache(str(tmpdir.join('cache')))
+
+        def check_labels(release=None, cached=False):
+            cct = builder_containerbuild.BuildContainerTask(id=1,
+                                                            method='buildContainer',
+                                                            params='params',
+                                                            session='session',
+                                                            options='options',
+                                                            workdir='workdir')
+            flexmock(cct).should_receive('labels_cache').and_return(labels_cache)
+            (flexmock(cct)
+                .should_receive('fetchDockerfile')
+                .and_return(folder_info['dockerfile_path'])
+                .times(0 if cached else 1))
+            label_overwrites = {'release': release} if release else None
+            return cct.checkLabels(src['src'], 'build-tag', False,
+                                   label_overwrites=label_overwrites)
+
+        assert check_labels() == ('fedora-docker', None)
+        assert check_labels(cached=True) == ('fedora-docker', None)
+        # release overwrite changes expected NVR
+        assert check_labels(release='3') == ('fedora-docker', 'fedora-docker-25-3')
+        assert check_labels(release='3', cached=True) == ('fedora-docker', 'fedora-docker-25-3')
+
+    def test_checkLabels_cache_branch(self, tmpdir):
+        folder_info = self._mock_folders(str(tmpdir))
+        cct = builder_containerbuild.BuildContainerTask(id=1,
+                                                        method='buildContainer',
+                                                        params='params',
+                                                        session='session',
+                                                        options='options',
+                                                        workdir='workdir')
+        labels_cache = builder_containerbuild.LabelsCache(str(tmpdir.join('cache')))
+        flexmock(cct).should_receive('labels_cache').and_return(labels_cache)
+        (flexmock(cct)
+            .should_receive('fetchDockerfile')
+            .and_return(folder_info['dockerfile_path'])
+            .times(2))
+        src = 'git://pkgs.example.com/rpms/fedora-docker#main'
+        for _ in range(2):
+            assert cct.checkLabels(src, 'build-tag', False) == ('fedora-docker', None)
+        assert not tmpdir.join('cache').check()
+
+    def test_checkLabels_cache_module(self, tmpdir):
+        folder_info = self._mock_folders(str(tmpdir))
+        cct = builder_containerbuild.BuildContainerTask(id=1,
+                                                        method='buildContainer',
+                                                        params='params',
+                                                        session='session',
+                                                        options='options',
+                                                        workdir='workdir')
+        labels_cache = builder_containerbuild.LabelsCache(str(tmpdir.join('cache')))
+        flexmock(cct).should_receive('labels_cache').and_return(labels_cache)
+        (flexmock(cct)
+            .should_receive('fetchDockerfile')
+            .and_return(folder_info['dockerfile_path'])
+            .times(2))
+        # the same commit with Dockerfiles in different subdirectories
+        commit = 'b8120b486367ec33fbbfa408542eec7eded8b54e'
+        for module in ('first', 'second'):
+            src = 'git://pkgs.example.com/rpms/fedora-docker?%s#%s' % (module, commit)
+            assert cct.checkLabels(src, 'build-tag', False) == ('fedora-docker', None)
+
+    @pytest.mark.parametrize('cbtype', ['preSCMCheckout', 'postSCMCheckout'])
+    def test_checkLabels_cache_scm_callbacks(self, tmpdir, monkeypatch, cbtype):
+        folder_info = self._mock_folders(str(tmpdir))
+        src = self._mock_git_source()
+        cct = builder_containerbuild.BuildContainerTask(id=1,
+                                                        method='buildContainer',
+                                                        params='params',
+                                                        session='session',
+                                                        options='options',
+                                                        workdir='workdir')
+        labels_cache = builder_containerbuild.LabelsCache(str(tmpdir.join('cache')))
+        flexmock(cct).should_receive('labels_cache').and_return(labels_cache)
+        # callbacks of other plugins run for every checkout
+        monkeypatch.setitem(koji.plugin.callbacks, cbtype, [lambda *args, **kwargs: None])
+        (flexmock(cct)
+            .should_receive('fetchDockerfile')
+            .and_return(folder_info['dockerfile_path'])
+            .times(2))
+        for _ in range(2):
+            assert cct.checkLabels(src['src'], 'build-tag', False) == ('fedora-docker', None)
+        assert not tmpdir.join('cache').check()
+
+    def test_labels_cache_eviction(self, tmpdir):
+        entry = {'component': 'fedora-docker', 'expected_nvr': 'fedora-docker-25-3'}
+        # room for two entries
+        labels_cache = builder_containerbuild.LabelsCache(str(tmpdir),
+                                                          max_size=2 * len(json.dumps(entry)))
+        keys = [labels_cache.key('git://example.com/repo#' + str(i) * 40) for i in range(3)]
+
+        for mtime, key in enumerate(keys[:2]):
+            labels_cache.put(key, entry)
+            os.utime(str(tmpdir.join(key + '.json')), (mtime, mtime))
+        # reading the oldest entry makes it most recently used
+        assert labels_cache.get(keys[0]) == entry
+
+        labels_cache.put(keys[2], entry)
+        assert labels_cache.get(keys[0]) == entry
+        assert labels_cache.get(keys[1]) is None
+        assert labels_cache.get(keys[2]) == entry
+        assert labels_cache.get(labels_cache.key('git://example.com/repo#' + 'a' * 40)) is None
+
+    def test_labels_wrapper_invalidate(self, tmpdir):
+        dockerfile = tmpdir.join('Dockerfile')
+        dockerfile.write('FROM fedora\nLABEL name=fedora version=25\n')
+        labels_wrapper = builder_containerbuild.LabelsWrapper(str(dockerfile),
+                                                              label_overwrites={'release': '3'})
+        assert labels_wrapper.get_data_labels() == {'NAME': 'fedora', 'VERSION': '25',
+                                                    'RELEASE': '3'}
+
+        dockerfile.write('FROM fedora\nLABEL name=fedora version=26\n')
+        assert labels_wrapper.get_labels() == {'name': 'fedora', 'version': '25'}
+        assert labels_wrapper.get_data_labels()['VERSION'] == '25'
+
+        labels_wrapper.invalidate()
+        assert labels_wrapper.get_labels() == {'name': 'fedora', 'version': '26'}
+        assert labels_wrapper.get_data_labels()['VERSION'] == '26'
+
+    def test_prefetch_hub_data(self, tmpdir):
+        koji_task_id = 123
+        last_event_id = 456
+        session = self._mock_session(last_event_id, koji_task_id)
+        task = builder_containerbuild.BuildContainerTask(id=koji_task_id,
+                                                         method='buildContainer',
+                                                         params='params',
+                                                         session=session,
+                                                         options={},
+                                                         workdir=str(tmpdir))
+        task._prefetch_hub_data('target')
+
+        assert session.multicall_batches == [
+            ['getLastEvent', 'getTaskInfo'],
+            ['getBuildTarget', 'getUser', 'getChannel'],
+        ]
+        assert task.event_id == last_event_id
+        assert sum(task.hub.misses.values()) == 5
+
+        # prefetched data don't go to the hub again
+        task.hub.session = flexmock()
+        assert task.hub.getTaskInfo(koji_task_id) == {'owner': 'owner', 'channel_id': 1}
+        assert task.hub.getUser('owner') == {'name': 'owner-name'}
+        assert task.hub.getChannel(1, strict=True) == {'name': 'default_channel'}
+        assert task.hub.getBuildTarget('target', event=last_event_id)['name'] == 'target-name'
+
+    def test_hub_lookups_memoized(self, tmpdir):
+        koji_task_id = 123
+        session = self._mock_session(456, koji_task_id)
+        (flexmock(koji.daemon.SCM)
+            .should_receive('assert_allowed')
+            .and_return(True)
+            .once())
+        options = flexmock(allowed_scms='pkgs.example.com:/*:no',
+                           allowed_scms_use_config=True,
+                           allowed_scms_use_policy=True)
+        task = builder_containerbuild.BuildContainerTask(id=koji_task_id,
+                                                         method='buildContainer',
+                                                         params='params',
+                                                         session=session,
+                                                         options=options,
+                                                         workdir=str(tmpdir))
+        src = self._mock_git_source()
+
+        # as fetchDockerfile and createContainer do
+        for _ in range(2):
+            this_task = task.hub.getTaskInfo(koji_task_id)
+            task._get_scm(src['src'], this_task, False)
+
+        assert task.hub.misses == {'getTaskInfo': 1, 'getChannel': 1, 'assert_allowed': 1}
+        assert task.hub.hits == {'getTaskInfo': 1, 'getChannel': 1, 'assert_allowed': 1}
+        assert task.hub.stats() == '3 hits, 3 misses'
+
+    def test_hub_calls_not_strict(self):
+        session = mock_multicall(flexmock())
+        session.should_receive('getBuild').and_raise(koji.GenericError('invalid nvr'))
+        session.should_receive('getPackageConfig').and_return({'blocked': False}).once()
+        hub = builder_containerbuild.HubCalls(session)
+
+        with hub.batch(strict=False) as batch:
+            batch.getPackageConfig('dest-tag', 'fedora-docker')
+            batch.getBuild('invalid')
+
+        assert hub.getPackageConfig('dest-tag', 'fedora-docker') == {'blocked': False}
+        with pytest.raises(koji.GenericError):
+            hub.getBuild('invalid')
+
     def _run_build_container_handler(
             self, tmpdir, pkg_info, task_opts,
             osbs_build_args=None,
@@ -638,6 +2030,12 @@ class TestBuilder(object):
             self._run_build_container_handler(
                 tmpdir, pkg_info, task_opts,
                 failure=failure)
+            # timings are reported also when the task fails before the build
+            with open(os.path.join('workdir', 'osbslogs', 'timings.json')) as f:
+                timings = json.load(f)
+            assert [phase['name'] for phase in timings['phases']] == [
+                'hub_prefetch', 'check_labels', 'scm_checkout', 'check_whitelist',
+            ]
         else:
             task_response = self._run_build_container_handler(
                 tmpdir, pkg_info, task_opts, koji_build_id=koji_build_id)
@@ -646,6 +2044,13 @@ class TestBuilder(object):
                 'repositories': ['unique-repo', 'primary-repo'],
                 'koji_builds': [str(koji_build_id)]
             }
+            with open(os.path.join('workdir', 'osbslogs', 'timings.json')) as f:
+                timings = json.load(f)
+            assert [phase['name'] for phase in timings['phases']] == [
+                'hub_prefetch', 'check_labels', 'scm_checkout', 'check_whitelist', 'osbs_init',
+                'osbs_create', 'log_follow', 'wait_for_build', 'collect_results', 'upload_logs',
+                'remove_build',
+            ]
 
     @pytest.mark.parametrize(('pkg_info', 'failure'), (
         (None, 'not in list for tag'),
@@ -736,13 +2141,13 @@ class TestBuilder(object):
                         koji_task_id=koji_task_id,
                         create_build_args={'git_branch': 'working'})
 
-        (flexmock(osbs.api.OSBS).should_receive('build_has_succeeded').and_return(False))
-        (flexmock(osbs.api.OSBS)
-            .should_receive('build_was_cancelled')
-            .and_return(reason == 'build_cancelled' or reason == 'signal_cancelled'))
-        (flexmock(osbs.api.OSBS)
-            .should_receive('build_not_finished')
-            .and_return(not build_finished))
+        if reason == 'build_cancelled' or reason == 'signal_cancelled':
+            pipeline_run = make_pipeline_run(reason='PipelineRunCancelled', status='False')
+        elif build_finished:
+            pipeline_run = make_pipeline_run(reason='Failed', status='False')
+        else:
+            pipeline_run = make_pipeline_run(reason='Running', status='Unknown')
+        (flexmock(osbs.api.OSBS).should_receive('get_build').and_return(pipeline_run))
 
         if reason == 'signal_cancelled':
             task._incremental_upload_logs = \
@@ -796,10 +2201,11 @@ class TestBuilder(object):
                         source=True,
                         create_build_args=create_args.copy())
 
-        (flexmock(osbs.api.OSBS).should_receive('build_has_succeeded').and_return(False))
-        (flexmock(osbs.api.OSBS)
-            .should_receive('build_was_cancelled')
-            .and_return(reason == 'build_cancelled' or reason == 'signal_cancelled'))
+        if reason == 'build_cancelled' or reason == 'signal_cancelled':
+            pipeline_run = make_pipeline_run(reason='PipelineRunCancelled', status='False')
+        else:
+            pipeline_run = make_pipeline_run(reason='Failed', status='False')
+        (flexmock(osbs.api.OSBS).should_receive('get_build').and_return(pipeline_run))
 
         if reason == 'signal_cancelled':
             task._incremental_upload_logs = \
@@ -816,14 +2222,25 @@ class TestBuilder(object):
     def test_get_build_target_failed(self, tmpdir):
         koji_task_id = 123
         last_event_id = 456
-        session = flexmock()
+        session = mock_multicall(flexmock())
         (session
             .should_receive('getLastEvent')
             .and_return({'id': last_event_id}))
+        (session
+            .should_receive('getTaskInfo')
+            .with_args(koji_task_id)
+            .and_return({'owner': 'owner', 'channel_id': 1}))
         (session
             .should_receive('getBuildTarget')
             .with_args('target', event=last_event_id)
             .and_return(None))
+        (session
+            .should_receive('getUser')
+            .with_args('owner')
+            .and_return({'name': 'owner-name'}))
+        (session
+            .should_receive('getChannel')
+            .and_return({'name': 'default_channel'}))
         src = self._mock_git_source()
         task = builder_containerbuild.BuildContainerTask(id=koji_task_id,
                                                          method='buildContainer',
@@ -871,14 +2288,26 @@ class TestBuilder(object):
     def test_get_build_target_failed_source(self, tmpdir):
         koji_task_id = 123
         last_event_id = 456
-        session = flexmock()
+        session = mock_multicall(flexmock())
         (session
             .should_receive('getLastEvent')
             .and_return({'id': last_event_id}))
+        (session
+            .should_receive('getTaskInfo')
+            .with_args(koji_task_id)
+            .and_return({'owner': 'owner', 'channel_id': 1}))
+        (session
+            .should_receive('getBuild')
+            .with_args(12345)
+            .and_return(None))
         (session
             .should_receive('getBuildTarget')
             .with_args('target', event=last_event_id)
             .and_return(None))
+        (session
+            .should_receive('getUser')
+            .with_args('owner')
+            .and_return({'name': 'owner-name'}))
         task = builder_containerbuild.BuildSourceContainerTask(id=koji_task_id,
                                                                method='buildSourceContainer',
                                                                params='params',
@@ -951,6 +2380,90 @@ class TestBuilder(object):
             .and_return(True))
         task.fetchDockerfile(source, 'build_tag', False)
 
+    @pytest.mark.parametrize('sparse_fails', [False, True])
+    def test_fetchDockerfile_sparse_checkout(self, tmpdir, sparse_fails):
+        koji_task_id = 123
+        options = mock_options_and_assert_allowed()
+        folders_info = self._mock_folders(str(tmpdir))
+        src = self._mock_git_source()
+        session = self._mock_session(456, koji_task_id)
+        task = builder_containerbuild.BuildContainerTask(id=koji_task_id,
+                                                         method='buildContainer',
+                                                         params='params',
+                                                         session=session,
+                                                         options=options,
+                                                         workdir=str(tmpdir))
+        task.opts = {}
+        flexmock(task).should_receive('getUploadDir').and_return(str(tmpdir))
+        flexmock(task).should_receive('run_callbacks')
+        flexmock(task).should_receive('sparse_checkout_enabled').and_return(True)
+
+        sources_dir = os.path.dirname(folders_info['dockerfile_path'])
+        sparse_checkout = (flexmock(builder_containerbuild.My_SCM)
+                           .should_receive('sparse_checkout')
+                           .with_args(str(tmpdir.join('sources-sparse')),
+                                      ('Dockerfile', 'additional-tags'),
+                                      session, str(tmpdir), object)
+                           .once())
+        if sparse_fails:
+            sparse_checkout.and_raise(koji.BuildError('fetch failed'))
+            (flexmock(koji.daemon.SCM)
+                .should_receive('checkout')
+                .and_return(sources_dir)
+                .once())
+        else:
+            sparse_checkout.and_return(sources_dir)
+            flexmock(koji.daemon.SCM).should_receive('checkout').never()
+
+        assert task.fetchDockerfile(src['src'], 'build_tag', False) == \
+            folders_info['dockerfile_path']
+        assert tmpdir.join('sources-sparse').check() != sparse_fails
+
+    @pytest.mark.parametrize('module', ['', 'docker'])
+    def test_sparse_checkout(self, tmpdir, module):
+        commands = []
+
+        def log_output(session, path, args, outfile, uploadpath, cwd=None, logerror=0,
+                       append=0):
+            commands.append((args, cwd))
+            return 0
+
+        flexmock(builder_containerbuild).should_receive('log_output').replace_with(log_output)
+        src = 'git://pkgs.example.com/rpms/fedora-docker.git'
+        if module:
+            src += '?' + module
+        scm = builder_containerbuild.My_SCM(src + '#origin/main')
+
+        sourcedir = scm.sparse_checkout(str(tmpdir), ('Dockerfile', 'additional-tags'),
+                                        'session', 'uploadpath', str(tmpdir.join('log')))
+
+        checkout_dir = str(tmpdir.join('fedora-docker'))
+        assert sourcedir == (os.path.join(checkout_dir, module) if module else checkout_dir)
+        assert commands == [
+            (['git', 'init', '-q', checkout_dir], str(tmpdir)),
+            (['git', 'remote', 'add', 'origin', 'git://pkgs.example.com/rpms/fedora-docker.git'],
+             checkout_dir),
+            (['git', 'config', 'core.sparseCheckout', 'true'], checkout_dir),
+            (['git', 'fetch', '-q', '--depth', '1', '--filter=blob:none', 'origin', 'main'],
+             checkout_dir),
+            (['git', 'checkout', '-q', 'FETCH_HEAD'], checkout_dir),
+        ]
+        module_path = '/%s/' % module if module else '/'
+        sparse_checkout_file = tmpdir.join('fedora-docker', '.git', 'info', 'sparse-checkout')
+        assert sparse_checkout_file.read() == '{0}Dockerfile\n{0}additional-tags\n'.format(
+            module_path)
+
+    def test_sparse_checkout_failed(self, tmpdir):
+        (flexmock(builder_containerbuild)
+            .should_receive('log_output')
+            .and_return(0)
+            .and_return(1))
+        scm = builder_containerbuild.My_SCM('git://pkgs.example.com/rpms/fedora-docker#main')
+        with pytest.raises(koji.BuildError) as exc:
+            scm.sparse_checkout(str(tmpdir), ('Dockerfile',), 'session', 'uploadpath',
+                                str(tmpdir.join('log')))
+        assert 'git remote add' in str(exc.value)
+
     @pytest.mark.parametrize('log_upload_raises', (True, False))
     @pytest.mark.parametrize('additional_args', (
         {'koji_parent_build': 'fedora-26-99'},
@@ -1497,6 +3010,31 @@ class TestBuilder(object):
         err_msg = 'is not of type {}'.format(expected_types_str)
         assert err_msg in str(exc_info.value)
 
+    @pytest.mark.parametrize('task_cls', [
+        builder_containerbuild.BuildContainerTask,
+        builder_containerbuild.BuildSourceContainerTask,
+    ])
+    def test_params_validator_created_once(self, task_cls):
+        if '_params_validator' in task_cls.__dict__:
+            del task_cls._params_validator
+        schemas = []
+        validator_for = jsonschema.validators.validator_for
+
+        def record_schema(schema, *args, **kwargs):
+            schemas.append(schema)
+            return validator_for(schema, *args, **kwargs)
+
+        # check_schema() looks up validators of meta schemas too
+        (flexmock(jsonschema.validators)
+            .should_receive('validator_for')
+            .replace_with(record_schema))
+
+        for _ in range(2):
+            with pytest.raises(jsonschema.ValidationError):
+                task_cls.validate_params([123])
+        assert [s for s in schemas if s is task_cls.PARAMS_SCHEMA] == [task_cls.PARAMS_SCHEMA]
+        assert task_cls._params_validator.schema is task_cls.PARAMS_SCHEMA
+
     @pytest.mark.parametrize('arg_name, arg_value, expected_types', [
         ('target', None, ['string']),
         ('target', 123, ['string']),